@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the lsmsd client against a local fake lsmsd.
+
+    python bench.py --items 20000 --latency 5
+
+Measures the select_all throughput, the bulk create/delete rate, the time
+to populate the item model and the memory per item. Pass --url to run
+the api benchmarks against a real lsmsd instead (this creates and deletes
+items!).
+"""
+
+import argparse
+import gc
+import logging
+import sys
+import time
+from hamster import records
+from hamster.fakelsmsd import FakeLsmsd, make_item
+from hamster.lsms import Lsms
+
+log = logging.getLogger(__name__)
+
+
+def timed(func, *args, **kwargs):
+    """ Returns (seconds, result) of calling func"""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def report(name, seconds, count, unit="items"):
+    print("%-28s %8.3fs %10.0f %s/s" % (name, seconds, count / seconds, unit))
+
+
+def bench_select_all(l):
+    seconds, things = timed(l.select_all, "items")
+    report("select_all", seconds, len(things))
+
+    seconds, count = timed(lambda: sum(1 for _ in l.iter_all("items")))
+    report("iter_all (streaming)", seconds, count)
+
+    start = time.time()
+    next(iter(l.iter_all("items")), None)
+    print("%-28s %8.3fs" % ("iter_all first item", time.time() - start))
+    return things
+
+
+def bench_bulk(l, count, workers):
+    datas = [make_item(0) for _ in range(count)]
+    seconds, results = timed(l.create_many, "items", datas, workers=workers)
+    report("create_many (%d workers)" % workers, seconds, count)
+
+    ids = [r.result for r in results if r.ok]
+    seconds, results = timed(l.delete_many, "items", ids, workers=workers)
+    report("delete_many (%d workers)" % workers, seconds, len(ids))
+
+
+def bench_memory(count):
+    try:
+        import tracemalloc
+    except ImportError:
+        print("memory per item: skipped (needs python 3)")
+        return
+
+    datas = [make_item(i) for i in range(count)]
+    for name, convert in (("dict", dict), ("Item record", records.Item.from_dict)):
+        gc.collect()
+        tracemalloc.start()
+        things = [convert(d) for d in datas]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%-28s %8.0f bytes (without values)" % (
+            "memory per %s" % name, float(size) / count))
+        del things
+
+
+def bench_model(things):
+    try:
+        from hamster.QtVariant import QtGui
+        from hamster.models import ItemModel
+    except ImportError as e:
+        print("model population: skipped (%s)" % e)
+        return
+
+    app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv)
+    model = ItemModel()
+    seconds, _ = timed(model.add_things, things)
+    report("ItemModel.add_things", seconds, len(things))
+
+    view = QtGui.QTreeView()
+    view.setModel(model)
+    seconds, _ = timed(app.processEvents)
+    print("%-28s %8.3fs" % ("view first paint", seconds))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10000,
+                        help="size of the fake inventory (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="fake request latency in ms (default: %(default)s)")
+    parser.add_argument("--bulk", type=int, default=1000,
+                        help="items created/deleted in bulk (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="parallel requests for bulk calls (default: %(default)s)")
+    parser.add_argument("--url", help="benchmark a real lsmsd instead")
+    parser.add_argument("--user", help="username for the real lsmsd")
+    parser.add_argument("--password", help="password for the real lsmsd")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = None
+    url = args.url
+    if not url:
+        server = FakeLsmsd(items=args.items, latency=args.latency / 1000.0)
+        url = server.start().url
+        print("fake lsmsd with %d items and %.1fms latency" % (
+            args.items, args.latency))
+
+    l = Lsms(url, args.user, args.password)
+    try:
+        things = bench_select_all(l)
+        bench_bulk(l, args.bulk, args.workers)
+        bench_memory(len(things) or args.items)
+        bench_model(things)
+    finally:
+        if server:
+            server.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
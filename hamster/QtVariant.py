@@ -1,6 +1,11 @@
+import hashlib
+import importlib
+import logging
 import sys
 import os
 
+log = logging.getLogger(__name__)
+
 default_variant = 'PySide'
 
 env_api = os.environ.get('QT_API', 'pyqt')
@@ -17,11 +22,15 @@ else:
 
 if variant == 'PySide':
     print("Using PySide")
-    from PySide import QtGui, QtCore, QtWebKit
+    from PySide import QtGui, QtCore
     # This will be passed on to new versions of matplotlib
     os.environ['QT_API'] = 'pyside'
 
-    def QtLoadUI(uifile, baseinstance=None, custom_widgets=None):
+    def QtCompileUI(uifile, pyfile):
+        from pysideuic import compileUi
+        compileUi(uifile, pyfile)
+
+    def QtLoadUIRuntime(uifile, baseinstance=None, custom_widgets=None):
         from PySide.QtUiTools import QUiLoader
         from PySide.QtCore import QMetaObject
 
@@ -68,13 +77,17 @@ elif variant == 'PyQt4':
     ]
     for cl in api2_classes:
         sip.setapi(cl, 2)
-    from PyQt4 import QtGui, QtCore, QtWebKit
+    from PyQt4 import QtGui, QtCore
     QtCore.Signal = QtCore.pyqtSignal
     QtCore.Slot = QtCore.pyqtSlot
     QtCore.QString = str
     os.environ['QT_API'] = 'pyqt'
 
-    def QtLoadUI(uifile, baseinstance=None):
+    def QtCompileUI(uifile, pyfile):
+        from PyQt4.uic import compileUi
+        compileUi(uifile, pyfile)
+
+    def QtLoadUIRuntime(uifile, baseinstance=None, custom_widgets=None):
         from PyQt4 import uic
         return uic.loadUi(uifile, baseinstance)
 else:
@@ -87,4 +100,92 @@ QtCore.QTextCodec.setCodecForTr(QtCore.QTextCodec.codecForName("UTF-8"))
 QtCore.QTextCodec.setCodecForLocale(QtCore.QTextCodec.codecForName("UTF-8"))
 QtCore.QTextCodec.setCodecForCStrings(QtCore.QTextCodec.codecForName("UTF-8"))
 
-__all__ = [QtGui, QtCore, QtLoadUI, QtWebKit, variant]
+
+def QtModule(name):
+    """ Imports a further Qt module (e.g. 'QtWebKit') of the used variant"""
+    return importlib.import_module("%s.%s" % (variant, name))
+
+
+#
+# .ui files are compiled to python once and cached until they change
+#
+ui_classes = {}
+
+
+def ui_cache_dir():
+    from hamster.cache import default_cache_dir
+    return os.path.join(default_cache_dir(), "ui")
+
+
+def QtCompiledUIClass(uifile):
+    """ Returns the form class compiled from uifile
+
+    The compiled python file is kept in the cache directory. Its name
+    contains a hash of the .ui file, so changed forms and forms of other
+    checkouts with the same name get their own file.
+    """
+    uifile = os.path.abspath(uifile)
+    cls = ui_classes.get(uifile)
+    if cls is not None:
+        return cls
+
+    cache_dir = ui_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    name = os.path.splitext(os.path.basename(uifile))[0]
+    with open(uifile, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    pyfile = os.path.join(cache_dir, "ui_%s_%s_%s.py" % (name, variant, digest))
+    if not os.path.exists(pyfile):
+        log.debug("Compiling %s to %s", uifile, pyfile)
+        # write to a temporary file, so other instances never read a
+        # half written form
+        tmpfile = "%s.%d" % (pyfile, os.getpid())
+        with open(tmpfile, "w") as f:
+            QtCompileUI(uifile, f)
+        os.rename(tmpfile, pyfile)
+
+    namespace = {'__name__': "ui_%s" % name}
+    with open(pyfile) as f:
+        exec(compile(f.read(), pyfile, "exec"), namespace)
+
+    cls = [v for k, v in namespace.items() if k.startswith("Ui_")][0]
+    ui_classes[uifile] = cls
+    return cls
+
+
+def QtLoadUI(uifile, baseinstance=None, custom_widgets=None):
+    """ Creates the widgets of uifile on baseinstance
+
+    The precompiled form is used if possible, otherwise the .ui file is
+    parsed at runtime.
+    """
+    if baseinstance is None or custom_widgets:
+        return QtLoadUIRuntime(uifile, baseinstance, custom_widgets)
+
+    try:
+        cls = QtCompiledUIClass(uifile)
+    except Exception as e:
+        log.debug("Can not compile %s, loading it at runtime: %s", uifile, e)
+        return QtLoadUIRuntime(uifile, baseinstance, custom_widgets)
+
+    ui = cls()
+    ui.setupUi(baseinstance)
+    for name, widget in vars(ui).items():
+        setattr(baseinstance, name, widget)
+    return baseinstance
+
+
+__all__ = [QtGui, QtCore, QtLoadUI, QtModule, variant]
+
+if __name__ == '__main__':
+    import glob
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    # precompile all forms, e.g. when installing on slow machines
+    for uifile in glob.glob(os.path.join(os.path.dirname(__file__), "*.ui")):
+        QtCompiledUIClass(uifile)
+
+    print("done")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+from hamster.QtVariant import QtCore
+
+log = logging.getLogger(__name__)
+
+# number of elements passed at once to the batch callback of stream
+STREAM_BATCH_SIZE = 500
+
+
+class LsmsCallSignals(QtCore.QObject):
+    """
+    Signals of a LsmsCall. They are emitted from the worker thread and
+    delivered to the receivers in the gui thread.
+    """
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(object)
+    batch = QtCore.Signal(object)
+
+
+class LsmsCall(QtCore.QRunnable):
+    """
+    Runnable which executes one blocking Lsms method in a worker thread
+    """
+
+    def __init__(self, func, args, kwargs, batch_size=None):
+        super(LsmsCall, self).__init__()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.batch_size = batch_size
+        self.signals = LsmsCallSignals()
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+            if self.batch_size:
+                result = self.emit_batches(result)
+        except Exception as e:
+            log.debug("Call %s failed: %s", self.func.__name__, e)
+            self.signals.failed.emit(e)
+            return
+
+        self.signals.finished.emit(result)
+
+    def emit_batches(self, iterable):
+        """ Emits the elements of iterable in lists and returns their number"""
+        count = 0
+        batch = []
+        for element in iterable:
+            batch.append(element)
+            if len(batch) >= self.batch_size:
+                self.signals.batch.emit(batch)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            self.signals.batch.emit(batch)
+            count += len(batch)
+        return count
+
+
+class AsyncLsms(object):
+    """
+    Non-blocking wrapper around a Lsms object.
+
+    Every Lsms method is available with the same arguments plus the
+    optional keyword arguments callback and errback. The call is executed
+    in a thread pool and the result (or the raised exception) is passed
+    to callback (or errback) in the gui thread.
+
+        async_lsms.select_all("items", callback=widget.add_things)
+
+    Methods returning a iterator (e.g. iter_all) can be run with stream,
+    which passes the elements in lists to the batch callback while the
+    iterator is running.
+    """
+
+    def __init__(self, lsms, max_threads=4):
+        self.lsms = lsms
+        self.pool = QtCore.QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        # keep running calls alive until their signals are delivered
+        self.calls = set()
+
+    def call(self, name, *args, **kwargs):
+        """ Schedules the Lsms method name and returns the LsmsCall"""
+        return self.run(getattr(self.lsms, name), *args, **kwargs)
+
+    def run(self, func, *args, **kwargs):
+        """ Schedules any blocking callable like a Lsms method
+
+        Accepts the same keyword arguments callback, errback, batch and
+        batch_size as the Lsms methods and returns the LsmsCall.
+        """
+        callback = kwargs.pop('callback', None)
+        errback = kwargs.pop('errback', None)
+        batch = kwargs.pop('batch', None)
+        batch_size = kwargs.pop('batch_size', None)
+
+        job = LsmsCall(func, args, kwargs, batch_size)
+        job.setAutoDelete(False)
+        self.calls.add(job)
+
+        if batch:
+            job.signals.batch.connect(batch)
+        if callback:
+            job.signals.finished.connect(callback)
+        if errback:
+            job.signals.failed.connect(errback)
+        else:
+            job.signals.failed.connect(
+                lambda e: log.error("Call %s failed: %s", func.__name__, e))
+        job.signals.finished.connect(lambda _: self.calls.discard(job))
+        job.signals.failed.connect(lambda _: self.calls.discard(job))
+
+        self.pool.start(job)
+        return job
+
+    def stream(self, name, *args, **kwargs):
+        """ Schedules the Lsms iterator method name
+
+        The optional keyword argument batch is called with lists of up to
+        batch_size elements, callback with the number of all elements.
+        """
+        kwargs.setdefault('batch_size', STREAM_BATCH_SIZE)
+        return self.call(name, *args, **kwargs)
+
+    def __getattr__(self, name):
+        lsms = self.__dict__.get('lsms')
+        if name.startswith('_') or not callable(getattr(lsms, name, None)):
+            raise AttributeError(name)
+
+        def schedule(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return schedule
+
+    def wait(self, msecs=-1):
+        """ Blocks until all scheduled calls are done"""
+        return self.pool.waitForDone(msecs)
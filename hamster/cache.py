@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from hamster.records import encode
+
+log = logging.getLogger(__name__)
+
+# fields which hold the id/name of a thing
+ID_FIELDS = {
+    'items': 'Id',
+    'users': 'Name',
+}
+
+
+def thing_id(thing, data):
+    """ Returns the id/name of the given thing data as string"""
+    return str(data[ID_FIELDS.get(thing, 'Id')])
+
+
+def default_cache_dir():
+    """ Returns the directory hamster stores its cache files in"""
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'hamster')
+
+
+class ItemCache(object):
+    """
+    Persistent on-disk cache of things fetched from one lsmsd instance.
+
+    Things are stored as json documents in a sqlite database. Things
+    which were changed through this client are marked as dirty and are
+    fetched again on the next sync.
+
+    The logs of things are stored entry by entry with their position in
+    the log, so they can be read page by page and only new entries have
+    to be added.
+    """
+
+    def __init__(self, path):
+        """ Opens (and creates if needed) the cache database at path"""
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS things ("
+                            "thing TEXT, id TEXT, data TEXT, "
+                            "dirty INTEGER DEFAULT 0, "
+                            "PRIMARY KEY (thing, id))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS syncs ("
+                            "thing TEXT PRIMARY KEY, synced REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS logs ("
+                            "thing TEXT, id TEXT, seq INTEGER, entry TEXT, "
+                            "PRIMARY KEY (thing, id, seq))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS log_syncs ("
+                            "thing TEXT, id TEXT, etag TEXT, "
+                            "PRIMARY KEY (thing, id))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS validators ("
+                            "thing TEXT PRIMARY KEY, data TEXT)")
+
+    @classmethod
+    def for_server(cls, base_url, cache_dir=None):
+        """ Returns the cache for the lsmsd instance at base_url"""
+        cache_dir = cache_dir or default_cache_dir()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        name = hashlib.sha1(base_url.rstrip('/').encode('utf-8')).hexdigest()
+        return cls(os.path.join(cache_dir, "%s.sqlite" % name[:16]))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def load(self, thing):
+        """ Returns a list with all cached things of the given type"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT data FROM things WHERE thing = ? AND data IS NOT NULL",
+                (thing,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def age(self, thing):
+        """ Returns the seconds since the last full sync or None"""
+        with self.lock:
+            row = self.db.execute("SELECT synced FROM syncs WHERE thing = ?",
+                                  (thing,)).fetchone()
+        if row is None:
+            return None
+        return time.time() - row[0]
+
+    def replace_all(self, thing, things):
+        """ Replaces all cached things of the given type"""
+        rows = [(thing, thing_id(thing, t), json.dumps(t, default=encode))
+                for t in things]
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM things WHERE thing = ?", (thing,))
+            self.db.executemany("INSERT INTO things (thing, id, data) "
+                                "VALUES (?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?)",
+                            (thing, time.time()))
+        log.debug("Cached %d %s", len(rows), thing)
+
+    def put(self, thing, data):
+        """ Stores the data of one thing and clears its dirty flag"""
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO things "
+                            "(thing, id, data, dirty) VALUES (?, ?, ?, 0)",
+                            (thing, thing_id(thing, data),
+                             json.dumps(data, default=encode)))
+
+    def remove(self, thing, _id):
+        """ Removes one thing and its log from the cache"""
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM things WHERE thing = ? AND id = ?",
+                            (thing, str(_id)))
+        self.clear_log(thing, _id)
+
+    def invalidate(self, thing, _id):
+        """ Marks one thing as changed, so it is fetched on the next sync"""
+        with self.lock, self.db:
+            cur = self.db.execute("UPDATE things SET dirty = 1 "
+                                  "WHERE thing = ? AND id = ?",
+                                  (thing, str(_id)))
+            if cur.rowcount == 0:
+                self.db.execute("INSERT INTO things (thing, id, data, dirty) "
+                                "VALUES (?, ?, NULL, 1)", (thing, str(_id)))
+
+    def dirty_ids(self, thing):
+        """ Returns the ids of all things marked as changed"""
+        with self.lock:
+            rows = self.db.execute("SELECT id FROM things "
+                                   "WHERE thing = ? AND dirty = 1",
+                                   (thing,)).fetchall()
+        return [row[0] for row in rows]
+
+    def load_validators(self, thing):
+        """ Returns the validators stored by save_validators or None"""
+        with self.lock:
+            row = self.db.execute("SELECT data FROM validators "
+                                  "WHERE thing = ?", (thing,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_validators(self, thing, validators):
+        """ Stores the validators of the last poll (see Lsms.poll_all)"""
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO validators VALUES (?, ?)",
+                            (thing, json.dumps(validators)))
+
+    def __log_length(self, thing, _id):
+        return self.db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM logs "
+                               "WHERE thing = ? AND id = ?",
+                               (thing, str(_id))).fetchone()[0]
+
+    def log_state(self, thing, _id):
+        """ Returns (number of entries, ETag) of the cached log of a thing"""
+        with self.lock:
+            length = self.__log_length(thing, _id)
+            row = self.db.execute(
+                "SELECT etag FROM log_syncs WHERE thing = ? AND id = ?",
+                (thing, str(_id))).fetchone()
+        return length, row[0] if row else None
+
+    def append_log(self, thing, _id, entries, etag=None, start=None):
+        """ Appends entries to the cached log of a thing
+
+        Args:
+            entries: The new entries, oldest first
+            etag: The ETag of the complete log (optional)
+            start: The position of the first entry in the log (default:
+                after the cached entries). Entries already cached at
+                their position are kept, so adding them twice is harmless.
+        """
+        with self.lock, self.db:
+            if start is None:
+                start = self.__log_length(thing, _id)
+            rows = [(thing, str(_id), start + n, json.dumps(e))
+                    for n, e in enumerate(entries)]
+            self.db.executemany("INSERT OR IGNORE INTO logs "
+                                "VALUES (?, ?, ?, ?)", rows)
+            if etag is not None:
+                self.db.execute("INSERT OR REPLACE INTO log_syncs "
+                                "VALUES (?, ?, ?)", (thing, str(_id), etag))
+
+    def load_log(self, thing, _id, before=None, after=None, limit=None):
+        """ Returns cached log entries of a thing, newest first
+
+        Args:
+            before: Only entries with a position lower than this
+            after: Only entries with a position higher than this
+            limit: The maximum number of entries
+
+        Returns:
+            A list of tuples (position, entry)
+        """
+        query = "SELECT seq, entry FROM logs WHERE thing = ? AND id = ?"
+        args = [thing, str(_id)]
+        if before is not None:
+            query += " AND seq < ?"
+            args.append(before)
+        if after is not None:
+            query += " AND seq > ?"
+            args.append(after)
+        query += " ORDER BY seq DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [(seq, json.loads(entry)) for seq, entry in rows]
+
+    def clear_log(self, thing, _id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM logs WHERE thing = ? AND id = ?",
+                            (thing, str(_id)))
+            self.db.execute("DELETE FROM log_syncs WHERE thing = ? AND id = ?",
+                            (thing, str(_id)))
+
+
+def test():
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "test.sqlite")
+    c = ItemCache(path)
+    c.replace_all("items", [{'Id': 1, 'Name': "Prusarotti"},
+                            {'Id': 2, 'Name': "Lasercutter"}])
+    log.info("Cached items: %s", c.load("items"))
+
+    c.invalidate("items", 2)
+    c.invalidate("items", 3)
+    log.info("Dirty items: %s", c.dirty_ids("items"))
+
+    c.put("items", {'Id': 3, 'Name': "Drehbank"})
+    c.remove("items", 1)
+    log.info("Cached items: %s (age %.3fs)", c.load("items"), c.age("items"))
+
+    c.append_log("items", 3, [{'Action': "create"}, {'Action': "update"}])
+    c.append_log("items", 3, [{'Action': "delete"}], etag='"3"')
+    log.info("Log state: %s, last page: %s", c.log_state("items", 3),
+             c.load_log("items", 3, before=3, limit=2))
+
+    c.save_validators("items", {'etag': '"7"', 'digest': None})
+    log.info("Validators: %s", c.load_validators("items"))
+    c.close()
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
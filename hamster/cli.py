@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Command line interface for scripting inventory tasks without a display.
+
+    python -m hamster.cli export -o items.jsonl
+    python -m hamster.cli import items.csv --user bernd
+    python -m hamster.cli diff items.jsonl
+
+This module must not import Qt.
+"""
+
+import argparse
+import contextlib
+import csv
+import getpass
+import json
+import logging
+import os
+import sys
+from hamster import records
+from hamster.cache import ID_FIELDS
+from hamster.lsms import BATCH_WORKERS, Lsms
+from hamster.throttle import RateLimiter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_URL = "http://localhost:8080/"
+
+FORMATS = ('jsonl', 'csv')
+
+
+def guess_format(path, default='jsonl'):
+    """ Returns the file format for the extension of path"""
+    ext = os.path.splitext(path or "")[1].lstrip('.').lower()
+    if ext == 'json':
+        return 'jsonl'
+    return ext if ext in FORMATS else default
+
+
+def csv_fields(thing):
+    cls = records.RECORD_TYPES.get(thing)
+    return cls.FIELDS if cls else (ID_FIELDS.get(thing, 'Id'),)
+
+
+def write_things(thing, things, f, fmt):
+    """ Writes things to the file f one by one and returns their number"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        fields = csv_fields(thing)
+        writer.writerow(fields)
+        for t in things:
+            row = []
+            for field in fields:
+                value = t.get(field)
+                if isinstance(value, list):
+                    value = " ".join(str(v) for v in value)
+                row.append("" if value is None else value)
+            writer.writerow(row)
+            count += 1
+    else:
+        for t in things:
+            f.write(json.dumps(t, default=records.encode, sort_keys=True))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def read_things(thing, f, fmt):
+    """ Yields the things in the file f as records"""
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            data = {}
+            for field, value in row.items():
+                if value == "":
+                    continue
+                if field == 'Contains':
+                    value = [int(v) for v in value.split()]
+                elif field == 'Id':
+                    value = int(value)
+                data[field] = value
+            yield records.from_dict(thing, data)
+    else:
+        for line in f:
+            if line.strip():
+                yield records.from_dict(thing, json.loads(line))
+
+
+@contextlib.contextmanager
+def open_file(path, mode):
+    """ Opens path, or stdin/stdout if it is '-' or not given"""
+    if not path or path == '-':
+        yield sys.stdout if 'w' in mode else sys.stdin
+    else:
+        with open(path, mode) as f:
+            yield f
+
+
+def export_things(l, args):
+    with open_file(args.output, 'w') as f:
+        count = write_things(args.thing, l.iter_all(args.thing), f,
+                             args.format or guess_format(args.output))
+    log.info("Exported %d %s", count, args.thing)
+    return 0
+
+
+def import_things(l, args):
+    id_field = ID_FIELDS.get(args.thing, 'Id')
+    existing = set()
+    if args.mode == 'auto':
+        existing = set(t[id_field] for t in l.iter_all(args.thing))
+
+    creates, updates = [], []
+    with open_file(args.file, 'r') as f:
+        for t in read_things(args.thing, f, args.format or guess_format(args.file)):
+            if args.mode == 'update' or t.get(id_field) in existing:
+                updates.append(t)
+            else:
+                if id_field == 'Id':
+                    t['Id'] = 0
+                creates.append(t)
+
+    report = (l.create_many(args.thing, creates, workers=args.workers) +
+              l.update_many(args.thing, updates, workers=args.workers))
+    failed = [r for r in report if not r.ok]
+    for r in failed:
+        log.error("%s: %s", r.arg.get(id_field), r.error)
+
+    log.info("Created %d, updated %d, failed %d %s", len(creates),
+             len(updates), len(failed), args.thing)
+    return 1 if failed else 0
+
+
+def diff_things(l, args):
+    """ Prints the differences between a file and the server
+
+    Lines start with + for things only in the file, - for things only on
+    the server and ~ for things with different fields.
+    """
+    id_field = ID_FIELDS.get(args.thing, 'Id')
+    server = dict((t[id_field], t) for t in l.iter_all(args.thing))
+
+    changes = 0
+    with open_file(args.file, 'r') as f:
+        for t in read_things(args.thing, f, args.format or guess_format(args.file)):
+            other = server.pop(t.get(id_field), None)
+            if other is None:
+                print("+ %s" % t.get(id_field))
+                changes += 1
+                continue
+
+            fields = [k for k in t.keys() if t.get(k) != other.get(k)]
+            if fields:
+                print("~ %s %s" % (t.get(id_field), " ".join(fields)))
+                changes += 1
+
+    for _id in sorted(server):
+        print("- %s" % _id)
+        changes += 1
+    return 1 if changes else 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="hamster.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get('HAMSTER_URL', DEFAULT_URL),
+                        help="url of the lsmsd instance (default: %(default)s)")
+    parser.add_argument("--user", help="username for changing things")
+    parser.add_argument("--thing", default="items",
+                        help="type of things (default: %(default)s)")
+    parser.add_argument("--format", choices=FORMATS,
+                        help="file format (default: from the file extension)")
+    parser.add_argument("--rate", type=float,
+                        help="limit the requests per second (default: no limit)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("export", help="write all things to a file")
+    p.add_argument("-o", "--output", help="output file (default: stdout)")
+    p.set_defaults(func=export_things)
+
+    p = sub.add_parser("import", help="create or update things from a file")
+    p.add_argument("file", help="input file ('-' for stdin)")
+    p.add_argument("--mode", choices=("auto", "create", "update"), default="auto",
+                   help="update the things already on the server (auto), "
+                        "create all things or update all things")
+    p.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                   help="parallel requests (default: %(default)s)")
+    p.set_defaults(func=import_things)
+
+    p = sub.add_parser("diff", help="compare a file with the server")
+    p.add_argument("file", help="input file ('-' for stdin)")
+    p.set_defaults(func=diff_things)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        stream=sys.stderr)
+
+    l = Lsms(args.url, limiter=RateLimiter(args.rate) if args.rate else None)
+    if args.user:
+        password = os.environ.get('HAMSTER_PASSWORD') or getpass.getpass()
+        l.set_credentials(args.user, password)
+
+    return args.func(l, args)
+
+if __name__ == '__main__':
+    sys.exit(main())
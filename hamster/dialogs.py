@@ -3,7 +3,8 @@
 
 import logging
 import os
-from hamster.QtVariant import QtGui, QtLoadUI
+from hamster.QtVariant import QtCore, QtGui, QtLoadUI
+from hamster.stats import PHASES
 
 log = logging.getLogger(__name__)
 
@@ -43,6 +44,61 @@ class NewUserDialog(QtGui.QDialog):
         return (u.strip(), m.strip(), p.strip(), result == QtGui.QDialog.Accepted)
 
 
+class StatsDialog(QtGui.QDialog):
+    """
+    Shows the request statistics of a Lsms object per endpoint and
+    refreshes them every second.
+    """
+    COLUMNS = (["Method", "Endpoint", "Calls", "Errors", "Connects"] +
+               ["Avg %s [ms]" % phase for phase in PHASES] +
+               ["Max [ms]", "Received [KiB]"])
+
+    def __init__(self, lsms, parent=None):
+        super(StatsDialog, self).__init__(parent)
+        self.lsms = lsms
+        self.setWindowTitle("Request Statistics")
+        self.resize(800, 300)
+
+        self.table = QtGui.QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.reset_button = QtGui.QPushButton("Reset", self)
+        self.copy_button = QtGui.QPushButton("Copy as Prometheus text", self)
+
+        buttons = QtGui.QHBoxLayout()
+        buttons.addWidget(self.reset_button)
+        buttons.addStretch()
+        buttons.addWidget(self.copy_button)
+        layout = QtGui.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+
+        self.reset_button.released.connect(self.reset)
+        self.copy_button.released.connect(self.copy)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        endpoints = self.lsms.stats.snapshot()
+        self.table.setRowCount(len(endpoints))
+        for row, s in enumerate(endpoints):
+            values = ([s.method.upper(), s.endpoint, s.calls, s.errors, s.connects] +
+                      ["%.1f" % (s.average(phase) * 1000) for phase in PHASES] +
+                      ["%.1f" % (s.max_total * 1000), "%.1f" % (s.received / 1024.0)])
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QtGui.QTableWidgetItem(str(value)))
+
+    def reset(self):
+        self.lsms.stats.reset()
+        self.refresh()
+
+    def copy(self):
+        QtGui.QApplication.clipboard().setText(self.lsms.stats.prometheus())
+
+
 def test():
     pass
 
@@ -52,10 +108,6 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    #import cProfile
-    #stats_file = "stats.prof"
-    #cProfile.run("test()", stats_file)
-
     test()
 
     print("done")
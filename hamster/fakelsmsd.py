@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in for lsmsd, used by the benchmarks and load tests.
+
+It implements the endpoints used by hamster.lsms.Lsms for items and users
+(list, select, log, create, update, delete) on in-memory data. Every
+request can be delayed to simulate a slow network or backend. GET
+responses are sent with an ETag and answered with 304 if they did not
+change.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+log = logging.getLogger(__name__)
+
+THINGS = ('items', 'users')
+
+
+def make_item(i, description_size=200):
+    """ Returns the data of a generated item"""
+    return {
+        'Id': i,
+        'Name': "Item %d" % i,
+        'Description': ("Description of item %d " % i).ljust(description_size, "x"),
+        'Contains': [],
+        'Owner': "user%d" % (i % 50),
+        'Maintainer': "user%d" % (i % 7),
+        'Usage': "See the [wiki](http://example.com/item/%d)" % i,
+    }
+
+
+class FakeLsmsdHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+    def send(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8') if status != 304 else b""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_cacheable(self, data):
+        """ Sends data with a ETag and answers 304 if it did not change"""
+        etag = '"%s"' % hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send(304, None, {'ETag': etag})
+        else:
+            self.send(200, data, {'ETag': etag})
+
+    def read_data(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        return json.loads(body.decode('utf-8'))
+
+    def route(self):
+        """ Returns (thing, id, rest) of the request path or None"""
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        if not parts or parts[0] not in THINGS:
+            self.send(404, "not found")
+            return None
+        return parts[0], (parts[1] if len(parts) > 1 else None), parts[2:]
+
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            return
+        thing, _id, rest = route
+        store = self.server.data[thing]
+
+        if _id is None:
+            with self.server.lock:
+                etag = '"%s-%d"' % (thing, self.server.version)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send(304, None, {'ETag': etag})
+                else:
+                    self.send(200, list(store.values()), {'ETag': etag})
+        elif _id not in store:
+            self.send(404, "not found")
+        elif rest == ['log']:
+            self.send_cacheable(self.server.logs.get((thing, _id), []))
+        else:
+            self.send_cacheable(store[_id])
+
+    def do_POST(self):
+        route = self.route()
+        if route is None:
+            return
+        thing = route[0]
+        data = self.read_data()
+
+        with self.server.lock:
+            if thing == 'items':
+                self.server.next_id += 1
+                data['Id'] = self.server.next_id
+            _id = str(data.get('Id', data.get('Name')))
+            if _id in self.server.data[thing]:
+                return self.send(403, "already exists")
+            self.server.store(thing, _id, data, "create")
+
+        self.send(200, "/%s/%s" % (thing, _id))
+
+    def do_PUT(self):
+        route = self.route()
+        if route is None:
+            return
+        thing = route[0]
+        data = self.read_data()
+
+        _id = str(data.get('Id', data.get('Name')))
+        with self.server.lock:
+            if _id not in self.server.data[thing]:
+                return self.send(404, "not found")
+            self.server.store(thing, _id, data, "update")
+        self.send(200, True)
+
+    def do_DELETE(self):
+        route = self.route()
+        if route is None:
+            return
+        thing, _id, rest = route
+
+        with self.server.lock:
+            if self.server.data[thing].pop(_id, None) is None:
+                return self.send(404, "not found")
+            self.server.version += 1
+            self.server.add_log(thing, _id, "delete")
+        self.send(200, True)
+
+
+class FakeLsmsd(ThreadingMixIn, HTTPServer):
+    """
+    Fake lsmsd server running in a background thread.
+
+        server = FakeLsmsd(items=10000, latency=0.01)
+        server.start()
+        l = Lsms(server.url)
+    """
+    daemon_threads = True
+    # enough for load tests with hundreds of clients connecting at once
+    request_queue_size = 256
+
+    def __init__(self, items=0, latency=0.0, port=0, description_size=200):
+        """ Creates the server
+
+        Args:
+            items: The number of generated items
+            latency: Seconds every request is delayed
+            port: The port to listen on (0 picks a free port)
+            description_size: The length of the generated descriptions
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeLsmsdHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.data = dict((thing, {}) for thing in THINGS)
+        self.logs = {}
+        self.next_id = 0
+        # changed on every write, used as ETag of the lists
+        self.version = 0
+        self.thread = None
+
+        for i in range(1, items + 1):
+            self.data['items'][str(i)] = make_item(i, description_size)
+        self.next_id = items
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % self.server_address
+
+    def add_log(self, thing, _id, action, data=None):
+        entry = {'Action': action, 'Time': time.time()}
+        if data is not None:
+            entry['Data'] = data
+        self.logs.setdefault((thing, _id), []).append(entry)
+
+    def store(self, thing, _id, data, action):
+        self.data[thing][_id] = data
+        self.version += 1
+        self.add_log(thing, _id, action, data)
+
+    def handle_error(self, request, client_address):
+        # clients closing streamed responses early are expected
+        log.debug("Error while handling request from %s", client_address,
+                  exc_info=True)
+
+    def start(self):
+        """ Serves requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def test():
+    from hamster.lsms import Lsms
+
+    server = FakeLsmsd(items=100).start()
+    l = Lsms(server.url)
+    log.info("Items: %d", len(l.select_all("items")))
+
+    thing_id = l.create_thing("items", {'Id': 0, 'Name': "Prusarotti"})
+    l.update_thing("items", {'Id': int(thing_id), 'Name': "Prusarotti 2"})
+    log.info("Log: %s", l.select_thing_log("items", thing_id))
+    l.delete_thing("items", thing_id)
+
+    log.info("Requests: %d", server.requests)
+    server.stop()
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.INFO)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
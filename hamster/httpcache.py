@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+from hamster.cache import default_cache_dir
+
+log = logging.getLogger(__name__)
+
+# bounds of the in-memory tier
+MAX_ENTRIES = 1000
+MAX_BYTES = 16 * 1024 * 1024
+# bound of the on-disk tier
+MAX_DISK_ENTRIES = 20000
+# responses stored between two prunes of the on-disk tier
+PRUNE_INTERVAL = 500
+
+
+def parse_cache_control(header):
+    """ Returns a dict with the directives of a Cache-Control header
+
+    Directives without a value are mapped to True.
+    """
+    directives = {}
+    for part in (header or "").split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') if value else True
+    return directives
+
+
+def expiry(headers, now=None, default_ttl=0):
+    """ Returns the time until a response with headers is fresh
+
+    Responses without Cache-Control or Expires are fresh for default_ttl
+    seconds.
+
+    Returns:
+        A unix timestamp (0 if the response must be revalidated every
+        time) or None if the response must not be stored
+    """
+    now = now or time.time()
+    cc = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cc:
+        return None
+    if 'no-cache' in cc:
+        return 0
+    if 'max-age' in cc:
+        try:
+            return now + int(cc['max-age'])
+        except ValueError:
+            return 0
+
+    expires = headers.get('Expires')
+    parsed = parsedate_tz(expires) if expires else None
+    if parsed:
+        return mktime_tz(parsed)
+    return now + default_ttl if default_ttl else 0
+
+
+class CachedResponse(object):
+    """
+    A stored GET response.
+
+    The following member variables are available
+    r.text           the body
+    r.etag           the ETag header or None
+    r.last_modified  the Last-Modified header or None
+    r.expires        unix timestamp until the response is fresh
+    """
+    __slots__ = ('text', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, text, etag=None, last_modified=None, expires=0):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def fresh(self):
+        return time.time() < self.expires
+
+    def validators(self):
+        """ Returns the headers to revalidate the response"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def __repr__(self):
+        return "<CachedResponse %d bytes etag=%s expires=%.0f>" % (
+            len(self.text), self.etag, self.expires)
+
+
+class HttpCache(object):
+    """
+    Cache for GET responses of the lsmsd api honoring Cache-Control,
+    Expires, ETag and Last-Modified.
+
+    Responses are kept in a bounded LRU in memory and optionally in a
+    sqlite database, which is used when a response is not in memory
+    (e.g. after a restart). The database is pruned to max_disk_entries
+    every PRUNE_INTERVAL stored responses. Fresh responses are used without a request,
+    stale ones are revalidated with a conditional request.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES,
+                 max_bytes=MAX_BYTES, max_disk_entries=MAX_DISK_ENTRIES,
+                 default_ttl=0):
+        """ Creates a cache
+
+        Args:
+            path: The path of the sqlite database of the disk tier
+                (optional, responses are only kept in memory without it)
+            max_entries: The number of responses kept in memory
+            max_bytes: The size of the response bodies kept in memory
+            max_disk_entries: The number of responses kept on disk
+            default_ttl: Seconds responses without Cache-Control or
+                Expires header are used without revalidation (e.g. so
+                prefetched responses are used right away)
+        """
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.size = 0
+        self.stored = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                "url TEXT PRIMARY KEY, text TEXT, etag TEXT, "
+                                "last_modified TEXT, expires REAL, "
+                                "stored REAL)")
+
+    @classmethod
+    def for_server(cls, base_url, cache_dir=None, **kwargs):
+        """ Returns the cache with a disk tier for the lsmsd at base_url"""
+        cache_dir = cache_dir or default_cache_dir()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        name = hashlib.sha1(base_url.rstrip('/').encode('utf-8')).hexdigest()
+        return cls(os.path.join(cache_dir, "%s.http.sqlite" % name[:16]),
+                   **kwargs)
+
+    def __remember(self, url, response):
+        """ Puts response into the memory tier and evicts old ones"""
+        old = self.memory.pop(url, None)
+        if old is not None:
+            self.size -= len(old.text)
+        self.memory[url] = response
+        self.size += len(response.text)
+
+        while self.memory and (len(self.memory) > self.max_entries or
+                               self.size > self.max_bytes):
+            _, evicted = self.memory.popitem(last=False)
+            self.size -= len(evicted.text)
+
+    def get(self, url):
+        """ Returns the CachedResponse for url or None"""
+        with self.lock:
+            response = self.memory.pop(url, None)
+            if response is not None:
+                # most recently used entries are at the end
+                self.memory[url] = response
+                return response
+            if self.db is None:
+                return None
+
+            row = self.db.execute("SELECT text, etag, last_modified, expires "
+                                  "FROM responses WHERE url = ?",
+                                  (url,)).fetchone()
+            if row is None:
+                return None
+            response = CachedResponse(*row)
+            self.__remember(url, response)
+            return response
+
+    def store(self, url, text, headers):
+        """ Stores a 200 response if its headers allow it
+
+        Returns:
+            The CachedResponse or None if it was not stored
+        """
+        expires = expiry(headers, default_ttl=self.default_ttl)
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        # responses which can neither be reused nor revalidated are useless
+        if expires is None or (not expires and not etag and not last_modified):
+            self.invalidate(url)
+            return None
+
+        response = CachedResponse(text, etag, last_modified, expires)
+        prune = False
+        with self.lock:
+            self.__remember(url, response)
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("INSERT OR REPLACE INTO responses "
+                                    "VALUES (?, ?, ?, ?, ?, ?)",
+                                    (url, text, etag, last_modified, expires,
+                                     time.time()))
+                self.stored += 1
+                prune = self.stored % PRUNE_INTERVAL == 0
+        if prune:
+            self.prune()
+        return response
+
+    def revalidated(self, url, response, headers):
+        """ Updates the freshness of response after a 304 for url"""
+        expires = expiry(headers, default_ttl=self.default_ttl)
+        if expires is None:
+            self.invalidate(url)
+            return response
+
+        response.expires = expires
+        response.etag = headers.get('ETag') or response.etag
+        with self.lock:
+            self.__remember(url, response)
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("UPDATE responses SET etag = ?, "
+                                    "expires = ?, stored = ? WHERE url = ?",
+                                    (response.etag, expires, time.time(), url))
+        return response
+
+    def invalidate(self, url):
+        """ Drops the response for url"""
+        with self.lock:
+            response = self.memory.pop(url, None)
+            if response is not None:
+                self.size -= len(response.text)
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM responses WHERE url = ?",
+                                    (url,))
+
+    def prune(self):
+        """ Drops the oldest responses exceeding the disk bound"""
+        if self.db is None:
+            return
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM responses WHERE url NOT IN ("
+                            "SELECT url FROM responses ORDER BY stored DESC "
+                            "LIMIT ?)", (self.max_disk_entries,))
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.size = 0
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM responses")
+
+    def close(self):
+        self.prune()
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+def test():
+    import tempfile
+
+    cache = HttpCache(os.path.join(tempfile.mkdtemp(), "test.http.sqlite"),
+                      max_entries=2)
+    for i in range(3):
+        cache.store("items/%d" % i, '{"Id": %d}' % i, {'ETag': '"%d"' % i})
+    cache.store("items/9", '{"Id": 9}', {'Cache-Control': 'max-age=60'})
+    cache.store("items/10", '{"Id": 10}', {'Cache-Control': 'no-store'})
+
+    log.info("In memory: %s", list(cache.memory.keys()))
+    log.info("items/0 from disk: %r", cache.get("items/0"))
+    log.info("items/9 fresh: %s", cache.get("items/9").fresh())
+    log.info("items/10: %r", cache.get("items/10"))
+    cache.close()
+
+    cache = HttpCache(os.path.join(tempfile.mkdtemp(), "test.http.sqlite"),
+                      max_disk_entries=10)
+    for i in range(PRUNE_INTERVAL):
+        cache.store("items/%d" % i, '{"Id": %d}' % i, {'ETag': '"%d"' % i})
+    rows = cache.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    log.info("On disk after %d stores: %d", PRUNE_INTERVAL, rows)
+    assert rows <= cache.max_disk_entries
+    cache.close()
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
@@ -4,28 +4,44 @@
 import logging
 import os
 from hamster.QtVariant import QtCore, QtGui, QtLoadUI
+from hamster.livefeed import Delta
+from hamster.models import ItemFilterProxyModel, ItemModel, LogModel
+from hamster.multi import SOURCE_FIELD, split_id
+from hamster.records import Item
+from hamster.search import tokenize
 
 log = logging.getLogger(__name__)
 logging.getLogger('PyQt4').setLevel(logging.WARNING)
 
+# rows above and below the selection which are prefetched
+PREFETCH_NEIGHBOURS = 5
+# children of a expanded item which are prefetched
+PREFETCH_CHILDREN = 10
+
 
 class ItemsWidget(QtGui.QWidget):
 
     def __init__(self, things, parent=None):
         super(ItemsWidget, self).__init__(parent)
 
+        self.filter_line_edit = QtGui.QLineEdit(self)
         self.item_tree_view = ItemTreeView(self)
         self.add_item_button = QtGui.QPushButton("New Item", self)
+        self.labels_button = QtGui.QPushButton("Labels", self)
         self.item_prop_widget = ItemPropertiesWidget(None, self)
 
         self.__setup_ui()
-        self.__initialize_item_view(things)
+        self.add_things(things)
 
     def __setup_ui(self):
         vert_widget = QtGui.QWidget(self)
         vert = QtGui.QVBoxLayout(vert_widget)
+        vert.addWidget(self.filter_line_edit)
         vert.addWidget(self.item_tree_view)
-        vert.addWidget(self.add_item_button)
+        buttons = QtGui.QHBoxLayout()
+        buttons.addWidget(self.add_item_button)
+        buttons.addWidget(self.labels_button)
+        vert.addLayout(buttons)
 
         hori_widget = QtGui.QSplitter(QtCore.Qt.Horizontal, self)
         hori_widget.addWidget(vert_widget)
@@ -34,74 +50,285 @@ class ItemsWidget(QtGui.QWidget):
         hori = QtGui.QHBoxLayout(self)
         hori.addWidget(hori_widget)
 
+        self.filter_line_edit.setPlaceholderText("Filter items")
+        self.filter_line_edit.textChanged.connect(self.filter_changed)
         self.add_item_button.released.connect(self.item_added)
+        self.labels_button.released.connect(self.labels_requested)
+
+    def add_things(self, things):
+        self.item_tree_view.model.add_things(things)
+
+    def clear(self):
+        """ Removes all items, e.g. before loading them from another server"""
+        self.item_prop_widget.record = None
+        self.item_prop_widget.set_history(None)
+        self.item_tree_view.model.clear()
+
+    def set_users(self, directory):
+        self.item_prop_widget.set_users(directory)
 
-    def __initialize_item_view(self, things):
-        for thing in things:
-            item = QtGui.QStandardItem(thing['Name'])
-            item.setData(thing)
-            self.item_tree_view.model.appendRow(item)
+    def things(self):
+        """ Returns all loaded item records"""
+        return list(self.item_tree_view.model.store.things.values())
+
+    def filter_changed(self, text):
+        self.item_tree_view.proxy.set_query(text)
 
     def item_dropEvent(self, event):
-        log.error("TODO: Implement item_dropEvent")
+        """ Moves the dragged item into the item it was dropped on"""
+        view = self.item_tree_view
+        # the rows are moved by the model, not by the view
+        event.setDropAction(QtCore.Qt.IgnoreAction)
+        event.accept()
+
+        source = view.currentIndex()
+        if not source.isValid():
+            return
 
-    def item_added(self):
-        thing_id = self.parent().create_thing({'Id': 0, "Name": "New thing"})
-        if not thing_id:
+        target = view.indexAt(event.pos())
+        position = view.dropIndicatorPosition()
+        if position in (view.AboveItem, view.BelowItem):
+            target = target.parent()
+        elif position != view.OnItem:
+            target = QtCore.QModelIndex()
+
+        parent_id = self.proxy_thing_id(target) if target.isValid() else None
+        self.move_item(self.proxy_thing_id(source), parent_id)
+
+    def move_item(self, _id, parent_id):
+        """ Moves a item into another item (or to the root for None)
+
+        Only the Contains of the old and the new container are saved, the
+        contents of the moved item stay unchanged. Items can not be moved
+        between lsmsd instances (see hamster.multi).
+        """
+        model = self.item_tree_view.model
+        store = model.store
+        old_parent_id = store.parents.get(_id)
+        if old_parent_id == parent_id:
+            return
+        if parent_id is not None and store.is_ancestor(_id, parent_id):
+            log.warning("Item %s can not be moved into %s", _id, parent_id)
+            return
+        if (parent_id is not None and store.things[_id].get('Source') !=
+                store.things[parent_id].get('Source')):
+            log.warning("Item %s is stored on another server than %s",
+                        _id, parent_id)
+            return
+
+        changed = []
+        if old_parent_id in store.things:
+            old_parent = store.things[old_parent_id]
+            old_parent.track()
+            old_parent['Contains'] = [c for c in old_parent['Contains']
+                                      if c != _id]
+            changed.append(old_parent)
+        if parent_id is not None:
+            parent = store.things[parent_id]
+            parent.track()
+            parent['Contains'] = (parent.get('Contains') or []) + [_id]
+            changed.append(parent)
+
+        model.move_thing(_id, parent_id)
+        for thing in changed:
+            self.save_thing(thing)
+
+    def label_things(self):
+        """ Returns the items to print labels for
+
+        These are the selected item and its contents, else the items
+        matching the filter, else all items. Things of a MultiLsms get
+        the id they have on their site, the one lsmsd knows.
+        """
+        view = self.item_tree_view
+        store = view.model.store
+        indexes = view.selectionModel().selectedIndexes()
+        query = self.filter_line_edit.text()
+        if indexes:
+            ids = store.descendants(self.proxy_thing_id(indexes[0]))
+        elif tokenize(query):
+            ids = sorted(store.index.search(query))
+        else:
+            ids = sorted(store.things)
+        things = []
+        for _id in ids:
+            thing = store.things[_id]
+            if thing.get(SOURCE_FIELD):
+                thing = {'Id': split_id(_id)[0], 'Name': thing.get('Name')}
+            things.append(thing)
+        return things
+
+    def labels_requested(self):
+        things = self.label_things()
+        if not things:
             return
 
-        item = QtGui.QStandardItem("New thing")
-        item.setData({'Id': thing_id, "Name": "New thing"})
-        self.item_tree_view.model.appendRow(item)
+        path = QtGui.QFileDialog.getSaveFileName(
+            self, "Labels for %d items" % len(things), "labels.pdf",
+            "PDF (*.pdf);;PNG sheets (*.png)")
+        # PySide returns a tuple (path, filter)
+        if isinstance(path, tuple):
+            path = path[0]
+        if path:
+            self.parent().export_labels(things, path)
+
+    def item_added(self):
+        self.parent().create_thing({'Id': 0, "Name": "New thing"},
+                                   self.item_created)
+
+    def item_created(self, thing_id):
+        self.add_things([Item(Id=thing_id, Name="New thing")])
 
     def item_deleted(self):
-        log.error("TODO: Implement item_deleted")
+        thing = self.item_prop_widget.record
+        if thing is None:
+            return
 
-    def item_changed(self, item):
-        log.error("TODO: Implement item_changed")
-        item_data = item.data()
-        log.info(item_data)
+        answer = QtGui.QMessageBox.question(
+            self, "Delete item", "Delete '%s'?" % thing['Name'],
+            QtGui.QMessageBox.Yes | QtGui.QMessageBox.No)
+        if answer != QtGui.QMessageBox.Yes:
+            return
+
+        self.item_prop_widget.record = None
+        self.item_tree_view.model.remove_thing(thing['Id'])
+        self.parent().delete_thing(thing['Id'])
+
+    def apply_operations(self, operations):
+        """ Shows journaled operations which are not sent to lsmsd yet"""
+        model = self.item_tree_view.model
+        for o in operations:
+            if o.thing != 'items':
+                continue
+            if o.op == 'delete':
+                model.remove_thing(o.id)
+            else:
+                model.update_thing(Item.from_dict(o.data))
+
+    def apply_changes(self, delta):
+        """ Shows the items changed by other clients (see ChangeFeed)"""
+        model = self.item_tree_view.model
+        prop_widget = self.item_prop_widget
+        shown = prop_widget.record
+
+        for _id in delta.removed:
+            if shown is not None and shown['Id'] == _id:
+                prop_widget.record = None
+            model.remove_thing(_id)
+
+        for thing in delta.added + delta.changed:
+            if shown is not None and shown['Id'] == thing['Id']:
+                if prop_widget.edit_state:
+                    log.info("Item %s changed while editing", thing['Id'])
+                    continue
+                model.update_thing(thing)
+                prop_widget.set_data(shown)
+            else:
+                model.update_thing(thing)
+
+    def ids_replaced(self, id_map):
+        """ Replaces the temporary ids of items created while offline"""
+        for temp_id, _id in id_map.items():
+            self.item_tree_view.model.replace_id(temp_id, _id)
+
+    def item_changed(self, thing):
+        prop_widget = self.item_prop_widget
+        if prop_widget.record is thing:
+            prop_widget.name_lineEdit.setText(thing['Name'])
+            # the name is saved together with the other properties
+            if prop_widget.edit_state:
+                return
+
+        self.save_thing(thing)
 
     def item_saved(self):
-        log.error("TODO: Implement item_saved")
-        #index = self.item_tree_view.currentIndex()
-        #item = self.item_tree_view.model.itemFromIndex(index)
-        #item_data = item.data()
+        thing = self.item_prop_widget.get_data()
+        if thing is not None:
+            self.save_thing(thing)
 
-        self.item_prop_widget.get_data()
+    def save_thing(self, thing):
+        self.item_tree_view.model.thing_updated(thing)
+        self.parent().save_thing(thing)
 
     def selection_changed(self, current, previous):
         if not current.indexes():
             return
 
-        index = current.indexes()[0]
+        index = self.item_tree_view.proxy.mapToSource(current.indexes()[0])
         if not index.isValid():
             return
 
-        item = self.item_tree_view.model.itemFromIndex(index)
-        item_data = item.data()
+        item_data = self.item_tree_view.model.thing(index)
         self.item_prop_widget.set_data(item_data)
+        self.show_history(item_data['Id'])
+        # usually answered from the http cache or with a 304
+        self.parent().refresh_thing(item_data['Id'], self.thing_refreshed)
+        self.prefetch_around(current.indexes()[0])
+
+    def show_history(self, _id):
+        """ Shows the cached log of a item and fetches the new entries"""
+        main = self.parent()
+        if main.lsms.cache is None or main.pending_create(_id):
+            self.item_prop_widget.set_history(None)
+            return
+
+        model = LogModel(main.lsms, "items", _id, self)
+        self.item_prop_widget.set_history(model)
+
+        def synced(count):
+            # the selection may have changed in the meantime
+            if count and self.item_prop_widget.history_model is model:
+                model.refresh()
+        main.sync_history(_id, synced)
+
+    def proxy_thing_id(self, proxy_index):
+        """ Returns the id of the item at a index of the tree view"""
+        view = self.item_tree_view
+        return view.model.thing(view.proxy.mapToSource(proxy_index))['Id']
+
+    def prefetch_around(self, proxy_index):
+        """ Prefetches the rows shown above and below proxy_index"""
+        view = self.item_tree_view
+        ids = []
+        above = below = proxy_index
+        for _ in range(PREFETCH_NEIGHBOURS):
+            below = view.indexBelow(below)
+            above = view.indexAbove(above)
+            ids += [self.proxy_thing_id(i) for i in (below, above)
+                    if i.isValid()]
+        self.parent().prefetch(ids)
+
+    def item_expanded(self, proxy_index):
+        proxy = self.item_tree_view.proxy
+        rows = min(proxy.rowCount(proxy_index), PREFETCH_CHILDREN)
+        self.parent().prefetch([
+            self.proxy_thing_id(proxy.index(row, 0, proxy_index))
+            for row in range(rows)])
+
+    def thing_refreshed(self, thing):
+        self.apply_changes(Delta(changed=[thing]))
 
 
 class ItemTreeView(QtGui.QTreeView):
 
     def __init__(self, parent):
         super(ItemTreeView, self).__init__(parent)
-        self.model = QtGui.QStandardItemModel(self)
-        self.model.setHorizontalHeaderLabels(["Items"])
-        self.setModel(self.model)
+        self.model = ItemModel(self)
+        self.proxy = ItemFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.setModel(self.proxy)
 
         self.setSelectionMode(QtGui.QTreeView.SingleSelection)
         self.setDragDropMode(QtGui.QAbstractItemView.InternalMove)
         self.setAcceptDrops(True)
         self.setAnimated(True)
 
-        self.model.itemChanged.connect(self.parent().item_changed)
+        self.model.thingChanged.connect(self.parent().item_changed)
         self.selectionModel().selectionChanged.connect(self.parent().selection_changed)
+        self.expanded.connect(self.parent().item_expanded)
 
     def dropEvent(self, event):
         self.parent().item_dropEvent(event)
-        super(ItemTreeView, self).dropEvent(event)
 
 
 class ItemPropertiesWidget(QtGui.QWidget):
@@ -109,6 +336,9 @@ class ItemPropertiesWidget(QtGui.QWidget):
     def __init__(self, data, parent):
         super(ItemPropertiesWidget, self).__init__(parent)
         self.edit_state = False
+        self.record = None
+        self.history_model = None
+        self.users = None
 
         self.__setup_ui(data)
 
@@ -116,18 +346,37 @@ class ItemPropertiesWidget(QtGui.QWidget):
             [self.name_lineEdit, lambda w: w.setReadOnly],
             [self.description_textEdit, lambda w: w.setReadOnly],
             [self.usage_lineEdit, lambda w: w.setReadOnly],
-            [self.owner_comboBox, lambda w: w.setEditable],
-            [self.maintainer_comboBox, lambda w: w.setEditable],
+            [self.owner_comboBox, lambda w: w.lineEdit().setReadOnly],
+            [self.maintainer_comboBox, lambda w: w.lineEdit().setReadOnly],
         ]
         self.input_dict = {
             "Name": self.name_lineEdit.setText,
-            "Description": self.description_textEdit.setText
+            "Description": self.description_textEdit.setPlainText,
+            "Usage": self.usage_lineEdit.setText,
+            "Owner": self.owner_comboBox.setEditText,
+            "Maintainer": self.maintainer_comboBox.setEditText,
+        }
+        self.output_dict = {
+            "Name": self.name_lineEdit.text,
+            "Description": self.description_textEdit.toPlainText,
+            "Usage": self.usage_lineEdit.text,
+            "Owner": self.owner_comboBox.currentText,
+            "Maintainer": self.maintainer_comboBox.currentText,
+        }
+        self.user_combos = {
+            "Owner": self.owner_comboBox,
+            "Maintainer": self.maintainer_comboBox,
         }
 
     def __setup_ui(self, data):
         QtLoadUI(os.path.join("hamster", "ItemPropertiesWidget.ui"), self)
 
         self.save_button.setHidden(True)
+        self.history_tableView.horizontalHeader().setStretchLastSection(True)
+        self.history_tableView.verticalHeader().setVisible(False)
+
+        for combo in (self.owner_comboBox, self.maintainer_comboBox):
+            self.__setup_user_combo(combo)
 
         self.edit_button.released.connect(self.edit_properties)
         self.delete_button.released.connect(self.delete_item)
@@ -137,15 +386,63 @@ class ItemPropertiesWidget(QtGui.QWidget):
             log.error("TODO: Implement data fill for input widgets on creation")
             self.set_data(data)
 
+    def __setup_user_combo(self, combo):
+        """ Completes the user names typed into combo (see set_users)"""
+        combo.setEditable(True)
+        combo.lineEdit().setReadOnly(True)
+
+        completer = QtGui.QCompleter(combo)
+        completer.setModel(QtGui.QStringListModel(completer))
+        completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        # the names are already filtered by the UserDirectory
+        completer.setCompletionMode(QtGui.QCompleter.UnfilteredPopupCompletion)
+        combo.setCompleter(completer)
+        combo.lineEdit().textEdited.connect(
+            lambda text: self.complete_user(completer, text))
+
+    def set_users(self, directory):
+        """ Sets the UserDirectory used to complete owners and maintainers"""
+        self.users = directory
+
+    def complete_user(self, completer, text):
+        if self.users is None or not text:
+            return
+        completer.model().setStringList(self.users.complete(text))
+        completer.complete()
+
     def set_data(self, data):
-        for key, value in data.iteritems():
-            f = self.input_dict.get(key, None)
-            if f:
-                log.debug("Set value for %s: %s", key, value)
-                f(value)
+        # track the changes from now on to only send them on save
+        data.track()
+        self.record = data
+
+        for key, f in self.input_dict.items():
+            value = data.get(key) or ""
+            log.debug("Set value for %s: %s", key, value)
+            f(value)
+
+        # resolved from the local directory, without calling the api
+        for key, combo in self.user_combos.items():
+            user = self.users.get(data.get(key)) if self.users else None
+            combo.setToolTip((user.get('EMail') or "") if user else "")
+
+    def set_history(self, model):
+        """ Shows the LogModel of the shown item (or nothing for None)"""
+        old = self.history_model
+        self.history_model = model
+        self.history_tableView.setModel(model)
+        if old is not None:
+            old.deleteLater()
 
     def get_data(self):
-        log.error("TODO: Implement get_data")
+        """ Writes the changed input values into the shown record"""
+        if self.record is None:
+            return None
+
+        for key, f in self.output_dict.items():
+            value = f()
+            if value != (self.record.get(key) or ""):
+                self.record[key] = value
+        return self.record
 
     def edit_properties(self):
         self.edit_state = not self.edit_state
@@ -171,8 +468,8 @@ class ItemPropertiesWidget(QtGui.QWidget):
         self.parent().parent().item_deleted()
 
     def save_item(self):
-        log.error("TODO: Implement save_item")
         self.parent().parent().item_saved()
+        self.edit_properties()
 
 
 def test():
@@ -191,10 +488,6 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    #import cProfile
-    #stats_file = "stats.prof"
-    #cProfile.run("test()", stats_file)
-
     test()
 
     print("done")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from hamster import records
+from hamster.cache import ID_FIELDS, default_cache_dir
+from hamster.lsms import never_sent, retryable
+
+log = logging.getLogger(__name__)
+
+
+class Operation(object):
+    """
+    One change to a thing which is not sent to lsmsd yet.
+
+    The following member variables are available
+    o.op     'create', 'update' or 'delete'
+    o.thing  the type of thing (e.g. 'items')
+    o.id     the id/name of the thing (negative temporary ids for created
+             items)
+    o.data   the whole data dict of the thing (None for deletes)
+    """
+    __slots__ = ('op', 'thing', 'id', 'data')
+
+    def __init__(self, op, thing, _id, data=None):
+        self.op = op
+        self.thing = thing
+        self.id = _id
+        self.data = data
+
+    def to_dict(self):
+        return {'op': self.op, 'thing': self.thing, 'id': self.id,
+                'data': self.data}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['op'], d['thing'], d['id'], d.get('data'))
+
+    def __repr__(self):
+        return "<Operation %s %s/%s>" % (self.op, self.thing, self.id)
+
+
+def coalesce(operations):
+    """ Merges the operations on the same thing into at most one
+
+    A create followed by updates becomes one create with the last data,
+    a create followed by a delete cancels out, repeated updates become
+    the last update and updates followed by a delete become the delete.
+    """
+    merged = {}
+    order = []
+    for o in operations:
+        key = (o.thing, o.id)
+        prev = merged.get(key)
+        if prev is None:
+            merged[key] = o
+            order.append(key)
+        elif o.op == 'update':
+            merged[key] = Operation(prev.op, o.thing, o.id, o.data)
+        elif o.op == 'delete':
+            merged[key] = None if prev.op == 'create' else o
+        else:
+            merged[key] = o
+
+    return [merged[key] for key in order if merged[key] is not None]
+
+
+def remap_ids(o, id_map):
+    """ Returns the operation o with the temporary ids in id_map replaced
+
+    Created items become updates of the real items.
+    """
+    if not id_map:
+        return o
+
+    op = o.op
+    _id = o.id
+    if _id in id_map:
+        op = 'update' if op == 'create' else op
+        _id = id_map[_id]
+
+    data = o.data
+    if data is not None:
+        data = dict(data)
+        if data.get('Id') in id_map:
+            data['Id'] = id_map[data['Id']]
+        if data.get('Contains'):
+            data['Contains'] = [id_map.get(c, c) for c in data['Contains']]
+    return Operation(op, o.thing, _id, data)
+
+
+class OperationJournal(object):
+    """
+    Durable journal of changes made while lsmsd is not reachable.
+
+    Operations are appended to a json lines file and synced to disk
+    before they are applied to the local model. replay() sends them to
+    lsmsd in batches, after merging repeated changes to the same thing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.operations = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.operations = [Operation.from_dict(json.loads(line))
+                                   for line in f if line.strip()]
+
+        temp_ids = [o.id for o in self.operations
+                    if o.op == 'create' and isinstance(o.id, int)]
+        self.next_temp_id = min(temp_ids + [0]) - 1
+
+    @classmethod
+    def for_server(cls, base_url, cache_dir=None):
+        """ Returns the journal for the lsmsd instance at base_url"""
+        cache_dir = cache_dir or default_cache_dir()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        name = hashlib.sha1(base_url.rstrip('/').encode('utf-8')).hexdigest()
+        return cls(os.path.join(cache_dir, "%s.journal" % name[:16]))
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __write(self, path, operations, mode):
+        with open(path, mode) as f:
+            for o in operations:
+                f.write(json.dumps(o.to_dict(), default=records.encode))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, op, thing, data=None, _id=None):
+        """ Appends a operation durably to the journal
+
+        Args:
+            op: 'create', 'update' or 'delete'
+            thing: The type of thing (e.g. 'items')
+            data: A dict or record with the data of the thing
+            _id: The id/name of the thing (only needed for deletes)
+
+        Returns:
+            The id of the thing (a temporary id for created items)
+        """
+        if data is not None:
+            data = json.loads(json.dumps(data, default=records.encode))
+            id_field = ID_FIELDS.get(thing, 'Id')
+            with self.lock:
+                if op == 'create' and id_field == 'Id':
+                    data['Id'] = self.next_temp_id
+                    self.next_temp_id -= 1
+            _id = data[id_field]
+
+        o = Operation(op, thing, _id, data)
+        with self.lock:
+            self.__write(self.path, [o], "a")
+            self.operations.append(o)
+        log.debug("Journaled %r", o)
+        return _id
+
+    def pending(self):
+        """ Returns the merged pending operations"""
+        with self.lock:
+            return coalesce(self.operations)
+
+    def replay(self, lsms, workers=None):
+        """ Sends the pending operations to lsmsd
+
+        Operations which failed because lsmsd is not reachable stay in the
+        journal, operations rejected by lsmsd are dropped. Creates which
+        may have reached lsmsd are dropped as well, since sending them
+        again could create the thing twice.
+
+        Returns:
+            A tuple (id_map, rejected) with a dict from the temporary to
+            the real ids of the created items and the list of rejected
+            BatchResults
+        """
+        with self.lock:
+            count = len(self.operations)
+            operations = coalesce(self.operations)
+
+        kwargs = {}
+        if workers:
+            kwargs['workers'] = workers
+
+        id_map = {}
+        retry = []
+        rejected = []
+
+        def check(report, ops):
+            for r, o in zip(report, ops):
+                if r.ok:
+                    continue
+                if retryable(r.error) and (
+                        o.op != 'create' or never_sent(r.error)):
+                    retry.append(o)
+                else:
+                    log.warning("Dropping %r: %s", o, r.error)
+                    rejected.append(r)
+
+        for thing in sorted(set(o.thing for o in operations)):
+            ops = [o for o in operations if o.thing == thing]
+
+            # deleted things always exist on the server (coalesce drops
+            # deletes of things created in the journal)
+            deletes = [o for o in ops if o.op == 'delete']
+            check(lsms.delete_many(thing, [o.id for o in deletes], **kwargs),
+                  deletes)
+
+            creates = [o for o in ops if o.op == 'create']
+            temp_ids = set(o.id for o in creates)
+            datas = []
+            for o in creates:
+                data = dict(o.data)
+                if isinstance(o.id, int) and o.id < 0:
+                    data['Id'] = 0
+                if data.get('Contains'):
+                    data['Contains'] = [c for c in data['Contains']
+                                        if c not in temp_ids]
+                datas.append(data)
+            report = lsms.create_many(thing, datas, **kwargs)
+            check(report, creates)
+            for r, o in zip(report, creates):
+                if r.ok and isinstance(o.id, int) and o.id < 0:
+                    id_map[o.id] = int(r.result)
+
+            # created items may contain each other, so they are updated
+            # with the real ids of their contents
+            updates = [remap_ids(o, id_map) for o in ops if o.op == 'update']
+            updates += [remap_ids(o, id_map) for o in creates
+                        if o.id in id_map and o.data.get('Contains')]
+            check(lsms.update_many(thing, [o.data for o in updates], **kwargs),
+                  updates)
+
+        with self.lock:
+            # keep what failed and what was appended during the replay
+            appended = [remap_ids(o, id_map) for o in self.operations[count:]]
+            self.operations = [remap_ids(o, id_map) for o in retry] + appended
+            tmp = self.path + ".tmp"
+            self.__write(tmp, self.operations, "w")
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+
+        log.info("Replayed %d operations, %d left", len(operations),
+                 len(self.operations))
+        return id_map, rejected
+
+
+def test(base_url):
+    import tempfile
+    from hamster.lsms import Lsms
+
+    j = OperationJournal(os.path.join(tempfile.mkdtemp(), "test.journal"))
+    shelf = j.append('create', 'items', {'Id': 0, 'Name': "Regal"})
+    j.append('update', 'items', {'Id': shelf, 'Name': "Regal 1"})
+    box = j.append('create', 'items', {'Id': 0, 'Name': "Kiste"})
+    j.append('update', 'items', {'Id': shelf, 'Name': "Regal 1", 'Contains': [box]})
+    gone = j.append('create', 'items', {'Id': 0, 'Name': "Weg"})
+    j.append('delete', 'items', _id=gone)
+    log.info("Pending: %s", j.pending())
+
+    log.info("Replayed: %s", j.replay(Lsms(base_url)))
+    log.info("Left: %d", len(j))
+
+if __name__ == '__main__':
+    import signal
+    from hamster.fakelsmsd import FakeLsmsd
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    server = FakeLsmsd().start()
+    test(server.url)
+    log.info("Server items: %s", list(server.data['items'].values()))
+    server.stop()
+
+    print("done")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r'\s*')
+
+
+def iter_array(chunks, encoding='utf-8'):
+    """
+    Parses a json array incrementally from an iterable of byte chunks.
+
+    Yields:
+        The elements of the array as soon as they are complete
+
+    Raises:
+        ValueError: The data is not a json array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    buf = u""
+    pos = 0
+    started = False
+    chunks = iter(chunks)
+    eof = False
+
+    while True:
+        pos = WHITESPACE_RE.match(buf, pos).end()
+
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected json array at %d" % pos)
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == ']':
+                return
+            if buf[pos] == ',':
+                pos += 1
+                continue
+
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+
+            # a element is only complete if something follows it
+            if end is not None and (eof or WHITESPACE_RE.match(buf, end).end() < len(buf)):
+                pos = end
+                yield element
+                continue
+
+        if eof:
+            raise ValueError("Unexpected end of json array")
+
+        # keep the unparsed rest and read the next chunk
+        buf = buf[pos:]
+        pos = 0
+        try:
+            buf += text_decoder.decode(next(chunks))
+        except StopIteration:
+            buf += text_decoder.decode(b"", final=True)
+            eof = True
+
+
+def test():
+    data = json.dumps([{'Id': i, 'Name': u"Schraube M%d ä" % i}
+                       for i in range(1000)] + [12345, "x"]).encode('utf-8')
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+    elements = list(iter_array(chunks))
+    log.info("Parsed %d elements, last: %s", len(elements), elements[-3:])
+
+    log.info("Empty array: %s", list(iter_array([b" [ ", b"] "])))
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
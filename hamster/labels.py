@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+import multiprocessing
+import os
+import zlib
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('pdf', 'png')
+SYMBOLOGIES = ('code128', 'qr')
+
+# A4 in points (1/72 inch), divided into COLUMNS x ROWS labels
+PAGE_SIZE = (595.28, 841.89)
+COLUMNS = 3
+ROWS = 8
+MARGIN = 28.35
+# space around the content of every label
+PADDING = 6.0
+NAME_SIZE = 9.0
+ID_SIZE = 7.0
+
+# resolution of png sheets
+PNG_DPI = 150
+
+# width of the narrowest bar/space in points and the quiet zone in modules
+CODE128_MODULE = 0.9
+CODE128_QUIET = 10
+
+# bar/space widths of the code 128 symbols 0-106 (106 is the stop symbol)
+CODE128_PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213",
+    "122312", "132212", "221213", "221312", "231212", "112232", "122132",
+    "122231", "113222", "123122", "123221", "223211", "221132", "221231",
+    "213212", "223112", "312131", "311222", "321122", "321221", "312212",
+    "322112", "322211", "212123", "212321", "232121", "111323", "131123",
+    "131321", "112313", "132113", "132311", "211313", "231113", "231311",
+    "112133", "112331", "132131", "113123", "113321", "133121", "313121",
+    "211331", "231131", "213113", "213311", "213131", "311123", "311321",
+    "331121", "312113", "312311", "332111", "314111", "221411", "431111",
+    "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114",
+    "413111", "241112", "134111", "111242", "121142", "121241", "114212",
+    "124112", "124211", "411212", "421112", "421211", "212141", "214121",
+    "412121", "111143", "111341", "131141", "114113", "114311", "411113",
+    "411311", "113141", "114131", "311141", "411131", "211412", "211214",
+    "211232", "2331112",
+)
+START_B = 104
+START_C = 105
+STOP = 106
+
+
+def code128(text):
+    """ Returns the symbol values of text encoded as code 128
+
+    Strings of an even number of digits use code set C (two digits per
+    symbol), all others code set B (printable ASCII).
+
+    Raises:
+        ValueError: text contains characters code set B can not encode
+    """
+    if text.isdigit() and len(text) % 2 == 0:
+        values = [START_C] + [int(text[i:i + 2])
+                              for i in range(0, len(text), 2)]
+    else:
+        if any(not 32 <= ord(c) < 128 for c in text):
+            raise ValueError("Can not encode %r as code 128" % text)
+        values = [START_B] + [ord(c) - 32 for c in text]
+
+    checksum = values[0] + sum(i * v for i, v in enumerate(values[1:], 1))
+    return values + [checksum % 103, STOP]
+
+
+def code128_bars(text):
+    """ Returns (x, width) tuples of the bars in modules and the total width"""
+    bars = []
+    x = CODE128_QUIET
+    for value in code128(text):
+        for n, width in enumerate(CODE128_PATTERNS[value]):
+            # patterns start with a bar and alternate with spaces
+            if n % 2 == 0:
+                bars.append((x, int(width)))
+            x += int(width)
+    return bars, x + CODE128_QUIET
+
+
+def qr_matrix(text):
+    """ Returns the QR code of text as list of rows of booleans
+
+    Needs the qrcode package.
+    """
+    try:
+        import qrcode
+    except ImportError:
+        raise ImportError("QR labels need the qrcode package "
+                          "(pip install qrcode), use code128 instead")
+    qr = qrcode.QRCode(border=1)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def matrix_rects(matrix):
+    """ Returns (x, y, width, height) rects of the dark modules of a matrix
+
+    Dark modules next to each other in a row are merged.
+    """
+    rects = []
+    for y, row in enumerate(matrix):
+        start = None
+        for x, dark in enumerate(list(row) + [False]):
+            if dark and start is None:
+                start = x
+            elif not dark and start is not None:
+                rects.append((start, y, x - start, 1))
+                start = None
+    return rects
+
+
+def fit_text(text, size, width):
+    """ Shortens text to about width points in Helvetica of size"""
+    # average width of a Helvetica character is about half its size
+    chars = int(width / (size * 0.5))
+    if len(text) <= chars:
+        return text
+    return text[:max(chars - 1, 0)] + u"…"
+
+
+def layout(labels, symbology):
+    """ Returns the shapes of one sheet with labels
+
+    Args:
+        labels: A list of (id, name) tuples
+        symbology: 'code128' or 'qr'
+
+    Returns:
+        A list of ('rect', x, y, width, height) and
+        ('text', x, y, size, text) tuples in points, y from the top
+    """
+    page_width, page_height = PAGE_SIZE
+    label_width = (page_width - 2 * MARGIN) / COLUMNS
+    label_height = (page_height - 2 * MARGIN) / ROWS
+    text_height = NAME_SIZE + ID_SIZE + 4
+
+    shapes = []
+    for n, (_id, name) in enumerate(labels):
+        left = MARGIN + (n % COLUMNS) * label_width + PADDING
+        top = MARGIN + (n // COLUMNS) * label_height + PADDING
+        width = label_width - 2 * PADDING
+        height = label_height - 2 * PADDING - text_height
+        text_left = left
+
+        if symbology == 'qr':
+            rects = matrix_rects(qr_matrix(_id))
+            side = max(x + w for x, _, w, _ in rects) if rects else 1
+            module = (label_height - 2 * PADDING) / float(side)
+            for x, y, w, h in rects:
+                shapes.append(('rect', left + x * module, top + y * module,
+                               w * module, h * module))
+            # the text is shown next to the square code
+            text_left = left + side * module + PADDING
+            width -= side * module + PADDING
+            top += height
+        else:
+            bars, modules = code128_bars(_id)
+            module = min(CODE128_MODULE, width / float(modules))
+            for x, w in bars:
+                shapes.append(('rect', left + x * module, top, w * module,
+                               height))
+            top += height
+
+        shapes.append(('text', text_left, top + NAME_SIZE + 2, NAME_SIZE,
+                       fit_text(name, NAME_SIZE, width)))
+        shapes.append(('text', text_left, top + NAME_SIZE + ID_SIZE + 4,
+                       ID_SIZE, _id))
+    return shapes
+
+
+def pdf_string(text):
+    """ Returns text as PDF string literal in WinAnsiEncoding"""
+    data = text.encode('cp1252', 'replace')
+    for c in (b"\\", b"(", b")"):
+        data = data.replace(c, b"\\" + c)
+    return b"(" + data + b")"
+
+
+def render_pdf(shapes):
+    """ Returns the compressed PDF content stream of a sheet"""
+    page_height = PAGE_SIZE[1]
+    ops = []
+    for shape in shapes:
+        if shape[0] == 'rect':
+            _, x, y, w, h = shape
+            ops.append(("%.2f %.2f %.2f %.2f re" % (
+                x, page_height - y - h, w, h)).encode('ascii'))
+        else:
+            _, x, y, size, text = shape
+            ops.append(("BT /F1 %.1f Tf %.2f %.2f Td " % (
+                size, x, page_height - y)).encode('ascii') +
+                pdf_string(text) + b" Tj ET")
+    # all rects are filled at once
+    content = b"\n".join([op for op in ops if op.endswith(b"re")] + [b"f"] +
+                         [op for op in ops if not op.endswith(b"re")])
+    return zlib.compress(content)
+
+
+def render_png(shapes, dpi=PNG_DPI):
+    """ Returns a sheet as PNG image, needs Pillow"""
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        raise ImportError("PNG labels need Pillow (pip install Pillow), "
+                          "use PDF instead")
+
+    scale = dpi / 72.0
+    image = Image.new('L', (int(PAGE_SIZE[0] * scale),
+                            int(PAGE_SIZE[1] * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    fonts = {}
+    for shape in shapes:
+        if shape[0] == 'rect':
+            _, x, y, w, h = shape
+            draw.rectangle([x * scale, y * scale, (x + w) * scale - 1,
+                            (y + h) * scale - 1], fill=0)
+            continue
+
+        _, x, y, size, text = shape
+        font = fonts.get(size)
+        if font is None:
+            try:
+                font = ImageFont.truetype("DejaVuSans.ttf", int(size * scale))
+            except IOError:
+                font = ImageFont.load_default()
+            fonts[size] = font
+        draw.text((x * scale, (y - size) * scale), text, fill=0, font=font)
+
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def render_sheet(job):
+    """ Renders one sheet in a worker process
+
+    Args:
+        job: A tuple (sheet number, labels, format, symbology, dpi)
+
+    Returns:
+        A tuple (sheet number, PDF content stream or PNG image)
+    """
+    number, labels, fmt, symbology, dpi = job
+    shapes = layout(labels, symbology)
+    if fmt == 'pdf':
+        return number, render_pdf(shapes)
+    return number, render_png(shapes, dpi)
+
+
+class PdfWriter(object):
+    """
+    Writes a PDF with one page per content stream while they are added.
+
+    Only the page tree, the catalog and the cross reference table are
+    written on close, so pages are on disk as soon as they are rendered.
+    """
+    CATALOG = 1
+    PAGES = 2
+    FONT = 3
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self.pages = []
+        self.next_number = 4
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.__object(self.FONT, b"<< /Type /Font /Subtype /Type1 "
+                                 b"/BaseFont /Helvetica "
+                                 b"/Encoding /WinAnsiEncoding >>")
+
+    def __object(self, number, body):
+        self.offsets[number] = self.f.tell()
+        self.f.write(("%d 0 obj\n" % number).encode('ascii'))
+        self.f.write(body)
+        self.f.write(b"\nendobj\n")
+
+    def add_page(self, content):
+        """ Writes a page with a FlateDecode compressed content stream"""
+        stream, page = self.next_number, self.next_number + 1
+        self.next_number += 2
+        self.__object(stream, ("<< /Length %d /Filter /FlateDecode >>\n"
+                               "stream\n" % len(content)).encode('ascii') +
+                      content + b"\nendstream")
+        self.__object(page, (
+            "<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] "
+            "/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (
+                self.PAGES, PAGE_SIZE[0], PAGE_SIZE[1], self.FONT,
+                stream)).encode('ascii'))
+        self.pages.append(page)
+        self.f.flush()
+
+    def close(self):
+        kids = " ".join("%d 0 R" % page for page in self.pages)
+        self.__object(self.PAGES, ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            kids, len(self.pages))).encode('ascii'))
+        self.__object(self.CATALOG, ("<< /Type /Catalog /Pages %d 0 R >>" %
+                                     self.PAGES).encode('ascii'))
+
+        xref = self.f.tell()
+        count = self.next_number
+        self.f.write(("xref\n0 %d\n0000000000 65535 f \n" % count).encode('ascii'))
+        for number in range(1, count):
+            self.f.write(("%010d 00000 n \n" % self.offsets[number]).encode('ascii'))
+        self.f.write(("trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n"
+                      "%%%%EOF\n" % (count, self.CATALOG, xref)).encode('ascii'))
+
+
+def sheet_path(path, number):
+    """ Returns the file name of a PNG sheet, e.g. labels-001.png"""
+    base, ext = os.path.splitext(path)
+    return "%s-%03d%s" % (base, number + 1, ext)
+
+
+def pool_context():
+    # forking a process with running gui threads is not safe
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('spawn')
+    return multiprocessing
+
+
+def iter_labels(things, path, fmt=None, symbology='code128', workers=None,
+                dpi=PNG_DPI):
+    """ Renders asset labels of things into printable sheets
+
+    The sheets are rendered in parallel by a pool of processes and written
+    in order as soon as they are done: all pages into one PDF file or one
+    PNG file per sheet (see sheet_path).
+
+    Args:
+        things: Records or dicts of items
+        path: The output file
+        fmt: 'pdf' or 'png' (default: from the extension of path)
+        symbology: 'code128' or 'qr' (needs the qrcode package)
+        workers: The number of processes (default: the number of cpus)
+        dpi: The resolution of PNG sheets
+
+    Yields:
+        The number of every written sheet and the number of all sheets
+        as tuple
+
+    Raises:
+        ValueError: A unknown format or symbology
+        ImportError: The format or symbology needs a missing package
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError("Unknown label format: %s" % fmt)
+    if symbology not in SYMBOLOGIES:
+        raise ValueError("Unknown symbology: %s" % symbology)
+
+    labels = [(str(t['Id']), t.get('Name') or "") for t in things]
+    per_sheet = COLUMNS * ROWS
+    jobs = [(n, labels[i:i + per_sheet], fmt, symbology, dpi)
+            for n, i in enumerate(range(0, len(labels), per_sheet))]
+    if not jobs:
+        return
+
+    # fail early instead of in every worker
+    render_sheet((0, labels[:1], fmt, symbology, dpi))
+
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+    pool = pool_context().Pool(workers)
+    f = open(path, "wb") if fmt == 'pdf' else None
+    try:
+        writer = PdfWriter(f) if f is not None else None
+        for number, data in pool.imap(render_sheet, jobs):
+            if writer is not None:
+                writer.add_page(data)
+            else:
+                with open(sheet_path(path, number), "wb") as sheet:
+                    sheet.write(data)
+            yield number, len(jobs)
+        if writer is not None:
+            writer.close()
+        pool.close()
+    finally:
+        if f is not None:
+            f.close()
+        pool.terminate()
+        pool.join()
+
+    log.info("%d labels written to %d sheets", len(labels), len(jobs))
+
+
+def write_labels(things, path, **kwargs):
+    """ Renders labels like iter_labels and returns the number of sheets"""
+    sheets = 0
+    for _, sheets in iter_labels(things, path, **kwargs):
+        pass
+    return sheets
+
+
+def test():
+    import tempfile
+    import time
+    from hamster.fakelsmsd import make_item
+
+    things = [make_item(i) for i in range(1, 3001)]
+    path = os.path.join(tempfile.mkdtemp(), "labels.pdf")
+    start = time.time()
+    sheets = write_labels(things, path)
+    log.info("%d sheets in %.2fs, %d bytes: %s", sheets, time.time() - start,
+             os.path.getsize(path), path)
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+from hamster.cache import thing_id
+from hamster.records import Record, freeze
+from hamster.throttle import background
+
+log = logging.getLogger(__name__)
+
+# seconds between two polls while things change and while they don't
+MIN_INTERVAL = 5.0
+MAX_INTERVAL = 300.0
+# the interval is multiplied with this after every poll without changes
+BACKOFF_FACTOR = 2.0
+# random part of the interval, so clients started together don't poll
+# at the same time
+JITTER = 0.1
+
+
+def fingerprint(thing):
+    """ Returns a hash over the content of a record or dict"""
+    if isinstance(thing, Record):
+        return thing.fingerprint()
+    return hash(freeze(thing))
+
+
+class Delta(object):
+    """
+    Differences between two polls.
+
+    The following member variables are available
+    d.added    list of the new things
+    d.changed  list of the changed things
+    d.removed  list of the ids/names of the removed things
+    """
+    __slots__ = ('added', 'changed', 'removed')
+
+    def __init__(self, added=None, changed=None, removed=None):
+        self.added = added or []
+        self.changed = changed or []
+        self.removed = removed or []
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def __repr__(self):
+        return "<Delta +%d ~%d -%d>" % (
+            len(self.added), len(self.changed), len(self.removed))
+
+
+class ChangeFeed(object):
+    """
+    Finds the things changed on lsmsd, e.g. by other clients.
+
+    lsmsd has no change notifications, so the list of things is polled
+    with conditional requests (see Lsms.poll_all) and compared with the
+    last known state. Only the differences are returned.
+
+    The interval between polls adapts to the changes: it drops to
+    min_interval when something changed or the user is active and grows
+    up to max_interval while nothing changes.
+
+    The validators of the last poll are kept in the ItemCache of the Lsms
+    object, so the first poll after a restart is conditional as well.
+
+        feed = ChangeFeed(lsms, "items")
+        feed.seed(things)
+        delta = feed.poll()
+        time.sleep(feed.delay())
+    """
+
+    def __init__(self, lsms, thing, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, factor=BACKOFF_FACTOR):
+        self.lsms = lsms
+        self.thing = thing
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.interval = min_interval
+        self.validators = None
+        self.fingerprints = None
+        self.lock = threading.Lock()
+
+    def seed(self, things):
+        """ Sets the known state, e.g. the things loaded on start"""
+        fingerprints = dict((thing_id(self.thing, t), fingerprint(t))
+                            for t in things)
+        with self.lock:
+            self.fingerprints = fingerprints
+
+    def poll(self):
+        """ Fetches the things if they changed and returns a Delta
+
+        All things are added if the feed was not seeded. The caches of
+        the Lsms object are refreshed.
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        cache = self.lsms.cache
+        with self.lock:
+            if self.validators is None and cache is not None:
+                self.validators = cache.load_validators(self.thing)
+            validators = self.validators
+
+        # other callers must not wait for a slow lsmsd
+        with background():
+            things, validators = self.lsms.poll_all(self.thing, validators)
+
+        delta = Delta()
+        with self.lock:
+            self.validators = validators
+            if things is not None:
+                delta = self.__diff(things)
+        if cache is not None:
+            cache.save_validators(self.thing, validators)
+
+        for t in delta.changed:
+            self.lsms.expire_responses(self.thing, thing_id(self.thing, t))
+        for _id in delta.removed:
+            self.lsms.expire_responses(self.thing, _id)
+
+        if delta:
+            log.info("%s changed: %r", self.thing, delta)
+            self.activity()
+        else:
+            self.backoff()
+        return delta
+
+    def __diff(self, things):
+        old = self.fingerprints or {}
+        new = {}
+        delta = Delta()
+        for t in things:
+            _id = thing_id(self.thing, t)
+            new[_id] = fingerprint(t)
+            if _id not in old:
+                delta.added.append(t)
+            elif old[_id] != new[_id]:
+                delta.changed.append(t)
+
+        delta.removed = [_id for _id in old if _id not in new]
+        self.fingerprints = new
+        return delta
+
+    def activity(self):
+        """ Polls often again, e.g. after the user did something"""
+        self.interval = self.min_interval
+
+    def backoff(self):
+        """ Polls less often, e.g. after nothing changed or a error"""
+        self.interval = min(self.interval * self.factor, self.max_interval)
+
+    def delay(self):
+        """ Returns the seconds to wait until the next poll"""
+        return self.interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+def test(base_url):
+    import os
+    import tempfile
+    from hamster.cache import ItemCache
+    from hamster.lsms import Lsms
+
+    path = os.path.join(tempfile.mkdtemp(), "test.sqlite")
+    l = Lsms(base_url, cache=ItemCache(path))
+    feed = ChangeFeed(l, "items")
+    feed.seed(l.select_all("items"))
+    log.info("Unchanged: %r, next poll in %.1fs", feed.poll(), feed.delay())
+
+    l.create_thing("items", {'Id': 0, 'Name': "Neu"})
+    l.update_thing("items", {'Id': 1, 'Name': "Umbenannt"})
+    l.delete_thing("items", 2)
+    log.info("Changed: %r, next poll in %.1fs", feed.poll(), feed.delay())
+    log.info("Unchanged: %r, next poll in %.1fs", feed.poll(), feed.delay())
+    log.info("Requests: %s", [(s.endpoint, s.statuses)
+                              for s in l.stats.snapshot()])
+
+    # a restarted client starts with the stored validators
+    l = Lsms(base_url, cache=ItemCache(path))
+    feed = ChangeFeed(l, "items")
+    feed.seed(l.sync_all("items"))
+    log.info("After restart: %r, requests: %s", feed.poll(),
+             [(s.endpoint, s.statuses) for s in l.stats.snapshot()])
+
+if __name__ == '__main__':
+    import signal
+    from hamster.fakelsmsd import FakeLsmsd
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    server = FakeLsmsd(items=10).start()
+    test(server.url)
+    server.stop()
+
+    print("done")
@@ -1,11 +1,29 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import gzip
+import hashlib
+import io
 import logging
 import requests
 import json
+import time
 from posixpath import basename
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from requests.packages.urllib3.exceptions import NewConnectionError
+from requests.packages.urllib3.util.retry import Retry
+from hamster import records
+from hamster.cache import ID_FIELDS, thing_id
+from hamster.jsonstream import iter_array
+from hamster.pool import imap
+from hamster.stats import CallTiming, RequestStats, endpoint_name
+from hamster.throttle import SingleFlight, background
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 
 log = logging.getLogger(__name__)
 
@@ -13,6 +31,29 @@ log = logging.getLogger(__name__)
 logging.getLogger('requests').setLevel(logging.WARNING)
 logging.getLogger('urllib3').setLevel(logging.WARNING)
 
+# seconds after which a cached thing list is fetched completely again.
+# Until then changes of other clients are only seen through polling
+# (see hamster.livefeed).
+CACHE_MAX_AGE = 24 * 60 * 60
+
+# default number of parallel requests for the batch calls
+BATCH_WORKERS = 8
+
+# default connection settings, see Lsms.__init__
+POOL_SIZE = 10
+TIMEOUT = (3.05, 30)
+RETRIES = 3
+BACKOFF = 0.3
+
+# request bodies smaller than this are not compressed
+COMPRESS_MIN_SIZE = 1024
+
+# bytes read at once when streaming responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# log entries written to the cache at once by sync_thing_log
+LOG_BATCH_SIZE = 1000
+
 
 def urljoin(*args):
     """
@@ -37,58 +78,290 @@ class LsmsException(Exception):
     pass
 
 
+class BatchResult(object):
+    """
+    Result of one operation of a batch call (e.g. Lsms.create_many)
+
+    The following member variables are available
+    r.index     position of the operation in the batch
+    r.arg       the data dict or id the operation was called with
+    r.result    the return value of the operation
+    r.error     the exception of the last attempt or None
+    r.attempts  the number of attempts
+    """
+    __slots__ = ('index', 'arg', 'result', 'error', 'attempts')
+
+    def __init__(self, index, arg, result=None, error=None, attempts=1):
+        self.index = index
+        self.arg = arg
+        self.result = result
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "<BatchResult %d ok: %r>" % (self.index, self.result)
+        return "<BatchResult %d failed after %d attempts: %s>" % (
+            self.index, self.attempts, self.error)
+
+
+def retryable(e):
+    """ Returns if a failed api call may succeed when it is repeated"""
+    if isinstance(e, LsmsException):
+        return e.status_code >= 500
+    return isinstance(e, requests.exceptions.RequestException)
+
+
+def never_sent(e):
+    """ Returns if a failed api call surely did not reach lsmsd
+
+    Only then a call which is not idempotent (e.g. a create) can be
+    repeated without doing it twice.
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and e.args:
+        reason = getattr(e.args[0], 'reason', e.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def run_batch(func, args, workers=BATCH_WORKERS, retries=2, idempotent=True):
+    """ Calls func for all args in parallel
+
+    Calls failing with a retryable error are repeated up to retries times.
+    If func is not idempotent, they are only repeated if the request
+    never reached lsmsd (see never_sent).
+
+    Returns:
+        A list with a BatchResult for every element of args (in order)
+    """
+    def attempt(arg):
+        # batches must not slow down interactive calls
+        with background():
+            for n in range(1, retries + 2):
+                try:
+                    return (func(arg), None, n)
+                except Exception as e:
+                    if n > retries or not retryable(e) or not (
+                            idempotent or never_sent(e)):
+                        return (None, e, n)
+                    log.debug("Retrying after error: %s", e)
+
+    report = []
+    for index, arg, res, e in imap(attempt, args, workers):
+        result, error, attempts = res if e is None else (None, e, 1)
+        report.append(BatchResult(index, arg, result, error, attempts))
+
+    failed = sum(1 for r in report if not r.ok)
+    if failed:
+        log.warning("%d of %d batch operations failed", failed, len(report))
+    return report
+
+
+def api_error(r, url, method, data):
+    """ Returns a LsmsException for the failed response r"""
+    e = LsmsException("Status code: %s\nURL: %s\nMethod: %s\nData: %s\n%s" % (
+        r.status_code, url, method, data, r.text))
+    e.status_code = r.status_code
+    e.url = url
+    e.method = method
+    e.data = data
+    return e
+
+
+def same_host(url_a, url_b):
+    """ Returns if two urls point to the same scheme, host and port"""
+    return urlparse(url_a)[:2] == urlparse(url_b)[:2]
+
+
+def gzip_compress(data):
+    """ Returns data compressed with gzip"""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+
 class Lsms(object):
     """
     Class to handle api calls to the lsmsd interface
     """
 
-    def __init__(self, base_url, username=None, password=None):
-        """ Creates a Lsms object"""
+    def __init__(self, base_url, username=None, password=None, cache=None,
+                 pool_size=POOL_SIZE, timeout=TIMEOUT, retries=RETRIES,
+                 backoff=BACKOFF, keep_alive=True, compress=False,
+                 partial_updates=False, http_cache=None, limiter=None):
+        """ Creates a Lsms object
+
+        Args:
+            base_url: The url of the lsmsd instance
+            username: The username for the basic auth (optional)
+            password: The password for the basic auth (optional)
+            cache: A ItemCache used by sync_all (optional)
+            pool_size: The number of connections kept open to lsmsd
+            timeout: Seconds to wait for the connection and for the
+                response, as single value or (connect, read) tuple
+            retries: How often idempotent requests are repeated on
+                connection errors and 502/503/504 responses
+            backoff: Backoff factor in seconds between the retries
+            keep_alive: Keep connections open between requests
+            compress: Send request bodies gzip compressed
+            partial_updates: Send only the changed fields in save_thing.
+                Only enable this if lsmsd keeps the fields missing in a
+                update.
+            http_cache: A HttpCache for the responses of select_thing and
+                select_thing_log (optional)
+            limiter: A RateLimiter for the requests sent (optional)
+        """
         self.base_url = base_url
+        self.cache = cache
+        self.timeout = timeout
+        self.compress = compress
+        self.partial_updates = partial_updates
+        self.http_cache = http_cache
+        self.limiter = limiter
+        self.stats = RequestStats()
+        # concurrent identical GETs share one request
+        self.flights = SingleFlight()
         auth = None
         if username and password:
             auth = HTTPBasicAuth(username, password)
 
+        # the last response of failed retries is handled like any other
+        # error response instead of raising requests' RetryError
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry)
+
         self.s = requests.Session()
+        self.s.mount('http://', adapter)
+        self.s.mount('https://', adapter)
         self.s.headers['Content-Type'] = 'application/json'
+        self.s.headers['Accept-Encoding'] = 'gzip, deflate'
+        if not keep_alive:
+            self.s.headers['Connection'] = 'close'
         self.s.auth = auth
 
+    def set_base_url(self, base_url, cache=None, http_cache=None):
+        """ Point the session to another lsmsd instance
+
+        Open connections and credentials are kept if the new url is on the
+        same host as the old one.
+        """
+        if not same_host(self.base_url, base_url):
+            log.debug("Closing connections to %s", self.base_url)
+            self.s.close()
+            self.s.auth = None
+
+        self.base_url = base_url
+        self.cache = cache
+        self.http_cache = http_cache
+
     def set_credentials(self, username, password):
         """ Set the username and password for the current session"""
         auth = HTTPBasicAuth(username, password)
         self.s.auth = auth
 
+    def __connections(self, url):
+        """ Returns the number of connections opened so far for url"""
+        try:
+            pools = self.s.get_adapter(url).poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys())
+        except Exception:
+            return 0
+
+    def __acquire(self):
+        """ Waits until self.limiter lets the current thread send a request"""
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    def __send(self, timing, method, url, limit=True, **kwargs):
+        """ Sends a request and records the wait time in timing
+
+        limit is False if the caller already acquired the rate limiter.
+        """
+        send = getattr(self.s, method, "get")
+        if limit:
+            self.__acquire()
+        connections = self.__connections(url)
+
+        start = time.time()
+        r = send(url, stream=True, timeout=self.timeout, **kwargs)
+        timing.wait = time.time() - start
+        timing.status = r.status_code
+        timing.connected = self.__connections(url) > connections
+        return r
+
     def __api_call(self, url, method="get", data=None, to_json=True,
-                   text_check=None):
-        """ Make a call to the lsmsd api"""
+                   text_check=None, record=None, cached=None, store=False,
+                   limit=True):
+        """ Make a call to the lsmsd api
+
+        If record is the type of a thing, the json response is decoded to
+        records of that type. If cached is a CachedResponse, the request is
+        sent conditionally. If store is True, a successful response is
+        stored in self.http_cache. The timing of the call is recorded in
+        self.stats.
+        """
+        timing = CallTiming(method, endpoint_name(self.base_url, url))
+        try:
+            return self.__timed_api_call(timing, url, method, data, to_json,
+                                         text_check, record, cached, store,
+                                         limit)
+        except Exception as e:
+            timing.error = e
+            raise
+        finally:
+            self.stats.record(timing)
+
+    def __timed_api_call(self, timing, url, method, data, to_json,
+                         text_check, record, cached, store, limit):
         # TODO: Ugly implementation => make cleaner (dict based approach???)
-        s = getattr(self.s, method, "get")
-        if data:
-            data = json.dumps(data)
-            r = s(url, data=data)
+        if cached is not None:
+            r = self.__send(timing, method, url, limit,
+                            headers=cached.validators())
+        elif data:
+            data = json.dumps(data, default=records.encode)
+            body = data.encode('utf-8')
+            headers = {}
+            if self.compress and len(body) >= COMPRESS_MIN_SIZE:
+                body = gzip_compress(body)
+                headers['Content-Encoding'] = 'gzip'
+            timing.sent = len(body)
+            r = self.__send(timing, method, url, limit, data=body,
+                            headers=headers)
         else:
-            r = s(url)
-
-        if text_check:
-            if r.status_code == 200 and r.text == text_check:
-                if to_json:
-                    return r.json()
-                else:
-                    return r.text
-        else:
-            if r.status_code == 200:
-                if to_json:
-                    return r.json()
-                else:
-                    return r.text
-
-        e = LsmsException("Status code: %s\nURL: %s\nMethod: %s\nData: %s\n%s" % (
-            r.status_code, url, method, data, r.text))
-        e.status_code = r.status_code
-        e.url = url
-        e.method = method
-        e.data = data
-        raise e
+            r = self.__send(timing, method, url, limit)
+
+        start = time.time()
+        text = r.text
+        timing.download = time.time() - start
+        timing.received = len(r.content)
+
+        status = r.status_code
+        if status == 304 and cached is not None:
+            text = self.http_cache.revalidated(url, cached, r.headers).text
+            status = 200
+        elif status == 200 and store and self.http_cache:
+            self.http_cache.store(url, text, r.headers)
+
+        if status == 200 and (text_check is None or text == text_check):
+            if not to_json:
+                return text
+
+            start = time.time()
+            try:
+                return records.loads(record, text)
+            finally:
+                timing.decode = time.time() - start
+
+        raise api_error(r, url, method, data)
 
     def select_all(self, thing):
         """ Fetch all things
@@ -97,12 +370,187 @@ class Lsms(object):
             thing: The type of thing (e.g. 'user', 'item', 'policy')
 
         Returns:
-            A list of dicts containing the data from the things
+            A list of records (see hamster.records) or dicts containing
+            the data from the things
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        return self.__api_call(urljoin(self.base_url, thing), record=thing)
+
+    def iter_all(self, thing):
+        """ Fetch all things and yield them while they are downloaded
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+
+        Yields:
+            Records (see hamster.records) or dicts containing the data
+            from the things
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        url = urljoin(self.base_url, thing)
+        timing = CallTiming("get", endpoint_name(self.base_url, url))
+        r = None
+        try:
+            r = self.__send(timing, "get", url)
+            if r.status_code != 200:
+                raise api_error(r, url, "get", None)
+
+            # the json is decoded while downloading, so it is all download
+            start = time.time()
+            chunks = r.iter_content(STREAM_CHUNK_SIZE)
+            for data in iter_array(chunks):
+                yield records.from_dict(thing, data)
+            timing.download = time.time() - start
+            timing.received = r.raw.tell() if hasattr(r.raw, 'tell') else 0
+        except Exception as e:
+            timing.error = e
+            raise
+        finally:
+            self.stats.record(timing)
+            if r is not None:
+                r.close()
+
+    def poll_all(self, thing, validators=None):
+        """ Fetch all things if they changed since the last poll
+
+        A conditional request is sent with the ETag and Last-Modified
+        header of the last response. If lsmsd does not send them, the
+        whole list is downloaded but only decoded if its digest differs.
+        Changed lists replace the cached things.
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            validators: The validators returned by the last call (optional)
+
+        Returns:
+            A tuple (things, validators). things is a list of records or
+            dicts, or None if nothing changed.
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        validators = validators or {}
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        url = urljoin(self.base_url, thing)
+        timing = CallTiming("get", endpoint_name(self.base_url, url))
+        r = None
+        try:
+            r = self.__send(timing, "get", url, headers=headers)
+            if r.status_code == 304:
+                return None, validators
+            if r.status_code != 200:
+                raise api_error(r, url, "get", None)
+
+            start = time.time()
+            content = r.content
+            timing.download = time.time() - start
+            timing.received = len(content)
+
+            new_validators = {
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+                'digest': hashlib.sha1(content).hexdigest(),
+            }
+            if new_validators['digest'] == validators.get('digest'):
+                return None, new_validators
+
+            start = time.time()
+            things = records.loads(thing, r.text)
+            timing.decode = time.time() - start
+        except Exception as e:
+            timing.error = e
+            raise
+        finally:
+            self.stats.record(timing)
+            if r is not None:
+                r.close()
+
+        if self.cache is not None:
+            self.cache.replace_all(thing, things)
+        return things, new_validators
+
+    def sync_all(self, thing, max_age=CACHE_MAX_AGE):
+        """ Fetch all things, served from the local cache where possible
+
+        See iter_sync.
+
+        Returns:
+            A list of records (see hamster.records) or dicts containing
+            the data from the things
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        return list(self.iter_sync(thing, max_age))
+
+    def iter_sync(self, thing, max_age=CACHE_MAX_AGE):
+        """ Fetch all things, served from the local cache where possible
+
+        The whole list is only fetched if the cache is empty or older than
+        max_age. In this case the things are yielded while they are
+        downloaded. Otherwise only the things changed through this client
+        are fetched again by their id.
+
+        Changes made by other clients are not seen this way: the cached
+        things can be up to max_age seconds out of date. Poll for them
+        (see poll_all and hamster.livefeed.ChangeFeed) or pass a shorter
+        max_age if that matters.
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            max_age: Seconds after which the whole list is fetched again
+
+        Yields:
+            Records (see hamster.records) or dicts containing the data
+            from the things
 
         Raises:
             LsmsException: A error occured when calling the api
         """
-        return self.__api_call(urljoin(self.base_url, thing))
+        if self.cache is None:
+            for t in self.iter_all(thing):
+                yield t
+            return
+
+        age = self.cache.age(thing)
+        if age is None or age > max_age:
+            things = []
+            for t in self.iter_all(thing):
+                things.append(t)
+                yield t
+            self.cache.replace_all(thing, things)
+            return
+
+        for _id in self.cache.dirty_ids(thing):
+            try:
+                self.cache.put(thing, self.select_thing(thing, _id))
+            except LsmsException as e:
+                if e.status_code != 404:
+                    raise
+                self.cache.remove(thing, _id)
+
+        for t in self.iter_cached(thing):
+            yield t
+
+    def iter_cached(self, thing):
+        """ Yields the cached things without calling the api
+
+        Used to show the last known state while lsmsd is not reachable.
+        Nothing is yielded without a cache.
+        """
+        if self.cache is None:
+            return
+        for data in self.cache.load(thing):
+            yield records.from_dict(thing, data)
 
     def select_thing(self, thing, _id):
         """ Fetch one thing
@@ -112,12 +560,14 @@ class Lsms(object):
             _id: The id/name of the thing
 
         Returns:
-            A dict containing the data from a thing
+            A record (see hamster.records) or dict containing the data
+            from a thing
 
         Raises:
             LsmsException: A error occured when calling the api
         """
-        return self.__api_call(urljoin(self.base_url, thing, _id))
+        return self.__cached_api_call(urljoin(self.base_url, thing, _id),
+                                      record=thing)
 
     def select_thing_log(self, thing, _id):
         """ Fetch the history from one thing
@@ -132,7 +582,143 @@ class Lsms(object):
         Raises:
             LsmsException: A error occured when calling the api
         """
-        return self.__api_call(urljoin(self.base_url, thing, _id, "log"))
+        return self.__cached_api_call(urljoin(self.base_url, thing, _id, "log"))
+
+    def sync_thing_log(self, thing, _id):
+        """ Fetch the new history entries of one thing into the cache
+
+        The log is requested with the ETag of the last sync, so an
+        unchanged log costs a 304. Otherwise the log is decoded while it
+        is downloaded and only the entries which are not cached yet are
+        stored. Read the entries with cache.load_log. Concurrent syncs of
+        the same thing share one request.
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            _id: The id/name of the thing
+
+        Returns:
+            The number of new entries
+
+        Raises:
+            LsmsException: A error occured when calling the api
+            ValueError: There is no cache
+        """
+        if self.cache is None:
+            raise ValueError("sync_thing_log needs a cache")
+
+        # the rate limit is applied with the priority of every caller, not
+        # only with that of the caller sending the request
+        self.__acquire()
+        count, _ = self.flights.do(("log", thing, str(_id)),
+                                   lambda: self.__sync_thing_log(thing, _id))
+        return count
+
+    def __sync_thing_log(self, thing, _id):
+        length, etag = self.cache.log_state(thing, _id)
+        headers = {'If-None-Match': etag} if etag and length else {}
+        url = urljoin(self.base_url, thing, _id, "log")
+        timing = CallTiming("get", endpoint_name(self.base_url, url))
+        r = None
+        try:
+            r = self.__send(timing, "get", url, False, headers=headers)
+            if r.status_code == 304:
+                return 0
+            if r.status_code != 200:
+                raise api_error(r, url, "get", None)
+
+            start = time.time()
+            count = 0
+            new = []
+            for entry in iter_array(r.iter_content(STREAM_CHUNK_SIZE)):
+                count += 1
+                if count <= length:
+                    continue
+                new.append(entry)
+                if len(new) >= LOG_BATCH_SIZE:
+                    self.cache.append_log(thing, _id, new,
+                                          start=count - len(new))
+                    new = []
+            timing.download = time.time() - start
+            timing.received = r.raw.tell() if hasattr(r.raw, 'tell') else 0
+        except Exception as e:
+            timing.error = e
+            raise
+        finally:
+            self.stats.record(timing)
+            if r is not None:
+                r.close()
+
+        if count < length:
+            log.info("Log of %s/%s is shorter than cached, fetching it again",
+                     thing, _id)
+            self.cache.clear_log(thing, _id)
+            return self.__sync_thing_log(thing, _id)
+
+        self.cache.append_log(thing, _id, new, r.headers.get('ETag') or "",
+                              start=count - len(new))
+        return count - length
+
+    def log_state(self, thing, _id):
+        """ Returns (number of entries, ETag) of the cached log of a thing
+
+        See sync_thing_log and ItemCache.log_state.
+        """
+        if self.cache is None:
+            return 0, None
+        return self.cache.log_state(thing, _id)
+
+    def load_log(self, thing, _id, before=None, after=None, limit=None):
+        """ Returns cached log entries of a thing, newest first
+
+        See sync_thing_log and ItemCache.load_log.
+        """
+        if self.cache is None:
+            return []
+        return self.cache.load_log(thing, _id, before, after, limit)
+
+    def __cached_api_call(self, url, record=None):
+        """ GET url, answered from self.http_cache if possible
+
+        Fresh cached responses are used without a request (recorded with
+        the status "cache" in self.stats), stale ones are revalidated.
+        Concurrent calls for the same url share one request and get copies
+        of its decoded result (recorded with the status "shared").
+
+        The rate limiter is acquired before a request is shared, so an
+        interactive call never waits for a throttled background call of
+        the same url.
+        """
+        cached = self.http_cache.get(url) if self.http_cache else None
+        if cached is None or not cached.fresh():
+            start = time.time()
+            self.__acquire()
+            result, shared = self.flights.do(
+                url, lambda: self.__api_call(url, record=record, cached=cached,
+                                             store=True, limit=False))
+            if shared:
+                timing = CallTiming("get", endpoint_name(self.base_url, url))
+                timing.status = "shared"
+                timing.wait = time.time() - start
+                self.stats.record(timing)
+            return result
+
+        timing = CallTiming("get", endpoint_name(self.base_url, url))
+        timing.status = "cache"
+        start = time.time()
+        try:
+            return records.loads(record, cached.text)
+        finally:
+            timing.decode = time.time() - start
+            self.stats.record(timing)
+
+    def expire_responses(self, thing, _id):
+        """ Drops the cached and running responses about one thing"""
+        url = urljoin(self.base_url, thing, _id)
+        for u in (url, urljoin(url, "log")):
+            self.flights.forget(u)
+            if self.http_cache is not None:
+                self.http_cache.invalidate(u)
 
     def delete_thing(self, thing, _id):
         """ Delete a thing
@@ -147,13 +733,16 @@ class Lsms(object):
         self.__api_call(urljoin(self.base_url, thing, _id),
                         method="delete", to_json=False,
                         text_check="true")
+        self.expire_responses(thing, _id)
+        if self.cache is not None:
+            self.cache.remove(thing, _id)
 
     def create_thing(self, thing, data):
         """ Create a thing
 
         Args:
             thing: The type of thing (e.g. 'user', 'item', 'policy')
-            data: A dict with the data for the thing
+            data: A dict or record with the data for the thing
 
         Returns:
             A int with the id/name of the thing
@@ -164,14 +753,18 @@ class Lsms(object):
         data = self.__api_call(urljoin(self.base_url, thing),
                                method="post", data=data,
                                to_json=True)
-        return basename(data)
+        _id = basename(data)
+        self.expire_responses(thing, _id)
+        if self.cache is not None:
+            self.cache.invalidate(thing, _id)
+        return _id
 
     def update_thing(self, thing, data):
         """ Update a thing
 
         Args:
             thing: The type of thing (e.g. 'user', 'item', 'policy')
-            data: A dict with the new data for the thing
+            data: A dict or record with the new data for the thing
 
         Raises:
             LsmsException: A error occured when calling the api
@@ -179,6 +772,104 @@ class Lsms(object):
         self.__api_call(urljoin(self.base_url, thing),
                         method="put", data=data,
                         to_json=False, text_check="true")
+        self.expire_responses(thing, thing_id(thing, data))
+        if self.cache is not None:
+            self.cache.invalidate(thing, thing_id(thing, data))
+
+    def save_thing(self, thing, record, values=None):
+        """ Send the changes of a record to lsmsd
+
+        Only the fields changed since record.mark_clean() are sent if
+        partial updates are enabled. If lsmsd rejects the partial document
+        partial updates are disabled and the whole record is sent.
+
+        Afterwards the record is marked clean as of values, so fields
+        changed while the request ran are sent by the next save.
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            record: A record (see hamster.records) with the new data
+            values: record.values() when the save was started, e.g. before
+                it was passed to another thread (default: now)
+
+        Returns:
+            A list with the names of the changed fields
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        if values is None:
+            values = record.values()
+        changed = record.changed_fields(values)
+        if not changed:
+            return changed
+
+        if self.partial_updates and '_extra' not in changed:
+            id_field = ID_FIELDS.get(thing, 'Id')
+            delta = dict((f, record[f]) for f in changed if f in record)
+            delta[id_field] = record[id_field]
+            try:
+                self.update_thing(thing, delta)
+                record.mark_clean(values)
+                return changed
+            except LsmsException as e:
+                if e.status_code not in (400, 422, 501):
+                    raise
+                log.warning("Partial update rejected, sending whole "
+                            "records from now on: %s", e.status_code)
+                self.partial_updates = False
+
+        self.update_thing(thing, record)
+        record.mark_clean(values)
+        return changed
+
+    def create_many(self, thing, datas, workers=BATCH_WORKERS, retries=2):
+        """ Create many things in parallel
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            datas: A iterable with a dict with the data for every thing
+            workers: The number of parallel requests
+            retries: How often a failed request is repeated. Only
+                requests which never reached lsmsd are repeated, others
+                may have created the thing already.
+
+        Returns:
+            A list with a BatchResult for every thing (in the order of
+            datas) with the id/name of the created thing as result
+        """
+        return run_batch(lambda data: self.create_thing(thing, data),
+                         datas, workers, retries, idempotent=False)
+
+    def update_many(self, thing, datas, workers=BATCH_WORKERS, retries=2):
+        """ Update many things in parallel
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            datas: A iterable with a dict with the new data for every thing
+            workers: The number of parallel requests
+            retries: How often a failed request is repeated
+
+        Returns:
+            A list with a BatchResult for every thing (in the order of datas)
+        """
+        return run_batch(lambda data: self.update_thing(thing, data),
+                         datas, workers, retries)
+
+    def delete_many(self, thing, ids, workers=BATCH_WORKERS, retries=2):
+        """ Delete many things in parallel
+
+        Args:
+            thing: The type of thing (e.g. 'user', 'item', 'policy')
+            ids: A iterable with the ids/names of the things
+            workers: The number of parallel requests
+            retries: How often a failed request is repeated
+
+        Returns:
+            A list with a BatchResult for every thing (in the order of ids)
+        """
+        return run_batch(lambda _id: self.delete_thing(thing, _id),
+                         ids, workers, retries)
 
 
 def test(base_url):
@@ -238,8 +929,7 @@ def test(base_url):
 
     log.info("Deleting all things")
     items = l.select_all("items")
-    for item in items:
-        l.delete_thing("items", item['Id'])
+    l.delete_many("items", [item['Id'] for item in items])
 
     log.info("Deleting all users")
     users = l.select_all("users")
@@ -255,10 +945,6 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    #import cProfile
-    #stats_file = "stats.prof"
-    #cProfile.run("test()", stats_file)
-
     test(base_url)
 
     print("done")
@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+from hamster.QtVariant import QtCore, QtGui
+from hamster.search import SearchIndex, tokenize
+
+log = logging.getLogger(__name__)
+
+# number of rows which are created at once when the view needs more
+FETCH_BATCH = 256
+
+# role under which the record of a thing is available
+THING_ROLE = QtCore.Qt.UserRole + 1
+
+# number of log entries which are read from the cache at once
+LOG_PAGE_SIZE = 100
+
+
+def format_time(value):
+    """ Returns a unix timestamp as local time, other values as text"""
+    if isinstance(value, (int, float)):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(value))
+    return value or ""
+
+
+class ItemStore(object):
+    """
+    Store for the records (see hamster.records) of all loaded items.
+
+    Items are indexed by their id and by their text in a SearchIndex.
+    Every item has at most one container, the first loaded item listing
+    it in its Contains. Items which are not contained are root items.
+    Contains entries which would make an item contain itself are ignored.
+    """
+
+    def __init__(self, things=()):
+        self.things = {}
+        self.roots = []
+        # container id by item id, also for items which are not loaded yet
+        self.parents = {}
+        self.index = SearchIndex()
+        self.add(things)
+
+    def __len__(self):
+        return len(self.things)
+
+    def add(self, things):
+        """ Adds or replaces things
+
+        Works in one pass over the things and their Contains, in any order
+        (e.g. contained items before their containers).
+
+        Returns:
+            A set with the ids of former root items which are now
+            contained in one of the added things
+        """
+        demoted = set()
+        for thing in things:
+            _id = thing['Id']
+            new = _id not in self.things
+            self.things[_id] = thing
+            self.index.add(_id, thing)
+
+            for child_id in thing.get('Contains') or []:
+                if child_id in self.parents or not self.__can_contain(_id, child_id):
+                    continue
+                self.parents[child_id] = _id
+                if child_id in self.things:
+                    demoted.add(child_id)
+
+            if new and _id not in self.parents:
+                self.roots.append(_id)
+
+        if demoted:
+            self.roots = [r for r in self.roots if r not in demoted]
+        return demoted
+
+    def __can_contain(self, _id, child_id):
+        """ Returns if _id can contain child_id without a cycle"""
+        if self.is_ancestor(child_id, _id):
+            log.warning("Item %s can not contain its container %s",
+                        _id, child_id)
+            return False
+        return True
+
+    def is_ancestor(self, ancestor_id, _id):
+        """ Returns if _id is ancestor_id or contained in it"""
+        while _id is not None:
+            if _id == ancestor_id:
+                return True
+            _id = self.parents.get(_id)
+        return False
+
+    def remove(self, _id):
+        """ Removes a thing
+
+        Returns:
+            A list with the ids of the items contained in the removed item,
+            which are root items now
+        """
+        thing = self.things.pop(_id, None)
+        if thing is None:
+            return []
+
+        self.index.remove(_id)
+        if self.parents.pop(_id, None) is None:
+            self.roots.remove(_id)
+
+        promoted = []
+        for child_id in thing.get('Contains') or []:
+            if self.parents.get(child_id) == _id:
+                del self.parents[child_id]
+                if child_id in self.things:
+                    self.roots.append(child_id)
+                    promoted.append(child_id)
+        return promoted
+
+    def move(self, _id, parent_id):
+        """ Changes the container of a item in the hierarchy
+
+        Only the hierarchy is changed, not the Contains of the records.
+
+        Args:
+            _id: The id of the item
+            parent_id: The id of the new container or None for the root
+
+        Returns:
+            False if parent_id is contained in the item
+        """
+        if parent_id is not None and not self.__can_contain(parent_id, _id):
+            return False
+
+        old_parent = self.parents.pop(_id, None)
+        if old_parent is None and _id in self.things:
+            self.roots.remove(_id)
+
+        if parent_id is not None:
+            self.parents[_id] = parent_id
+        elif _id in self.things:
+            self.roots.append(_id)
+        return True
+
+    def children(self, _id):
+        """ Returns the ids of the loaded items contained in an item"""
+        if _id is None:
+            return self.roots
+
+        contains = self.things[_id].get('Contains') or []
+        return [c for c in contains
+                if c in self.things and self.parents.get(c) == _id]
+
+    def descendants(self, _id):
+        """ Returns _id and the ids of all loaded items it contains"""
+        result = []
+        stack = [_id]
+        while stack:
+            _id = stack.pop()
+            result.append(_id)
+            stack.extend(reversed(self.children(_id)))
+        return result
+
+    def with_ancestors(self, ids):
+        """ Returns the given ids together with the ids of their containers"""
+        result = set()
+        for _id in ids:
+            while _id is not None and _id not in result:
+                result.add(_id)
+                _id = self.parents.get(_id)
+        return result
+
+
+class ItemNode(object):
+    """ One row in the ItemModel"""
+    __slots__ = ('parent', 'thing_id', 'row', 'children')
+
+    def __init__(self, parent, thing_id, row):
+        self.parent = parent
+        self.thing_id = thing_id
+        self.row = row
+        self.children = []
+
+
+class ItemModel(QtCore.QAbstractItemModel):
+    """
+    Item model which creates its rows lazily.
+
+    Rows are only created in batches of FETCH_BATCH when the view asks for
+    them through canFetchMore/fetchMore, the children of an item when it
+    is expanded.
+
+    contentChanged is emitted when items were added, changed, moved or
+    removed, also if none of their rows exist yet.
+    """
+    thingChanged = QtCore.Signal(object)
+    contentChanged = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super(ItemModel, self).__init__(parent)
+        self.store = ItemStore()
+        self.root = ItemNode(None, None, 0)
+        # the created rows of every item by id
+        self.nodes = {}
+
+    def node(self, index):
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    def thing(self, index):
+        """ Returns the record of the item at index"""
+        return self.store.things[self.node(index).thing_id]
+
+    def add_things(self, things):
+        demoted = set(self.store.add(things))
+        if demoted:
+            self.__remove_root_rows(demoted)
+
+        # show new items right away if all root rows are already shown
+        if len(self.root.children) < FETCH_BATCH:
+            self.fetchMore(QtCore.QModelIndex())
+        self.contentChanged.emit()
+
+    def clear(self):
+        """ Removes all items"""
+        self.beginResetModel()
+        self.store = ItemStore()
+        self.root = ItemNode(None, None, 0)
+        self.nodes = {}
+        self.endResetModel()
+        self.contentChanged.emit()
+
+    def __remove_root_rows(self, ids):
+        for node in [n for n in self.root.children if n.thing_id in ids]:
+            self.__remove_node(node)
+
+    def __remove_node(self, node):
+        """ Removes the row of node and all rows below it"""
+        parent = node.parent
+        if parent is self.root:
+            parent_index = QtCore.QModelIndex()
+        else:
+            parent_index = self.createIndex(parent.row, 0, parent)
+
+        self.beginRemoveRows(parent_index, node.row, node.row)
+        del parent.children[node.row]
+        for row in range(node.row, len(parent.children)):
+            parent.children[row].row = row
+
+        self.__forget([node])
+        self.endRemoveRows()
+
+    def __forget(self, nodes):
+        """ Drops nodes and all nodes below them from self.nodes"""
+        stack = list(nodes)
+        while stack:
+            n = stack.pop()
+            self.nodes[n.thing_id].remove(n)
+            stack.extend(n.children)
+
+    def remove_thing(self, _id):
+        """ Removes an item and its rows"""
+        while self.nodes.get(_id):
+            self.__remove_node(self.nodes[_id][0])
+
+        promoted = self.store.remove(_id)
+        # show the former contents right away if all roots are shown
+        if promoted and len(self.root.children) >= len(self.store.roots) - len(promoted):
+            self.fetchMore(QtCore.QModelIndex(), len(promoted))
+        self.contentChanged.emit()
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        node = self.node(parent)
+        if column != 0 or row < 0 or row >= len(node.children):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        parent = index.internalPointer().parent
+        if parent is self.root:
+            return QtCore.QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.node(parent).children)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return False
+        return bool(self.store.children(self.node(parent).thing_id))
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return len(node.children) < len(self.store.children(node.thing_id))
+
+    def fetchMore(self, parent, count=FETCH_BATCH):
+        node = self.node(parent)
+        ids = self.store.children(node.thing_id)
+        start = len(node.children)
+        end = min(start + count, len(ids))
+        if start >= end:
+            return
+
+        self.beginInsertRows(parent, start, end - 1)
+        for row in range(start, end):
+            child = ItemNode(node, ids[row], row)
+            node.children.append(child)
+            self.nodes.setdefault(child.thing_id, []).append(child)
+        self.endInsertRows()
+
+    def replace_id(self, old_id, new_id):
+        """ Changes the id of a item, e.g. after it was created on lsmsd"""
+        thing = self.store.things.get(old_id)
+        if thing is None:
+            return
+
+        parent_id = self.store.parents.get(old_id)
+        self.remove_thing(old_id)
+        thing['Id'] = new_id
+        self.add_things([thing])
+
+        parent = self.store.things.get(parent_id)
+        if parent is not None:
+            parent['Contains'] = [new_id if c == old_id else c
+                                  for c in parent['Contains']]
+            self.move_thing(new_id, parent_id)
+
+    def update_thing(self, thing):
+        """ Adds a item or replaces the values of the loaded item
+
+        The loaded record is kept, so views showing it stay valid. Items
+        added to or removed from its Contains are moved.
+        """
+        _id = thing['Id']
+        old = self.store.things.get(_id)
+        if old is None:
+            self.add_things([thing])
+            return
+
+        old_contains = old.get('Contains') or []
+        new_contains = thing.get('Contains') or []
+        old.update(thing)
+        self.thing_updated(old)
+        if old_contains == new_contains:
+            return
+
+        for child_id in set(old_contains) - set(new_contains):
+            if self.store.parents.get(child_id) == _id:
+                self.__move(child_id, None)
+        for child_id in set(new_contains) - set(old_contains):
+            if self.store.parents.get(child_id) != _id:
+                self.__move(child_id, _id)
+        self.__reset_children(_id)
+
+    def move_thing(self, _id, parent_id):
+        """ Moves the rows of a item below another item
+
+        Only the hierarchy is changed, the Contains of the records have
+        to be changed by the caller.
+
+        Args:
+            _id: The id of the item
+            parent_id: The id of the new container or None for the root
+
+        Returns:
+            False if parent_id is contained in the item
+        """
+        if not self.__move(_id, parent_id):
+            return False
+        if parent_id is not None:
+            self.__reset_children(parent_id)
+        self.contentChanged.emit()
+        return True
+
+    def __move(self, _id, parent_id):
+        """ Moves a item in the store and removes its old rows
+
+        The new row below parent_id is not created.
+        """
+        if parent_id is not None and self.store.is_ancestor(_id, parent_id):
+            log.warning("Item %s can not be moved into %s", _id, parent_id)
+            return False
+
+        while self.nodes.get(_id):
+            self.__remove_node(self.nodes[_id][0])
+        self.store.move(_id, parent_id)
+
+        # show the item right away if all roots are shown
+        if (parent_id is None and _id in self.store.things and
+                len(self.root.children) == len(self.store.roots) - 1):
+            self.fetchMore(QtCore.QModelIndex(), 1)
+        return True
+
+    def __reset_children(self, _id):
+        """ Recreates the child rows of the item
+
+        As many rows as before (plus one for a moved in item) are created,
+        the view fetches the rest when needed.
+        """
+        for node in self.nodes.get(_id, []):
+            rows = len(node.children)
+            if not rows:
+                continue
+
+            index = self.createIndex(node.row, 0, node)
+            self.beginRemoveRows(index, 0, rows - 1)
+            self.__forget(node.children)
+            node.children = []
+            self.endRemoveRows()
+            self.fetchMore(index, rows + 1)
+
+    def fetch_all(self, parent=QtCore.QModelIndex()):
+        """ Creates all rows below parent at once"""
+        node = self.node(parent)
+        rest = len(self.store.children(node.thing_id)) - len(node.children)
+        if rest > 0:
+            self.fetchMore(parent, rest)
+
+    def index_of(self, _id):
+        """ Returns the index of the row of an item
+
+        The rows of its containers are created if needed.
+        """
+        chain = []
+        while _id is not None and _id not in chain:
+            chain.append(_id)
+            _id = self.store.parents.get(_id)
+
+        parent = QtCore.QModelIndex()
+        for _id in reversed(chain):
+            self.fetch_all(parent)
+            parent_node = self.node(parent)
+            nodes = [n for n in self.nodes.get(_id, [])
+                     if n.parent is parent_node]
+            if not nodes:
+                return QtCore.QModelIndex()
+            parent = self.createIndex(nodes[0].row, 0, nodes[0])
+        return parent
+
+    def reveal(self, ids):
+        """ Creates the rows of the given items and of their containers
+
+        Below every container only the rows up to the last needed one are
+        created, the other containers are not touched.
+        """
+        needed = {}
+        for _id in self.store.with_ancestors(ids):
+            needed.setdefault(self.store.parents.get(_id), set()).add(_id)
+
+        stack = [None]
+        while stack:
+            parent_id = stack.pop()
+            children = needed.get(parent_id)
+            if not children:
+                continue
+            rows = [row for row, c in enumerate(self.store.children(parent_id))
+                    if c in children]
+            if not rows:
+                continue
+            if parent_id is None:
+                parents = [QtCore.QModelIndex()]
+            else:
+                parents = [self.createIndex(n.row, 0, n)
+                           for n in self.nodes.get(parent_id, [])]
+            for parent in parents:
+                rest = rows[-1] + 1 - len(self.node(parent).children)
+                if rest > 0:
+                    self.fetchMore(parent, rest)
+            stack.extend(children)
+
+    def thing_updated(self, thing):
+        """ Updates the rows showing the given (changed) record"""
+        self.store.index.add(thing['Id'], thing)
+        for node in self.nodes.get(thing['Id'], []):
+            index = self.createIndex(node.row, 0, node)
+            self.dataChanged.emit(index, index)
+        self.contentChanged.emit()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        thing = self.thing(index)
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return thing.get('Name')
+        if role == QtCore.Qt.ToolTipRole and thing.get('Source'):
+            # the lsmsd instance of the item, see hamster.multi
+            return "%s (%s)" % (thing.get('Name'), thing['Source'])
+        if role == THING_ROLE:
+            return thing
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+
+        thing = self.thing(index)
+        thing.track()
+        thing['Name'] = value
+        self.thing_updated(thing)
+        self.thingChanged.emit(thing)
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            # items can be dropped on the viewport to make them roots
+            return QtCore.Qt.ItemIsDropEnabled
+        return (QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable |
+                QtCore.Qt.ItemIsEditable | QtCore.Qt.ItemIsDragEnabled |
+                QtCore.Qt.ItemIsDropEnabled)
+
+    def supportedDropActions(self):
+        return QtCore.Qt.MoveAction
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return "Items"
+        return None
+
+
+class ItemFilterProxyModel(QtGui.QSortFilterProxyModel):
+    """
+    Proxy model which only shows the items matching a search query and
+    their containers.
+
+    The matching ids come from the SearchIndex of the source ItemModel,
+    so changing the query only filters the existing rows. The matches are
+    searched again whenever the items of the source model change.
+    """
+
+    def __init__(self, parent=None):
+        super(ItemFilterProxyModel, self).__init__(parent)
+        self.query = ""
+        self.visible = None
+
+    def setSourceModel(self, model):
+        old = self.sourceModel()
+        if old is not None:
+            old.contentChanged.disconnect(self.refilter)
+        super(ItemFilterProxyModel, self).setSourceModel(model)
+        model.contentChanged.connect(self.refilter)
+
+    def set_query(self, query):
+        """ Shows only the items matching query
+
+        All items are shown if query has no words (e.g. it is empty or
+        only punctuation).
+        """
+        self.query = query
+        self.refilter()
+
+    def refilter(self):
+        """ Searches the matches of the query again"""
+        model = self.sourceModel()
+        if not tokenize(self.query):
+            if self.visible is None:
+                return
+            self.visible = None
+        else:
+            matches = model.store.index.search(self.query)
+            self.visible = model.store.with_ancestors(matches)
+            # the rows of matching items must exist to be shown
+            model.reveal(matches)
+
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        if self.visible is None:
+            return True
+
+        index = self.sourceModel().index(row, 0, parent)
+        return self.sourceModel().node(index).thing_id in self.visible
+
+
+class LogModel(QtCore.QAbstractTableModel):
+    """
+    Table with the log of one thing, newest entries first.
+
+    The entries are read page by page from the cache of a Lsms object when
+    the view scrolls down (see Lsms.sync_thing_log). refresh() shows
+    entries which were added to the cache later.
+    """
+    COLUMNS = ("Time", "Action", "Details")
+
+    def __init__(self, lsms, thing, _id, parent=None,
+                 page_size=LOG_PAGE_SIZE):
+        super(LogModel, self).__init__(parent)
+        self.lsms = lsms
+        self.thing = thing
+        self.id = _id
+        self.page_size = page_size
+        # tuples (position in the log, entry)
+        self.entries = []
+        self.length = lsms.log_state(thing, _id)[0]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.COLUMNS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and len(self.entries) < self.length
+
+    def fetchMore(self, parent):
+        before = self.entries[-1][0] if self.entries else None
+        page = self.lsms.load_log(self.thing, self.id, before=before,
+                                   limit=self.page_size)
+        if not page:
+            self.length = len(self.entries)
+            return
+
+        start = len(self.entries)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(page) - 1)
+        self.entries.extend(page)
+        self.endInsertRows()
+
+    def refresh(self):
+        """ Shows the entries added to the cache since the last refresh"""
+        length = self.lsms.log_state(self.thing, self.id)[0]
+        newest = self.entries[0][0] if self.entries else None
+        if newest is None or length <= newest:
+            # nothing was shown yet or the cached log was replaced
+            self.beginResetModel()
+            self.entries = []
+            self.length = length
+            self.endResetModel()
+            return
+
+        new = self.lsms.load_log(self.thing, self.id, after=newest)
+        self.length = length
+        if new:
+            self.beginInsertRows(QtCore.QModelIndex(), 0, len(new) - 1)
+            self.entries[:0] = new
+            self.endInsertRows()
+
+    def details(self, entry):
+        """ Returns the fields of a entry except Time and Action"""
+        if not isinstance(entry, dict):
+            return entry
+        return dict((k, v) for k, v in entry.items()
+                    if k not in ('Time', 'Action'))
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        entry = self.entries[index.row()][1]
+        column = index.column()
+        if role == QtCore.Qt.DisplayRole:
+            if not isinstance(entry, dict):
+                return json.dumps(entry) if column == 2 else ""
+            if column == 0:
+                return format_time(entry.get('Time'))
+            if column == 1:
+                return entry.get('Action') or ""
+            return json.dumps(self.details(entry), sort_keys=True)
+        if role == QtCore.Qt.ToolTipRole and column == 2:
+            return json.dumps(self.details(entry), sort_keys=True, indent=2)
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+from hamster.cache import ID_FIELDS
+from hamster.lsms import BATCH_WORKERS, run_batch
+from hamster.pool import imap
+from hamster.records import Record, from_dict
+from hamster.stats import RequestStats
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+log = logging.getLogger(__name__)
+
+# item ids are mapped to local id * SITE_STRIDE + index of the site, so
+# at most SITE_STRIDE lsmsd instances can be combined
+SITE_STRIDE = 1000
+
+# field added to the things to show where they are stored
+SOURCE_FIELD = 'Source'
+
+
+def parse_backends(text):
+    """ Returns a list of (name, url) tuples for a backend configuration
+
+    The configuration is a list of urls separated by whitespace or commas.
+    Every url can be named with name=url, otherwise its host and port are
+    used as name.
+
+    Raises:
+        ValueError: No url is given or a name is used twice
+    """
+    backends = []
+    for part in re.split(r'[\s,]+', text.strip()):
+        if not part:
+            continue
+        name, sep, url = part.partition('=')
+        if not sep or '/' in name:
+            url = part
+            name = urlparse(url).netloc or url
+        backends.append((name, url))
+
+    names = [name for name, _ in backends]
+    if not names:
+        raise ValueError("No lsmsd url given")
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate backend names: %s" % ", ".join(names))
+    return backends
+
+
+def split_id(_id):
+    """ Returns a tuple (local id, site index) for a global item id"""
+    _id = int(_id)
+    return _id // SITE_STRIDE, _id % SITE_STRIDE
+
+
+def sharded(thing):
+    """ Returns if the type of thing is stored on every site
+
+    Things without numeric ids (e.g. users) only exist on the first site.
+    """
+    return ID_FIELDS.get(thing, 'Id') == 'Id'
+
+
+class Site(object):
+    """
+    One lsmsd instance of a MultiLsms.
+
+    The following member variables are available
+    s.name   the name shown in the Source field of its things
+    s.index  the position of the site, part of the global ids
+    s.lsms   the Lsms object connected to the site
+    """
+
+    def __init__(self, name, index, lsms):
+        if not 0 <= index < SITE_STRIDE:
+            raise ValueError("Site index out of range: %d" % index)
+        self.name = name
+        self.index = index
+        self.lsms = lsms
+
+    def global_id(self, local_id):
+        return int(local_id) * SITE_STRIDE + self.index
+
+    def local_id(self, _id):
+        """ Returns the id on this site for a global id
+
+        Raises:
+            ValueError: The id belongs to another site
+        """
+        local_id, index = split_id(_id)
+        if local_id and index != self.index:
+            raise ValueError("Item %s is not stored on %s" % (_id, self.name))
+        return local_id
+
+    def to_global(self, thing, data):
+        """ Returns a copy of a thing from lsmsd with global ids
+
+        The name of the site is added in the Source field. data is not
+        changed, it may be cached or shared with other callers.
+        """
+        if not sharded(thing) or data is None:
+            return data
+        if isinstance(data, Record):
+            copy = from_dict(thing, data.to_dict())
+        else:
+            copy = dict(data)
+        copy['Id'] = self.global_id(data['Id'])
+        if data.get('Contains'):
+            copy['Contains'] = [self.global_id(c) for c in data['Contains']]
+        copy[SOURCE_FIELD] = self.name
+        return copy
+
+    def to_local(self, thing, data):
+        """ Returns a dict of a thing with the ids of this site
+
+        Raises:
+            ValueError: The thing or its contents are stored on another site
+        """
+        if not sharded(thing):
+            return data
+        data = data.to_dict() if isinstance(data, Record) else dict(data)
+        data.pop(SOURCE_FIELD, None)
+        data['Id'] = self.local_id(data.get('Id') or 0)
+        if data.get('Contains'):
+            data['Contains'] = [self.local_id(c) for c in data['Contains']]
+        return data
+
+    def __repr__(self):
+        return "<Site %d %s %s>" % (self.index, self.name, self.lsms.base_url)
+
+
+class MultiLsms(object):
+    """
+    Combines several lsmsd instances (e.g. one per site) to one inventory.
+
+    MultiLsms has the interface of Lsms. Items of all sites are fetched in
+    parallel and merged, their ids are made unique by encoding the index
+    of their site (see SITE_STRIDE) and the name of the site is added in
+    their Source field. Writes are sent to the site which stores the item,
+    new items to the site in their Source field or the first site. Users
+    only exist on the first site.
+
+    The order of the sites must stay the same, since it is part of the ids.
+
+        l = MultiLsms([Site("lab", 0, Lsms(lab_url)),
+                       Site("shed", 1, Lsms(shed_url))])
+        items = l.select_all("items")
+    """
+
+    def __init__(self, sites):
+        if not sites:
+            raise ValueError("MultiLsms needs at least one site")
+        self.sites = list(sites)
+        self.stats = RequestStats()
+        self.unreachable = []
+        for site in self.sites:
+            site.lsms.stats = self.stats
+
+    @property
+    def base_url(self):
+        return " ".join("%s=%s" % (s.name, s.lsms.base_url) for s in self.sites)
+
+    @property
+    def cache(self):
+        """ The ItemCache of the first site if all sites have one
+
+        Only use it to check if things are cached, the methods of
+        MultiLsms read the caches of the right sites.
+        """
+        caches = [s.lsms.cache for s in self.sites]
+        return caches[0] if None not in caches else None
+
+    @property
+    def http_cache(self):
+        """ The HttpCache of the first site if all sites have one (see cache)"""
+        caches = [s.lsms.http_cache for s in self.sites]
+        return caches[0] if None not in caches else None
+
+    def set_credentials(self, username, password):
+        """ Set the username and password for all sites"""
+        for site in self.sites:
+            site.lsms.set_credentials(username, password)
+
+    def site(self, name):
+        for site in self.sites:
+            if site.name == name:
+                return site
+        raise ValueError("Unknown site: %s" % name)
+
+    def route(self, thing, _id):
+        """ Returns a tuple (site, local id) for the id/name of a thing
+
+        Raises:
+            ValueError: The id does not belong to a site
+        """
+        if not sharded(thing):
+            return self.sites[0], _id
+        local_id, index = split_id(_id)
+        if local_id <= 0 or index >= len(self.sites):
+            raise ValueError("Item %s is not stored on any site" % _id)
+        return self.sites[index], local_id
+
+    def site_of(self, thing, data):
+        """ Returns the site a thing is stored on or should be created on"""
+        if not sharded(thing):
+            return self.sites[0]
+        if data.get(SOURCE_FIELD):
+            return self.site(data[SOURCE_FIELD])
+        if data.get('Id'):
+            return self.route(thing, data['Id'])[0]
+        return self.sites[0]
+
+    def __merge(self, method, thing, *args):
+        """ Yields the things of all sites while they are fetched in parallel
+
+        Sites which fail are logged and listed in self.unreachable.
+
+        Raises:
+            The error of the first site if all sites failed
+        """
+        if not sharded(thing):
+            for t in getattr(self.sites[0].lsms, method)(thing, *args):
+                yield t
+            return
+
+        results = queue.Queue()
+        done = object()
+
+        def fetch(site):
+            try:
+                for t in getattr(site.lsms, method)(thing, *args):
+                    results.put((site, site.to_global(thing, t), None))
+                results.put((site, done, None))
+            except Exception as e:
+                results.put((site, done, e))
+
+        for site in self.sites:
+            t = threading.Thread(target=fetch, args=(site,))
+            t.daemon = True
+            t.start()
+
+        errors = []
+        running = len(self.sites)
+        while running:
+            site, t, e = results.get()
+            if t is not done:
+                yield t
+                continue
+            running -= 1
+            if e is not None:
+                log.error("Loading %s from %s failed: %s", thing, site.name, e)
+                errors.append((site, e))
+
+        self.unreachable = [site.name for site, _ in errors]
+        if len(errors) == len(self.sites):
+            raise errors[0][1]
+
+    def iter_all(self, thing):
+        """ Yields all things of all sites, see Lsms.iter_all"""
+        return self.__merge("iter_all", thing)
+
+    def iter_sync(self, thing, *args):
+        """ Yields all things of all sites, see Lsms.iter_sync"""
+        return self.__merge("iter_sync", thing, *args)
+
+    def iter_cached(self, thing):
+        """ Yields the cached things of all sites, see Lsms.iter_cached"""
+        return self.__merge("iter_cached", thing)
+
+    def select_all(self, thing):
+        return list(self.iter_all(thing))
+
+    def sync_all(self, thing, *args):
+        return list(self.iter_sync(thing, *args))
+
+    def poll_all(self, thing, validators=None):
+        """ Fetches the things of all sites if any of them changed
+
+        See Lsms.poll_all. The validators are kept per site. Sites which
+        are unchanged or not reachable contribute their cached things.
+
+        Returns:
+            A tuple (things or None, validators)
+
+        Raises:
+            LsmsException: A site without cache failed
+        """
+        if not sharded(thing):
+            return self.sites[0].lsms.poll_all(thing, validators)
+
+        validators = validators or {}
+
+        def poll(site):
+            return site.lsms.poll_all(thing, validators.get(site.name))
+
+        new_validators = {}
+        polled = {}
+        for _, site, res, e in imap(poll, self.sites, len(self.sites)):
+            if e is not None:
+                if site.lsms.cache is None:
+                    raise e
+                log.warning("Polling %s failed: %s", site.name, e)
+                res = (None, validators.get(site.name))
+            polled[site.name], new_validators[site.name] = res
+
+        if all(things is None for things in polled.values()):
+            return None, new_validators
+
+        merged = []
+        for site in self.sites:
+            things = polled[site.name]
+            if things is None:
+                if site.lsms.cache is not None:
+                    things = site.lsms.iter_cached(thing)
+                else:
+                    things = site.lsms.select_all(thing)
+            merged.extend(site.to_global(thing, t) for t in things)
+        return merged, new_validators
+
+    def select_thing(self, thing, _id):
+        site, local_id = self.route(thing, _id)
+        return site.to_global(thing, site.lsms.select_thing(thing, local_id))
+
+    def select_thing_log(self, thing, _id):
+        site, local_id = self.route(thing, _id)
+        return site.lsms.select_thing_log(thing, local_id)
+
+    def sync_thing_log(self, thing, _id):
+        site, local_id = self.route(thing, _id)
+        return site.lsms.sync_thing_log(thing, local_id)
+
+    def log_state(self, thing, _id):
+        site, local_id = self.route(thing, _id)
+        return site.lsms.log_state(thing, local_id)
+
+    def load_log(self, thing, _id, before=None, after=None, limit=None):
+        site, local_id = self.route(thing, _id)
+        return site.lsms.load_log(thing, local_id, before, after, limit)
+
+    def expire_responses(self, thing, _id):
+        try:
+            site, local_id = self.route(thing, _id)
+        except ValueError:
+            return
+        site.lsms.expire_responses(thing, local_id)
+
+    def create_thing(self, thing, data):
+        """ Creates a thing on the site in its Source field or the first one
+
+        Returns:
+            The global id/name of the thing as string
+        """
+        site = self.site_of(thing, data)
+        _id = site.lsms.create_thing(thing, site.to_local(thing, data))
+        return str(site.global_id(_id)) if sharded(thing) else _id
+
+    def update_thing(self, thing, data):
+        site = self.site_of(thing, data)
+        site.lsms.update_thing(thing, site.to_local(thing, data))
+
+    def delete_thing(self, thing, _id):
+        site, local_id = self.route(thing, _id)
+        site.lsms.delete_thing(thing, local_id)
+
+    def save_thing(self, thing, record, values=None):
+        """ Sends a changed record to its site, see Lsms.save_thing
+
+        The whole record is always sent, partial updates are not used.
+        """
+        if values is None:
+            values = record.values()
+        changed = record.changed_fields(values)
+        if not changed:
+            return changed
+        self.update_thing(thing, record)
+        record.mark_clean(values)
+        return changed
+
+    def create_many(self, thing, datas, workers=BATCH_WORKERS, retries=2):
+        return run_batch(lambda data: self.create_thing(thing, data),
+                         datas, workers, retries, idempotent=False)
+
+    def update_many(self, thing, datas, workers=BATCH_WORKERS, retries=2):
+        return run_batch(lambda data: self.update_thing(thing, data),
+                         datas, workers, retries)
+
+    def delete_many(self, thing, ids, workers=BATCH_WORKERS, retries=2):
+        return run_batch(lambda _id: self.delete_thing(thing, _id),
+                         ids, workers, retries)
+
+
+def test(urls):
+    import time
+    from hamster.lsms import Lsms
+
+    l = MultiLsms([Site(name, n, Lsms(url))
+                   for n, (name, url) in enumerate(parse_backends(urls))])
+
+    start = time.time()
+    items = l.select_all("items")
+    log.info("%d items from %d sites in %.2fs", len(items), len(l.sites),
+             time.time() - start)
+
+    _id = l.create_thing("items", {'Id': 0, 'Name': "Neu",
+                                   SOURCE_FIELD: l.sites[-1].name})
+    log.info("Created %s on %s: %s", _id, l.route("items", _id)[0].name,
+             l.select_thing("items", _id))
+    things, validators = l.poll_all("items")
+    log.info("Polled %d items, again: %s", len(things),
+             l.poll_all("items", validators)[0])
+
+
+def test_cached_ids(url):
+    """ Merging twice from the same caches must give the same ids"""
+    import tempfile
+    from hamster.cache import ItemCache
+    from hamster.lsms import Lsms
+
+    path = tempfile.mkdtemp()
+    sites = [Site("site%d" % n, n, Lsms(url, cache=ItemCache(
+        "%s/site%d.db" % (path, n)))) for n in range(2)]
+    l = MultiLsms(sites)
+    first = sorted(t['Id'] for t in l.sync_all("items"))
+    cached = sorted(t['Id'] for t in l.iter_cached("items"))
+    again = sorted(t['Id'] for t in l.sync_all("items"))
+    assert first == cached == again, (first[:3], cached[:3], again[:3])
+    log.info("Ids stable over cache reloads: %s", first[:4])
+
+if __name__ == '__main__':
+    import signal
+    from hamster.fakelsmsd import FakeLsmsd
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    servers = [FakeLsmsd(items=100, latency=0.05).start() for _ in range(3)]
+    test(" ".join("site%d=%s" % (n, s.url) for n, s in enumerate(servers)))
+    test_cached_ids(servers[0].url)
+    for server in servers:
+        server.stop()
+
+    print("done")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+
+def imap_unordered(func, args, workers=8):
+    """
+    Calls func for every element of args in a bounded pool of threads.
+
+    Elements are read lazily from args, so at most 2 * workers calls are
+    pending at any time.
+
+    Yields:
+        Tuples (index, arg, result, exception) in the order the calls
+        finish. Exactly one of result and exception is set.
+    """
+    tasks = queue.Queue(maxsize=workers * 2)
+    results = queue.Queue()
+    stop = object()
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is stop:
+                return
+            index, arg = task
+            try:
+                results.put((index, arg, func(arg), None))
+            except Exception as e:
+                results.put((index, arg, None, e))
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    pending = 0
+    try:
+        for task in enumerate(args):
+            while True:
+                try:
+                    tasks.put(task, timeout=0.05)
+                    break
+                except queue.Full:
+                    pass
+                while not results.empty():
+                    pending -= 1
+                    yield results.get()
+            pending += 1
+
+        while pending:
+            pending -= 1
+            yield results.get()
+    finally:
+        for _ in threads:
+            tasks.put(stop)
+
+
+def imap(func, args, workers=8):
+    """ Like imap_unordered, but yields the results in the order of args"""
+    done = {}
+    expected = 0
+    for result in imap_unordered(func, args, workers):
+        done[result[0]] = result
+        while expected in done:
+            yield done.pop(expected)
+            expected += 1
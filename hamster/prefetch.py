@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from hamster.throttle import background
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+# few workers, so prefetching never takes all connections to lsmsd
+PREFETCH_WORKERS = 2
+
+
+class Prefetcher(object):
+    """
+    Loads the details and the log of things in the background before they
+    are shown.
+
+    The responses end up in the HttpCache of the Lsms object, so the
+    following select_thing calls are answered without waiting for lsmsd.
+    Logs are synced into the ItemCache of the Lsms object if it has one.
+    Every call of prefetch cancels the prefetches which are not started
+    yet, so only the things around the current selection are loaded.
+
+        prefetcher = Prefetcher(lsms)
+        prefetcher.prefetch("items", [4, 5, 3, 6])
+    """
+
+    def __init__(self, lsms, workers=PREFETCH_WORKERS, logs=True):
+        """ Starts the worker threads
+
+        Args:
+            lsms: A Lsms object with a http cache
+            workers: The number of parallel requests
+            logs: Also prefetch the logs of the things
+        """
+        self.lsms = lsms
+        self.logs = logs
+        self.lock = threading.Lock()
+        self.tasks = queue.Queue()
+        self.generation = 0
+        self.fetched = 0
+        self.threads = []
+        for _ in range(workers):
+            t = threading.Thread(target=self.__work)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def prefetch(self, thing, ids):
+        """ Replaces the pending prefetches
+
+        Args:
+            thing: The type of thing (e.g. 'items')
+            ids: The ids/names of the things, the most likely shown first
+        """
+        if self.lsms.http_cache is None:
+            return
+
+        with self.lock:
+            self.generation += 1
+            self.__drain()
+            for _id in ids:
+                self.tasks.put((self.generation, thing, _id))
+
+    def cancel(self):
+        """ Drops all prefetches which are not started yet"""
+        with self.lock:
+            self.generation += 1
+            self.__drain()
+
+    def __drain(self):
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __work(self):
+        with background():
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    return
+
+                generation, thing, _id = task
+                try:
+                    self.lsms.select_thing(thing, _id)
+                    if self.logs and generation == self.generation:
+                        self.fetch_log(thing, _id)
+                    self.fetched += 1
+                except Exception as e:
+                    log.debug("Prefetching %s/%s failed: %s", thing, _id, e)
+
+    def fetch_log(self, thing, _id):
+        """ Loads the log into the item cache or else into the http cache"""
+        if self.lsms.cache is not None:
+            self.lsms.sync_thing_log(thing, _id)
+        else:
+            self.lsms.select_thing_log(thing, _id)
+
+    def stop(self):
+        """ Cancels all prefetches and ends the worker threads"""
+        self.cancel()
+        for _ in self.threads:
+            self.tasks.put(None)
+        for t in self.threads:
+            t.join()
+
+
+def test(base_url):
+    import time
+    from hamster.httpcache import HttpCache
+    from hamster.lsms import Lsms
+
+    l = Lsms(base_url, http_cache=HttpCache(default_ttl=30))
+    prefetcher = Prefetcher(l)
+    prefetcher.prefetch("items", range(1, 50))
+    prefetcher.prefetch("items", [10, 11, 9, 12, 8])
+    time.sleep(0.5)
+    prefetcher.stop()
+    log.info("Prefetched: %d", prefetcher.fetched)
+
+    start = time.time()
+    l.select_thing("items", 10)
+    l.select_thing_log("items", 10)
+    log.info("Details and log of item 10 in %.1fms", (time.time() - start) * 1000)
+    log.info("Requests: %s", [(s.endpoint, s.statuses)
+                              for s in l.stats.snapshot()])
+
+if __name__ == '__main__':
+    import signal
+    from hamster.fakelsmsd import FakeLsmsd
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    server = FakeLsmsd(items=100, latency=0.05).start()
+    test(server.url)
+    server.stop()
+
+    print("done")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+PROFILERS = ('cprofile', 'sample')
+
+# seconds between two stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+# seconds the main thread may be blocked before a stall is reported
+STALL_THRESHOLD = 0.2
+
+# functions shown in the log after profiling
+TOP_FUNCTIONS = 20
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name,
+                         frame.f_lineno)
+
+
+def collapse(frame):
+    """ Returns the stack of frame as 'outer;...;inner' string"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler which samples the stack of one thread.
+
+    Unlike cProfile it does not slow down the profiled code, so timings
+    of the gui stay realistic. The samples are written in the collapsed
+    stack format ('outer;...;inner count' per line), which flame graph
+    tools (e.g. flamegraph.pl, speedscope) read.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        """ Creates a profiler for the current thread or thread_id"""
+        self.interval = interval
+        self.thread_id = thread_id or threading.current_thread().ident
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def __sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.__sample)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def top(self, count=TOP_FUNCTIONS):
+        """ Returns (function, samples) tuples of the most sampled functions
+
+        A function is counted once per sample it is on the stack.
+        """
+        functions = Counter()
+        for stack, n in self.stacks.items():
+            names = set(name.rsplit(':', 1)[0] for name in stack.split(';'))
+            for name in names:
+                functions[name] += n
+        return functions.most_common(count)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, n))
+
+
+def profile_call(path, profiler, func, *args, **kwargs):
+    """ Calls func with a profiler and writes the profile to path
+
+    Args:
+        path: The output file, a pstats file for 'cprofile' (see
+            python -m pstats) or collapsed stacks for 'sample'
+        profiler: 'cprofile' or 'sample'
+
+    Returns:
+        The return value of func
+    """
+    if profiler not in PROFILERS:
+        raise ValueError("Unknown profiler: %s" % profiler)
+
+    if profiler == 'sample':
+        sampler = SamplingProfiler().start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            sampler.dump(path)
+            log.info("%d samples written to %s, most sampled:\n%s",
+                     sampler.samples, path, "\n".join(
+                         "%6d %s" % (n, name) for name, n in sampler.top()))
+
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        prof.dump_stats(path)
+        log.info("Profile written to %s", path)
+        pstats.Stats(path).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+
+class Stall(object):
+    """
+    A period the watched thread was blocked.
+
+    The following member variables are available
+    s.start     unix timestamp of the last heartbeat before the stall
+    s.duration  seconds the thread was blocked (so far)
+    s.stack     the formatted stack of the thread when it was detected
+    """
+    __slots__ = ('start', 'duration', 'stack')
+
+    def __init__(self, start, duration, stack):
+        self.start = start
+        self.duration = duration
+        self.stack = stack
+
+    def __repr__(self):
+        return "<Stall %.0fms>" % (self.duration * 1000)
+
+
+class StallWatchdog(object):
+    """
+    Reports when a thread, usually the gui thread, stops beating.
+
+    The watched thread calls beat() regularly, e.g. from a QTimer with a
+    interval well below threshold. If no beat arrives for threshold
+    seconds, the stack of the watched thread is logged, which shows the
+    handler blocking the event loop. The stall is logged again with its
+    total duration when the thread beats again.
+
+        watchdog = StallWatchdog(0.2).start()
+        timer.timeout.connect(watchdog.beat)
+    """
+
+    def __init__(self, threshold=STALL_THRESHOLD, thread_id=None):
+        """ Creates a watchdog for the current thread or thread_id"""
+        self.threshold = threshold
+        self.thread_id = thread_id or threading.current_thread().ident
+        self.last_beat = time.time()
+        self.stalls = []
+        self.running = False
+        self.thread = None
+
+    def beat(self):
+        self.last_beat = time.time()
+
+    def __watch(self):
+        stall = None
+        while self.running:
+            time.sleep(self.threshold / 4)
+            last_beat = self.last_beat
+            blocked = time.time() - last_beat
+
+            if stall is not None and stall.start != last_beat:
+                stall.duration = last_beat - stall.start
+                log.warning("Main thread was blocked for %.0fms",
+                            stall.duration * 1000)
+                stall = None
+            if stall is not None:
+                stall.duration = blocked
+            elif blocked > self.threshold:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                stall = Stall(last_beat, blocked, stack)
+                self.stalls.append(stall)
+                log.warning("Main thread blocked for %.0fms in:\n%s",
+                            blocked * 1000, stack)
+
+    def start(self):
+        self.beat()
+        self.running = True
+        self.thread = threading.Thread(target=self.__watch)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def test():
+    import tempfile
+
+    def busy(seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            sum(range(1000))
+
+    def handler():
+        busy(0.2)
+        time.sleep(0.3)
+
+    def idle():
+        for _ in range(10):
+            watchdog.beat()
+            time.sleep(0.02)
+
+    watchdog = StallWatchdog(0.1).start()
+    idle()
+    handler()
+    idle()
+    watchdog.stop()
+    log.info("Stalls: %s", watchdog.stalls)
+
+    path = os.path.join(tempfile.mkdtemp(), "test.stacks")
+    profile_call(path, 'sample', handler)
+    profile_call(path + ".prof", 'cprofile', busy, 0.1)
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
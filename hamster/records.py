@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Missing(object):
+    """ Marker for fields which are not set in a record"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __reduce__(self):
+        # copies and pickles of records must keep the singleton
+        return "MISSING"
+
+MISSING = Missing()
+
+
+def freeze(value):
+    """ Returns a hashable copy of a field value"""
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+
+class Record(object):
+    """
+    Compact representation of one thing of the lsmsd api.
+
+    Subclasses list the known fields of the thing in FIELDS. Unknown
+    fields sent by lsmsd are kept in a dict, so records can be sent back
+    without losing data. Records can be used like the dicts returned by
+    the api (record['Name'], record.get('Contains'), record.items()).
+
+    The values of all fields are remembered when the record is marked as
+    clean, so the changed fields can be found cheaply. Records are not
+    tracked until then, to keep them small.
+    """
+    __slots__ = ('_extra', '_snapshot')
+    FIELDS = ()
+
+    def __init__(self, **fields):
+        self._extra = None
+        for field in self.FIELDS:
+            setattr(self, field, fields.pop(field, MISSING))
+        if fields:
+            self._extra = fields
+        self._snapshot = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Creates a record from a dict decoded from json"""
+        return cls(**data)
+
+    def to_dict(self):
+        """ Returns a dict which can be encoded to json for the api"""
+        data = dict(self._extra or ())
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                data[field] = value
+        return data
+
+    def keys(self):
+        return [k for k, v in self.items()]
+
+    def items(self):
+        items = [(f, getattr(self, f)) for f in self.FIELDS]
+        items = [(f, v) for f, v in items if v is not MISSING]
+        return items + list((self._extra or {}).items())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not MISSING:
+                return value
+        elif self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def values(self):
+        """ Returns a tuple with the frozen values of all fields"""
+        return (tuple(freeze(getattr(self, f)) for f in self.FIELDS) +
+                (freeze(self._extra or {}),))
+
+    def fingerprint(self):
+        """ Returns a hash over the values of all fields"""
+        return hash(self.values())
+
+    def diff(self, other):
+        """ Returns the names of the fields which differ from other"""
+        return [f for f, a, b in zip(self.FIELDS + ('_extra',),
+                                     self.values(), other.values())
+                if a != b]
+
+    def update(self, other):
+        """ Replaces all values with those of the record other
+
+        A tracked record stays tracked with the new values as unchanged.
+        """
+        for field in self.FIELDS:
+            setattr(self, field, getattr(other, field))
+        self._extra = dict(other._extra) if other._extra else None
+        if self._snapshot is not None:
+            self.mark_clean()
+
+    def mark_clean(self, values=None):
+        """ Remembers the current values as unchanged
+
+        Pass the values() taken when a save was started, so the fields
+        changed while it ran stay changed.
+        """
+        self._snapshot = values if values is not None else self.values()
+
+    def track(self):
+        """ Starts tracking changes if the record is not tracked yet"""
+        if self._snapshot is None:
+            self.mark_clean()
+
+    def changed_fields(self, values=None):
+        """ Returns the names of the fields changed since mark_clean
+
+        All set fields are returned if the record was never marked clean.
+        If values (see values()) are given, the fields which had changed
+        when they were taken are returned.
+        """
+        values = values if values is not None else self.values()
+        if self._snapshot is None:
+            return [f for f, v in zip(self.FIELDS, values) if v is not MISSING]
+        return [f for f, a, b in zip(self.FIELDS + ('_extra',),
+                                     values, self._snapshot)
+                if a != b]
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    # records are mutable, use fingerprint() to hash the content
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % item for item in self.items()))
+
+
+class Item(Record):
+    FIELDS = ('Id', 'Name', 'Description', 'Contains', 'Owner',
+              'Maintainer', 'Usage')
+    __slots__ = FIELDS
+
+
+class User(Record):
+    FIELDS = ('Name', 'EMail', 'Password')
+    __slots__ = FIELDS
+
+
+RECORD_TYPES = {
+    'items': Item,
+    'users': User,
+}
+
+
+def from_dict(thing, data):
+    """ Converts a dict of the given type of thing to a record if possible"""
+    cls = RECORD_TYPES.get(thing)
+    if cls is None or not isinstance(data, dict):
+        return data
+    return cls.from_dict(data)
+
+
+def loads(thing, text):
+    """ Decodes a json document with one or a list of things to records"""
+    data = json.loads(text)
+    if isinstance(data, list):
+        return [from_dict(thing, d) for d in data]
+    return from_dict(thing, data)
+
+
+def encode(obj):
+    """ json default function which encodes records as dicts"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def test():
+    item = loads("items", '{"Id": 1, "Name": "Prusarotti", "Contains": [2]}')
+    log.info("Item: %r", item)
+
+    item.mark_clean()
+    item['Maintainer'] = "hans"
+    item['Contains'].append(3)
+    log.info("Changed fields: %s", item.changed_fields())
+    log.info("Json: %s", json.dumps(item, default=encode))
+
+    # a change made while a save runs stays changed
+    values = item.values()
+    item['Name'] = "Prusa"
+    item.mark_clean(values)
+    log.info("Changed after save: %s", item.changed_fields())
+
+    other = Item.from_dict(item.to_dict())
+    log.info("Equal: %s, diff: %s", item == other, item.diff(other))
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# fields of a item which are searched
+SEARCH_FIELDS = ('Name', 'Description', 'Usage', 'Owner', 'Maintainer')
+
+# shorter terms only match the beginning of words
+SUBSTRING_MIN_LENGTH = 3
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """ Returns the set of lower case words in text"""
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+class SearchIndex(object):
+    """
+    In-memory inverted index over the text fields of items.
+
+    Every word of the SEARCH_FIELDS points to the ids of the items which
+    contain it. The words are kept sorted, so prefix queries only look at
+    the matching range of words. Terms with at least SUBSTRING_MIN_LENGTH
+    characters also match inside of words, which scans the words (not the
+    items).
+    """
+
+    def __init__(self, fields=SEARCH_FIELDS):
+        self.fields = fields
+        self.postings = {}
+        self.words = []
+        self.tokens = {}
+        # words matching the last queried term, see __matching_words
+        self.last_term = None
+        self.last_words = []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, _id, thing):
+        """ Adds or replaces a item in the index"""
+        if _id in self.tokens:
+            self.remove(_id)
+
+        tokens = set()
+        for field in self.fields:
+            value = thing.get(field)
+            if value:
+                tokens |= tokenize(value)
+
+        for token in tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                bisect.insort(self.words, token)
+                self.last_term = None
+            ids.add(_id)
+        self.tokens[_id] = tokens
+
+    def remove(self, _id):
+        """ Removes a item from the index"""
+        for token in self.tokens.pop(_id, ()):
+            ids = self.postings[token]
+            ids.discard(_id)
+            if not ids:
+                del self.postings[token]
+                del self.words[bisect.bisect_left(self.words, token)]
+                self.last_term = None
+
+    def __matching_words(self, term):
+        """ Returns the words which start with or contain term"""
+        start = bisect.bisect_left(self.words, term)
+        end = bisect.bisect_left(self.words, term + u'\uffff')
+        words = set(self.words[start:end])
+        if len(term) < SUBSTRING_MIN_LENGTH:
+            return words
+
+        # the words containing a longer term are a subset of the last words
+        if self.last_term and self.last_term in term:
+            candidates = self.last_words
+        else:
+            candidates = self.words
+        words.update(w for w in candidates if term in w)
+
+        self.last_term = term
+        self.last_words = list(words)
+        return words
+
+    def search(self, query):
+        """ Returns the set of ids of the items matching all words in query"""
+        result = None
+        for term in sorted(tokenize(query), key=len, reverse=True):
+            ids = set()
+            for word in self.__matching_words(term):
+                ids |= self.postings[word]
+
+            result = ids if result is None else result & ids
+            if not result:
+                break
+
+        return result if result is not None else set()
+
+
+def test():
+    import time
+
+    index = SearchIndex()
+    index.add(1, {'Name': "Prusarotti", 'Description': "Prusa Mendel 3D-Drucker",
+                  'Maintainer': "hans"})
+    index.add(2, {'Name': "Lasercutter", 'Owner': "franz"})
+    index.add(3, {'Name': "Drehbank", 'Maintainer': "hans"})
+
+    log.info("'pru': %s", index.search("pru"))
+    log.info("'cut': %s", index.search("cut"))
+    log.info("'hans dreh': %s", index.search("hans dreh"))
+
+    index.remove(3)
+    log.info("'hans': %s", index.search("hans"))
+
+    for i in range(100000):
+        index.add(i + 10, {'Name': "Schraube M%d" % i,
+                           'Description': "Box %d" % (i % 1000)})
+
+    start = time.time()
+    result = index.search("box 12")
+    log.info("'box 12': %d results in %.1fms", len(result),
+             (time.time() - start) * 1000)
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.DEBUG)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+PHASES = ('wait', 'download', 'decode')
+
+# path segments which are ids/names of things
+ID_SEGMENT_RE = re.compile(r'^(items|users|policies)/[^/]+')
+
+
+def endpoint_name(base_url, url):
+    """ Returns the api endpoint of url with the id replaced by {id}"""
+    path = url[len(base_url):] if url.startswith(base_url) else url
+    path = path.strip('/').split('?')[0]
+    return ID_SEGMENT_RE.sub(lambda m: m.group(1) + "/{id}", path)
+
+
+class CallTiming(object):
+    """
+    Timing of one api call.
+
+    The following member variables are available
+    t.method     the http method
+    t.endpoint   the endpoint (see endpoint_name)
+    t.status     the http status code or None on connection errors
+    t.connected  True if a new connection was opened for the call
+    t.wait       seconds until the response headers arrived, including
+                 connecting and sending the request
+    t.download   seconds to read the response body
+    t.decode     seconds to decode the json response
+    t.sent       bytes of the request body
+    t.received   bytes of the response body
+    t.error      the exception if the call failed
+    """
+    __slots__ = ('method', 'endpoint', 'status', 'connected', 'wait',
+                 'download', 'decode', 'sent', 'received', 'error')
+
+    def __init__(self, method, endpoint):
+        self.method = method
+        self.endpoint = endpoint
+        self.status = None
+        self.connected = False
+        self.wait = 0.0
+        self.download = 0.0
+        self.decode = 0.0
+        self.sent = 0
+        self.received = 0
+        self.error = None
+
+    @property
+    def total(self):
+        return self.wait + self.download + self.decode
+
+    def __repr__(self):
+        return "<CallTiming %s %s %s %.1fms>" % (
+            self.method.upper(), self.endpoint, self.status, self.total * 1000)
+
+
+class EndpointStats(object):
+    """ Aggregated timings of one endpoint"""
+
+    def __init__(self, method, endpoint):
+        self.method = method
+        self.endpoint = endpoint
+        self.calls = 0
+        self.errors = 0
+        self.connects = 0
+        self.statuses = {}
+        self.seconds = dict((phase, 0.0) for phase in PHASES)
+        self.max_total = 0.0
+        self.sent = 0
+        self.received = 0
+
+    def add(self, timing):
+        self.calls += 1
+        if timing.error is not None:
+            self.errors += 1
+        if timing.connected:
+            self.connects += 1
+        self.statuses[timing.status] = self.statuses.get(timing.status, 0) + 1
+        for phase in PHASES:
+            self.seconds[phase] += getattr(timing, phase)
+        self.max_total = max(self.max_total, timing.total)
+        self.sent += timing.sent
+        self.received += timing.received
+
+    def average(self, phase):
+        return self.seconds[phase] / self.calls if self.calls else 0.0
+
+
+class RequestStats(object):
+    """
+    Collects the CallTimings of Lsms api calls per endpoint.
+
+    Additional hooks can be registered, which are called with every
+    CallTiming.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, timing):
+        key = (timing.method, timing.endpoint)
+        with self.lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats(*key)
+            stats.add(timing)
+
+        for hook in self.hooks:
+            try:
+                hook(timing)
+            except Exception:
+                log.exception("Stats hook %r failed", hook)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def snapshot(self):
+        """ Returns the EndpointStats sorted by the total time spent"""
+        with self.lock:
+            endpoints = list(self.endpoints.values())
+        return sorted(endpoints, key=lambda s: -sum(s.seconds.values()))
+
+    def prometheus(self):
+        """ Returns the stats in the prometheus text format"""
+        lines = [
+            "# TYPE hamster_requests_total counter",
+            "# TYPE hamster_request_errors_total counter",
+            "# TYPE hamster_request_connects_total counter",
+            "# TYPE hamster_request_seconds_total counter",
+            "# TYPE hamster_request_bytes_total counter",
+        ]
+        for s in self.snapshot():
+            labels = 'method="%s",endpoint="%s"' % (s.method, s.endpoint)
+            for status, count in sorted(s.statuses.items(), key=str):
+                lines.append('hamster_requests_total{%s,status="%s"} %d' % (
+                    labels, status or "", count))
+            lines.append("hamster_request_errors_total{%s} %d" % (labels, s.errors))
+            lines.append("hamster_request_connects_total{%s} %d" % (labels, s.connects))
+            for phase in PHASES:
+                lines.append('hamster_request_seconds_total{%s,phase="%s"} %f' % (
+                    labels, phase, s.seconds[phase]))
+            lines.append('hamster_request_bytes_total{%s,direction="sent"} %d' % (
+                labels, s.sent))
+            lines.append('hamster_request_bytes_total{%s,direction="received"} %d' % (
+                labels, s.received))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# priorities of api calls, see RateLimiter
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# part of the burst background calls leave for interactive ones
+RESERVE = 0.5
+
+local = threading.local()
+
+
+def current_priority():
+    """ Returns the priority of the api calls of the current thread"""
+    return getattr(local, 'priority', INTERACTIVE)
+
+
+@contextmanager
+def priority(value):
+    """ Sets the priority of the api calls made by the current thread
+
+        with priority(BACKGROUND):
+            lsms.select_thing("items", 4)
+    """
+    old = current_priority()
+    local.priority = value
+    try:
+        yield
+    finally:
+        local.priority = old
+
+
+def background():
+    """ Marks the api calls of the current thread as background calls"""
+    return priority(BACKGROUND)
+
+
+class Flight(object):
+    """ One call of SingleFlight.do, shared by all concurrent callers"""
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Lets concurrent calls with the same key share one execution.
+
+    The first caller of a key runs the function, callers arriving while
+    it runs wait for it and get a deep copy of its result (or the same
+    exception). Every caller can change its result without affecting the
+    others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, func):
+        """ Calls func unless a call with key is already running
+
+        Returns:
+            A tuple (result, shared), shared is True if the result of
+            another caller was used
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result), True
+
+        result = None
+        try:
+            result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            # no caller can join anymore, the waiters copy a result the
+            # leader does not hand out
+            if flight.waiters:
+                flight.result = copy.deepcopy(result)
+            flight.done.set()
+        return result, False
+
+    def forget(self, key):
+        """ Lets later callers of key start a new call
+
+        Used when the running call may return outdated data, e.g. after
+        the thing was changed.
+        """
+        with self.lock:
+            self.flights.pop(key, None)
+
+
+class RateLimiter(object):
+    """
+    Token bucket limiting the requests sent to lsmsd.
+
+    The bucket holds up to burst tokens and is refilled with rate tokens
+    per second, every request takes one. Background calls (see
+    background()) leave a reserve of the burst and wait while interactive
+    calls are waiting, so clicks stay fast while prefetches or scripts use
+    up the rate.
+
+        limiter = RateLimiter(10, burst=20)
+        limiter.acquire()
+    """
+
+    def __init__(self, rate, burst=None, reserve=RESERVE):
+        """ Creates a full bucket
+
+        Args:
+            rate: Requests per second
+            burst: Requests which can be sent at once (default: rate)
+            reserve: Part of the burst only interactive calls can use
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.reserve = self.burst * reserve
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.cond = threading.Condition()
+        self.interactive_waiting = 0
+
+    def __refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=None):
+        """ Blocks until a request may be sent
+
+        Args:
+            priority: INTERACTIVE or BACKGROUND (default: the priority of
+                the current thread, see priority())
+
+        Returns:
+            The seconds waited
+        """
+        interactive = (priority or current_priority()) == INTERACTIVE
+        # a small bucket can not hold the reserve, background calls must
+        # still get in once it is full
+        needed = 1.0 if interactive else min(1.0 + self.reserve, self.burst)
+        start = time.time()
+        with self.cond:
+            if interactive:
+                self.interactive_waiting += 1
+            try:
+                while True:
+                    self.__refill()
+                    if self.tokens >= needed and (
+                            interactive or not self.interactive_waiting):
+                        self.tokens -= 1
+                        break
+                    self.cond.wait(max(needed - self.tokens, 0.05) / self.rate)
+            finally:
+                if interactive:
+                    self.interactive_waiting -= 1
+                    self.cond.notify_all()
+
+        waited = time.time() - start
+        if waited > 0.01:
+            log.debug("Rate limited %s call for %.0fms",
+                      INTERACTIVE if interactive else BACKGROUND,
+                      waited * 1000)
+        return waited
+
+
+def test():
+    limiter = RateLimiter(20, burst=10)
+    waits = {INTERACTIVE: [], BACKGROUND: []}
+
+    def client(prio, count):
+        with priority(prio):
+            for _ in range(count):
+                waits[prio].append(limiter.acquire())
+
+    threads = [threading.Thread(target=client, args=(BACKGROUND, 30))
+               for _ in range(3)]
+    threads.append(threading.Thread(target=client, args=(INTERACTIVE, 10)))
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    log.info("100 requests in %.1fs", time.time() - start)
+    for prio, w in waits.items():
+        log.info("%s: max wait %.0fms", prio, max(w) * 1000)
+
+    flights = SingleFlight()
+    results = []
+
+    def slow():
+        time.sleep(0.1)
+        return {'Id': 1}
+
+    threads = [threading.Thread(target=lambda: results.append(
+        flights.do("items/1", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    log.info("Shared results: %d of %d, distinct: %d",
+             sum(1 for _, shared in results if shared), len(results),
+             len(set(id(r) for r, _ in results)))
+    assert len(set(id(r) for r, _ in results)) == len(results)
+
+    # the bucket of a low rate is too small for the reserve
+    limiter = RateLimiter(1)
+    start = time.time()
+    with background():
+        for _ in range(3):
+            limiter.acquire()
+    log.info("3 background requests at rate 1 in %.1fs", time.time() - start)
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.INFO)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    test()
+
+    print("done")
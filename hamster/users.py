@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import logging
+import threading
+import time
+from hamster.throttle import background
+
+log = logging.getLogger(__name__)
+
+# seconds after which the users are fetched again
+USERS_TTL = 10 * 60
+
+# names returned by UserDirectory.complete by default
+COMPLETE_LIMIT = 50
+
+
+class UserDirectory(object):
+    """
+    Local directory of the lsmsd users, e.g. for the owner/maintainer
+    completion.
+
+    The users are fetched at once by refresh(), which should run in the
+    background. Lookups and completions never call the api: the user names
+    are kept sorted by their lower case form, so prefix completions are a
+    binary search. The directory is stale after ttl seconds, the last
+    known users are used until the next refresh succeeds.
+
+        directory = UserDirectory(lsms)
+        directory.refresh()
+        directory.complete("be")  # ['bernd', 'Berta']
+    """
+
+    def __init__(self, lsms, ttl=USERS_TTL):
+        self.lsms = lsms
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.users = {}
+        # lower case names and names in the same order
+        self.keys = []
+        self.names = []
+        self.loaded = None
+
+    def __len__(self):
+        return len(self.users)
+
+    def set_users(self, users):
+        """ Replaces the known users with a list of user records or dicts"""
+        users = dict((u['Name'], u) for u in users if u.get('Name'))
+        names = sorted(users, key=lambda name: (name.lower(), name))
+        keys = [name.lower() for name in names]
+        with self.lock:
+            self.users = users
+            self.names = names
+            self.keys = keys
+            self.loaded = time.time()
+
+    def stale(self):
+        """ Returns if the users should be fetched again"""
+        return self.loaded is None or time.time() - self.loaded > self.ttl
+
+    def expire(self):
+        """ Makes the directory stale, e.g. after a user was created"""
+        self.loaded = None
+
+    def refresh(self):
+        """ Fetches the users (blocking)
+
+        The ItemCache of the Lsms object is used if it is younger than the
+        ttl, so the users are available right after a restart.
+
+        Returns:
+            The number of users
+
+        Raises:
+            LsmsException: A error occured when calling the api
+        """
+        with background():
+            self.set_users(self.lsms.sync_all("users", self.ttl))
+        log.debug("%d users loaded", len(self.users))
+        return len(self.users)
+
+    def get(self, name):
+        """ Returns the user record with name or None"""
+        return self.users.get(name)
+
+    def complete(self, prefix, limit=COMPLETE_LIMIT):
+        """ Returns the names starting with prefix (case insensitive)"""
+        prefix = prefix.lower()
+        with self.lock:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + u'\uffff', start,
+                                     min(start + limit, len(self.keys)))
+            return self.names[start:end]
+
+
+def test(base_url):
+    from hamster.lsms import Lsms
+
+    l = Lsms(base_url)
+    for n in range(2000):
+        l.create_thing("users", {'Name': "user%04d" % n,
+                                 'EMail': "user%04d@example.com" % n,
+                                 'Password': "secret"})
+
+    directory = UserDirectory(l)
+    start = time.time()
+    log.info("Users: %d in %.1fms", directory.refresh(),
+             (time.time() - start) * 1000)
+
+    start = time.time()
+    for _ in range(1000):
+        names = directory.complete("User01")
+    log.info("Completions: %s (%.3fms per call)", names[:3],
+             (time.time() - start))
+    log.info("user0042: %r", directory.get("user0042"))
+
+if __name__ == '__main__':
+    import signal
+    from hamster.fakelsmsd import FakeLsmsd
+
+    logging.basicConfig(level=logging.INFO)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    server = FakeLsmsd().start()
+    test(server.url)
+    server.stop()
+
+    print("done")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load generator simulating many hamster clients working with one lsmsd.
+
+    python loadgen.py --clients 200 --duration 60
+    python loadgen.py --url http://lsmsd:8080/ --clients 50
+
+Every client loads all items on start and then repeats a mix of the
+operations of the gui with a random think time in between: browsing
+(select_thing and select_thing_log of a item), polling for changes
+(poll_all), edits (update_thing) and reloads (select_all). The latency
+percentiles and error rates are reported per endpoint.
+
+Without --url a local fake lsmsd is started. Edits write the items back
+unchanged, so a real inventory keeps its data (lsmsd still logs them).
+"""
+
+import argparse
+import logging
+import math
+import random
+import sys
+import threading
+import time
+from hamster.fakelsmsd import FakeLsmsd
+from hamster.lsms import Lsms
+from hamster.stats import RequestStats
+
+log = logging.getLogger(__name__)
+
+# operations of a client after the start and their default weights
+OPERATIONS = ('browse', 'poll', 'edit', 'reload')
+DEFAULT_MIX = "browse=70,poll=20,edit=8,reload=2"
+
+PERCENTILES = (50, 90, 99)
+
+
+def parse_mix(text):
+    """ Returns a dict with the weights of a mix like 'browse=70,edit=5'
+
+    Raises:
+        ValueError: A operation is unknown or a weight is not a number
+    """
+    mix = dict((op, 0.0) for op in OPERATIONS)
+    for part in text.split(','):
+        op, _, weight = part.strip().partition('=')
+        if op not in mix:
+            raise ValueError("Unknown operation: %s" % op)
+        mix[op] = float(weight)
+    if not sum(mix.values()) > 0:
+        raise ValueError("The mix needs a positive weight")
+    return mix
+
+
+def percentile(values, p):
+    """ Returns the p-th percentile (nearest rank) of sorted values"""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p * len(values) / 100.0)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class LatencyRecorder(object):
+    """
+    RequestStats hook keeping the latency of every call per endpoint.
+
+    RequestStats only keeps sums, percentiles need all values.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+
+    def __call__(self, timing):
+        key = (timing.method, timing.endpoint)
+        with self.lock:
+            self.latencies.setdefault(key, []).append(timing.total)
+
+    def percentiles(self, method, endpoint, ps=PERCENTILES):
+        """ Returns the latencies of the percentiles ps and the maximum"""
+        with self.lock:
+            values = sorted(self.latencies.get((method, endpoint), ()))
+        return [percentile(values, p) for p in ps] + [
+            values[-1] if values else 0.0]
+
+
+class SimulatedClient(object):
+    """
+    One simulated hamster client with its own connections to lsmsd.
+
+    The following member variables are available
+    c.operations  dict with the number of finished operations by name
+    c.failures    the number of operations which raised an exception
+    """
+
+    def __init__(self, url, stats, mix, think_time, seed=None,
+                 username=None, password=None):
+        # errors should be counted, not hidden by retries
+        self.lsms = Lsms(url, username, password, pool_size=1, retries=0)
+        self.lsms.stats = stats
+        self.mix = mix
+        self.think_time = think_time
+        self.random = random.Random(seed)
+        self.ids = []
+        self.validators = None
+        self.operations = dict((op, 0) for op in ('startup',) + OPERATIONS)
+        self.failures = 0
+
+    def think(self, deadline):
+        pause = self.random.expovariate(1.0 / self.think_time)
+        time.sleep(max(min(pause, deadline - time.time()), 0))
+
+    def choose(self):
+        ops = [op for op in OPERATIONS if self.mix[op] > 0]
+        pick = self.random.uniform(0, sum(self.mix[op] for op in ops))
+        for op in ops:
+            pick -= self.mix[op]
+            if pick <= 0:
+                return op
+        return ops[-1]
+
+    def startup(self):
+        self.ids = [item['Id'] for item in self.lsms.select_all("items")]
+
+    def browse(self):
+        _id = self.random.choice(self.ids)
+        self.lsms.select_thing("items", _id)
+        self.lsms.select_thing_log("items", _id)
+
+    def poll(self):
+        things, self.validators = self.lsms.poll_all("items", self.validators)
+        if things is not None:
+            self.ids = [item['Id'] for item in things]
+
+    def edit(self):
+        item = self.lsms.select_thing("items", self.random.choice(self.ids))
+        self.lsms.update_thing("items", item)
+
+    def reload(self):
+        self.startup()
+
+    def run(self, deadline):
+        """ Works until the unix timestamp deadline"""
+        while time.time() < deadline:
+            op = self.choose() if self.ids else 'startup'
+            try:
+                getattr(self, op)()
+                self.operations[op] += 1
+            except Exception as e:
+                log.debug("%s failed: %s", op, e)
+                self.failures += 1
+            self.think(deadline)
+        self.lsms.s.close()
+
+
+def run_load(url, clients, duration, mix, think_time=1.0, ramp_up=0.0,
+             username=None, password=None, seed=None):
+    """ Runs clients simulated clients against the lsmsd at url
+
+    The clients are started evenly spread over ramp_up seconds and stop
+    duration seconds after the start.
+
+    Returns:
+        A tuple (RequestStats, LatencyRecorder, list of SimulatedClients)
+    """
+    stats = RequestStats()
+    recorder = LatencyRecorder()
+    stats.add_hook(recorder)
+
+    rnd = random.Random(seed)
+    deadline = time.time() + duration
+    sims = [SimulatedClient(url, stats, mix, think_time, rnd.random(),
+                            username, password) for _ in range(clients)]
+    threads = []
+    for n, sim in enumerate(sims):
+        t = threading.Thread(target=sim.run, args=(deadline,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+        if ramp_up and n < clients - 1:
+            time.sleep(ramp_up / clients)
+
+    for t in threads:
+        t.join()
+    return stats, recorder, sims
+
+
+def print_report(stats, recorder, sims, seconds):
+    calls = sum(s.calls for s in stats.snapshot())
+    names = ('startup',) + OPERATIONS
+    operations = dict((op, sum(s.operations[op] for s in sims)) for op in names)
+    print("%d clients, %d requests in %.1fs (%.1f/s), %d failed operations" % (
+        len(sims), calls, seconds, calls / seconds,
+        sum(s.failures for s in sims)))
+    print("operations: %s" % ", ".join(
+        "%s %d" % (op, operations[op]) for op in names))
+    print("")
+    print("%-6s %-16s %8s %7s %8s %8s %8s %8s" % (
+        "method", "endpoint", "calls", "errors", "p50 ms", "p90 ms",
+        "p99 ms", "max ms"))
+    for s in sorted(stats.snapshot(), key=lambda s: (s.endpoint, s.method)):
+        latencies = recorder.percentiles(s.method, s.endpoint)
+        print("%-6s %-16s %8d %6.2f%% %8.1f %8.1f %8.1f %8.1f" % tuple(
+            [s.method.upper(), s.endpoint, s.calls,
+             100.0 * s.errors / s.calls] + [l * 1000 for l in latencies]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="lsmsd to load (default: a local fake lsmsd)")
+    parser.add_argument("--user", help="username for the real lsmsd")
+    parser.add_argument("--password", help="password for the real lsmsd")
+    parser.add_argument("--clients", type=int, default=100,
+                        help="simulated clients (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds to run (default: %(default)s)")
+    parser.add_argument("--ramp-up", type=float, default=5,
+                        help="seconds over which the clients start (default: %(default)s)")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="mean seconds between two operations of a client "
+                             "(default: %(default)s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="weights of the operations (default: %(default)s)")
+    parser.add_argument("--seed", type=int, help="seed for repeatable runs")
+    parser.add_argument("--items", type=int, default=2000,
+                        help="size of the fake inventory (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="fake request latency in ms (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        stream=sys.stderr)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = None
+    url = args.url
+    if not url:
+        server = FakeLsmsd(items=args.items, latency=args.latency / 1000.0)
+        url = server.start().url
+        print("fake lsmsd with %d items and %.1fms latency" % (
+            args.items, args.latency))
+
+    try:
+        start = time.time()
+        stats, recorder, sims = run_load(
+            url, args.clients, args.duration, mix, args.think_time,
+            args.ramp_up, args.user, args.password, args.seed)
+        print_report(stats, recorder, sims, time.time() - start)
+    finally:
+        if server:
+            server.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
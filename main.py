@@ -1,30 +1,106 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import logging
+import os
 import sys
-from hamster.QtVariant import QtGui
+from hamster.QtVariant import QtCore, QtGui
+from hamster.asynclsms import AsyncLsms
 from hamster.items import ItemsWidget
-from hamster.dialogs import LoginDialog, NewUserDialog
-from hamster.lsms import Lsms, LsmsException
+from hamster.dialogs import LoginDialog, NewUserDialog, StatsDialog
+from hamster.cache import ItemCache
+from hamster.httpcache import HttpCache
+from hamster.journal import OperationJournal
+from hamster.labels import iter_labels
+from hamster.livefeed import ChangeFeed
+from hamster.prefetch import Prefetcher
+from hamster.profiling import (PROFILERS, STALL_THRESHOLD, StallWatchdog,
+                               profile_call)
+from hamster.throttle import RateLimiter
+from hamster.users import UserDirectory
+from hamster.lsms import Lsms, LsmsException, never_sent, retryable
+from hamster.multi import MultiLsms, Site, parse_backends
 
 log = logging.getLogger(__name__)
 
+# lsmsd used if no url is given
+DEFAULT_URL = "http://localhost:8080/"
+# milliseconds between the attempts to send journaled changes
+REPLAY_INTERVAL = 30000
+# seconds cached responses are used without asking lsmsd
+HTTP_CACHE_TTL = 30
+# requests per second and burst sent to every lsmsd instance
+REQUEST_RATE = 20
+REQUEST_BURST = 40
+# milliseconds between the checks if the users are stale
+USERS_CHECK_INTERVAL = 60000
+
+
+def connect_lsms(url, partial_updates=False):
+    """ Returns a Lsms object with caches for the lsmsd at url"""
+    return Lsms(url, cache=ItemCache.for_server(url),
+                http_cache=HttpCache.for_server(url,
+                                                default_ttl=HTTP_CACHE_TTL),
+                limiter=RateLimiter(REQUEST_RATE, REQUEST_BURST),
+                partial_updates=partial_updates)
+
+
+def create_lsms(server_url, partial_updates=False):
+    """ Returns a Lsms or, for several urls, a MultiLsms object
+
+    See parse_backends for the format of server_url and Lsms for
+    partial_updates.
+    """
+    backends = parse_backends(server_url)
+    if len(backends) == 1:
+        return connect_lsms(backends[0][1], partial_updates)
+    return MultiLsms([Site(name, n, connect_lsms(url, partial_updates))
+                      for n, (name, url) in enumerate(backends)])
+
 
 class MainWindow(QtGui.QMainWindow):
-    def __init__(self, server_url):
+    def __init__(self, server_url, partial_updates=False):
         super(MainWindow, self).__init__()
         self.setGeometry(400, 400, 800, 400)
         self.setWindowTitle("Hamster (lsmsd client)")
 
         self.server_url = server_url
-        self.lsms = Lsms(self.server_url)
-        things = self.lsms.select_all("items")
+        self.partial_updates = partial_updates
+        self.lsms = create_lsms(self.server_url, partial_updates)
+        self.async_lsms = AsyncLsms(self.lsms)
+        self.prefetcher = Prefetcher(self.lsms)
+        self.stats_dialog = None
+
+        # changes are journaled while lsmsd is not reachable
+        self.journal = OperationJournal.for_server(self.server_url)
+        self.offline = False
+        self.replaying = False
+        self.loaded = 0
+        self.replay_timer = QtCore.QTimer(self)
+        self.replay_timer.setInterval(REPLAY_INTERVAL)
+        self.replay_timer.timeout.connect(self.replay_journal)
 
-        self.items_widget = ItemsWidget(things, self)
+        # changes of other clients are polled
+        self.feed = ChangeFeed(self.lsms, "items")
+        self.poll_timer = QtCore.QTimer(self)
+        self.poll_timer.setSingleShot(True)
+        self.poll_timer.timeout.connect(self.poll_changes)
+
+        self.items_widget = ItemsWidget([], self)
         self.setCentralWidget(self.items_widget)
 
+        # users for the owner/maintainer completion, refreshed when stale
+        self.users = UserDirectory(self.lsms)
+        self.items_widget.set_users(self.users)
+        self.users_timer = QtCore.QTimer(self)
+        self.users_timer.setInterval(USERS_CHECK_INTERVAL)
+        self.users_timer.timeout.connect(self.refresh_users)
+        self.users_timer.start()
+
         self.__setup_ui()
+        self.load_things()
+        self.refresh_users()
 
     def __setup_ui(self):
         login_action = QtGui.QAction('Login', self)
@@ -36,10 +112,25 @@ class MainWindow(QtGui.QMainWindow):
         new_user_action = QtGui.QAction('New User', self)
         new_user_action.triggered.connect(self.new_user)
 
+        stats_action = QtGui.QAction('Stats', self)
+        stats_action.triggered.connect(self.show_stats)
+
+        self.offline_action = QtGui.QAction('Offline', self)
+        self.offline_action.setCheckable(True)
+        self.offline_action.toggled.connect(self.offline_toggled)
+
         self.toolbar = self.addToolBar('Bla')
         self.toolbar.addAction(login_action)
         self.toolbar.addAction(config_action)
         self.toolbar.addAction(new_user_action)
+        self.toolbar.addAction(stats_action)
+        self.toolbar.addAction(self.offline_action)
+
+    def show_stats(self):
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(self.lsms, self)
+        self.stats_dialog.show()
+        self.stats_dialog.raise_()
 
     def login_changed(self):
         u, p, ok = LoginDialog.getLoginData(self)
@@ -49,63 +140,406 @@ class MainWindow(QtGui.QMainWindow):
 
     def config_changed(self):
         text, ok = QtGui.QInputDialog.getText(
-            self, 'Backend configuration', 'Server URL')
+            self, 'Backend configuration',
+            'Server URL (several as name=url separated by spaces)',
+            text=self.server_url)
 
-        if ok:
-            log.info("New Server url: '%s'", text.strip())
-            self.server_url = text.strip()
-            self.lsms = Lsms(self.server_url)
+        if not ok:
+            return
+        try:
+            backends = parse_backends(text)
+        except ValueError as e:
+            QtGui.QMessageBox.critical(self, "Invalid configuration", str(e))
+            return
+
+        log.info("New Server url: '%s'", text.strip())
+        self.server_url = text.strip()
+        self.journal = OperationJournal.for_server(self.server_url)
+        if len(backends) == 1 and isinstance(self.lsms, Lsms):
+            url = backends[0][1]
+            self.lsms.set_base_url(url, ItemCache.for_server(url),
+                                   HttpCache.for_server(
+                                       url, default_ttl=HTTP_CACHE_TTL))
+            # the old server may have rejected partial updates
+            self.lsms.partial_updates = self.partial_updates
+            self.feed = ChangeFeed(self.lsms, "items")
+            self.feed.seed(self.items_widget.things())
+            self.set_users(UserDirectory(self.lsms))
+            return
+
+        # the ids of the items change with the number of sites
+        self.prefetcher.stop()
+        self.poll_timer.stop()
+        self.lsms = create_lsms(self.server_url, self.partial_updates)
+        self.async_lsms = AsyncLsms(self.lsms)
+        self.prefetcher = Prefetcher(self.lsms)
+        self.feed = ChangeFeed(self.lsms, "items")
+        if self.stats_dialog is not None:
+            self.stats_dialog.close()
+            self.stats_dialog = None
+        self.items_widget.clear()
+        self.load_things()
+        self.set_users(UserDirectory(self.lsms))
+
+    def set_users(self, directory):
+        self.users = directory
+        self.items_widget.set_users(directory)
+        self.refresh_users()
+
+    def refresh_users(self):
+        """ Fetches the users in the background if they are stale"""
+        if self.offline or not self.users.stale():
+            return
+
+        self.async_lsms.run(
+            self.users.refresh,
+            callback=lambda count: log.info("%d users loaded", count),
+            errback=lambda e: log.warning("Loading users failed: %s", e))
+
+    def load_things(self):
+        self.statusBar().showMessage("Loading items...")
+        self.loaded = 0
+        self.async_lsms.stream("iter_sync", "items",
+                               batch=self.things_received,
+                               callback=self.things_loaded,
+                               errback=self.things_failed)
+
+    def things_received(self, things):
+        self.loaded += len(things)
+        self.items_widget.add_things(things)
+
+    def things_loaded(self, count):
+        self.feed.seed(self.items_widget.things())
+        self.items_widget.apply_operations(self.journal.pending())
+        unreachable = getattr(self.lsms, 'unreachable', None)
+        if unreachable:
+            self.statusBar().showMessage("%d items loaded, not reachable: %s"
+                                         % (count, ", ".join(unreachable)))
+        else:
+            self.statusBar().showMessage("%d items loaded" % count, 5000)
+        if len(self.journal):
+            self.replay_journal()
+        self.schedule_poll()
+
+    def schedule_poll(self):
+        self.poll_timer.start(int(self.feed.delay() * 1000))
+
+    def poll_changes(self):
+        """ Fetches the changes of other clients in the background"""
+        # journaled changes are sent first, they would be overwritten
+        if self.offline or len(self.journal):
+            self.feed.backoff()
+            self.schedule_poll()
+            return
+
+        self.async_lsms.run(self.feed.poll, callback=self.changes_received,
+                            errback=self.poll_failed)
+
+    def changes_received(self, delta):
+        if delta:
+            self.items_widget.apply_changes(delta)
+        self.schedule_poll()
+
+    def poll_failed(self, e):
+        log.warning("Polling changes failed: %s", e)
+        self.feed.backoff()
+        self.schedule_poll()
+
+    def changeEvent(self, event):
+        # poll soon when the user comes back to the window
+        if (event.type() == QtCore.QEvent.ActivationChange and
+                self.isActiveWindow() and self.poll_timer.isActive()):
+            self.feed.activity()
+            self.schedule_poll()
+        super(MainWindow, self).changeEvent(event)
+
+    def things_failed(self, e):
+        log.error(e)
+        if not retryable(e) or self.loaded:
+            self.statusBar().showMessage("Items can not be loaded")
+            return
+
+        # show the last known items until lsmsd is reachable again
+        self.go_offline()
+        self.async_lsms.stream("iter_cached", "items",
+                               batch=self.things_received,
+                               callback=self.things_loaded)
+
+    def go_offline(self):
+        """ Journals all changes until the next successful replay"""
+        if not self.offline:
+            log.warning("lsmsd not reachable, working offline")
+            self.offline_action.setChecked(True)
+        self.replay_timer.start()
+
+    def offline_toggled(self, offline):
+        self.offline = offline
+        if offline:
+            self.statusBar().showMessage("Offline: changes are saved locally")
+        else:
+            self.statusBar().showMessage("Online", 5000)
+            self.replay_journal()
+
+    def replay_journal(self):
+        """ Sends the journaled changes to lsmsd in the background"""
+        if self.replaying or not len(self.journal):
+            return
+        if self.offline and not self.replay_timer.isActive():
+            # offline was chosen by the user
+            return
+
+        self.replaying = True
+        self.async_lsms.run(self.journal.replay, self.lsms,
+                            callback=self.journal_replayed,
+                            errback=self.journal_replay_failed)
+
+    def journal_replayed(self, result):
+        id_map, rejected = result
+        self.replaying = False
+        self.items_widget.ids_replaced(id_map)
+
+        if rejected:
+            QtGui.QMessageBox.warning(
+                self, "Changes rejected",
+                "%d offline changes were rejected by the server:\n%s" % (
+                    len(rejected), "\n".join(str(r.error) for r in rejected)))
+
+        if len(self.journal):
+            self.go_offline()
+            return
+
+        self.replay_timer.stop()
+        self.offline_action.setChecked(False)
+
+    def journal_replay_failed(self, e):
+        log.error("Replay failed: %s", e)
+        self.replaying = False
+        self.go_offline()
+
+    def pending_create(self, _id):
+        """ Returns if _id is the temporary id of a journaled create"""
+        return isinstance(_id, int) and _id < 0
+
+    def journaled(self, e, idempotent=True):
+        """ Returns if the failed call e was journaled for a later replay
+
+        Calls which are not idempotent (creates) are only journaled if
+        they never reached lsmsd, replaying them could do them twice.
+        """
+        return self.offline or (retryable(e) and (idempotent or never_sent(e)))
 
     def new_user(self):
         u, m, p, ok = NewUserDialog.getUserData(self)
 
         if ok:
-            try:
-                payload = {'Name': u, 'EMail': m, 'Password': p}
-                log.info("User created: %s", self.lsms.create_thing("users", payload))
-            except LsmsException as e:
-                #log.error(e)
-                if e.status_code == 403:
-                    QtGui.QMessageBox.critical(self, "User can not be created",
-                                               "The given username already exists")
-
-    def create_thing(self, payload):
+            payload = {'Name': u, 'EMail': m, 'Password': p}
+            self.async_lsms.create_thing(
+                "users", payload,
+                callback=self.user_created,
+                errback=self.new_user_failed)
+
+    def user_created(self, name):
+        log.info("User created: %s", name)
+        self.users.expire()
+        self.refresh_users()
+
+    def new_user_failed(self, e):
+        #log.error(e)
+        if isinstance(e, LsmsException) and e.status_code == 403:
+            QtGui.QMessageBox.critical(self, "User can not be created",
+                                       "The given username already exists")
+
+    def create_thing(self, payload, callback):
+        """ Creates a thing and passes its id to callback when done
+
+        While offline the thing gets a negative temporary id, which is
+        replaced after the journal is replayed.
+        """
+        if self.offline:
+            callback(self.journal.append('create', "items", payload))
+            return
+
         log.info("Creating thing in database")
-        try:
-            return int(self.lsms.create_thing("items", payload))
-        except LsmsException as e:
-            if e.status_code == 401:
-                log.warning(e)
-                QtGui.QMessageBox.critical(self, "Thing can not be created",
-                                           "Username or password incorrect")
+        self.async_lsms.create_thing(
+            "items", payload,
+            callback=lambda _id: callback(int(_id)),
+            errback=lambda e: self.create_thing_failed(e, payload, callback))
+
+    def refresh_thing(self, _id, callback):
+        """ Fetches the current data of a item and passes it to callback"""
+        if self.offline or self.pending_create(_id):
+            return
 
-        return None
+        self.async_lsms.select_thing(
+            "items", _id, callback=callback,
+            errback=lambda e: log.debug("Refreshing %s failed: %s", _id, e))
 
+    def sync_history(self, _id, callback):
+        """ Fetches the new log entries of a item into the cache
 
-def test(base_url):
-    app = QtGui.QApplication(sys.argv)
+        callback is called with the number of new entries.
+        """
+        if self.offline:
+            return
 
-    w = MainWindow(base_url)
+        self.async_lsms.sync_thing_log(
+            "items", _id, callback=callback,
+            errback=lambda e: log.debug("Loading log of %s failed: %s", _id, e))
+
+    def prefetch(self, ids):
+        """ Loads items in the background which are likely shown next"""
+        if self.offline:
+            return
+        self.prefetcher.prefetch(
+            "items", [_id for _id in ids if not self.pending_create(_id)])
+
+    def export_labels(self, things, path):
+        """ Renders the labels of things into path in the background"""
+        self.statusBar().showMessage("Rendering %d labels..." % len(things))
+        self.async_lsms.run(
+            iter_labels, things, path,
+            batch=lambda sheets: self.statusBar().showMessage(
+                "Labels: sheet %d of %d written" % (sheets[-1][0] + 1,
+                                                    sheets[-1][1])),
+            batch_size=1,
+            callback=lambda count: self.statusBar().showMessage(
+                "Labels written to %s" % path, 5000),
+            errback=self.export_labels_failed)
+
+    def export_labels_failed(self, e):
+        log.error("Rendering labels failed: %s", e)
+        QtGui.QMessageBox.critical(self, "Labels can not be written", str(e))
+
+    def save_thing(self, record):
+        """ Sends the changed fields of a item record to lsmsd"""
+        if self.offline or self.pending_create(record['Id']):
+            self.journal.append('update', "items", record)
+            record.mark_clean()
+            return
+
+        # edits made while the request runs must stay unsaved
+        self.async_lsms.save_thing(
+            "items", record, record.values(),
+            callback=lambda changed: log.info("Thing %s saved: %s",
+                                              record['Id'], changed),
+            errback=lambda e: self.save_thing_failed(e, record))
+
+    def delete_thing(self, _id):
+        """ Deletes a item on lsmsd"""
+        if self.offline or self.pending_create(_id):
+            self.journal.append('delete', "items", _id=_id)
+            return
+
+        self.async_lsms.delete_thing(
+            "items", _id,
+            callback=lambda _: log.info("Thing %s deleted", _id),
+            errback=lambda e: self.delete_thing_failed(e, _id))
+
+    def save_thing_failed(self, e, record):
+        if self.journaled(e):
+            self.go_offline()
+            self.journal.append('update', "items", record)
+            record.mark_clean()
+        elif isinstance(e, LsmsException) and e.status_code == 401:
+            log.warning(e)
+            QtGui.QMessageBox.critical(self, "Thing can not be saved",
+                                       "Username or password incorrect")
+        else:
+            log.error(e)
+
+    def create_thing_failed(self, e, payload, callback):
+        if self.journaled(e, idempotent=False):
+            self.go_offline()
+            callback(self.journal.append('create', "items", payload))
+        elif isinstance(e, LsmsException) and e.status_code == 401:
+            log.warning(e)
+            QtGui.QMessageBox.critical(self, "Thing can not be created",
+                                       "Username or password incorrect")
+        elif retryable(e):
+            log.warning(e)
+            QtGui.QMessageBox.warning(self, "Thing may not be created",
+                                      "The connection to lsmsd failed while "
+                                      "creating the thing. Reload to check "
+                                      "if it was created before trying "
+                                      "again.")
+        else:
+            log.error(e)
+
+    def delete_thing_failed(self, e, _id):
+        if self.journaled(e):
+            self.go_offline()
+            self.journal.append('delete', "items", _id=_id)
+        elif isinstance(e, LsmsException) and e.status_code == 401:
+            log.warning(e)
+            QtGui.QMessageBox.critical(self, "Thing can not be deleted",
+                                       "Username or password incorrect")
+        else:
+            log.error(e)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="main.py",
+                                     description="Hamster (lsmsd client)")
+    parser.add_argument("url", nargs="?", default=DEFAULT_URL,
+                        help="url of lsmsd, several as 'name=url name=url' "
+                             "(default: %(default)s)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="profile the session and write the result to FILE")
+    parser.add_argument("--profiler", choices=PROFILERS, default="cprofile",
+                        help="cprofile writes pstats, sample writes collapsed "
+                             "stacks for flame graphs (default: %(default)s)")
+    parser.add_argument("--stall-threshold", type=int, metavar="MS",
+                        default=int(STALL_THRESHOLD * 1000),
+                        help="log the stack when the gui is blocked longer "
+                             "(0 disables, default: %(default)s)")
+    parser.add_argument("--partial-updates", action="store_true",
+                        default=bool(os.environ.get('HAMSTER_PARTIAL_UPDATES')),
+                        help="send only the changed fields of edited items, "
+                             "for lsmsd versions keeping the missing fields "
+                             "(default: from HAMSTER_PARTIAL_UPDATES)")
+    # unknown arguments are left to Qt and QtVariant (e.g. --pyside)
+    return parser.parse_known_args(argv)
+
+
+def test(base_url, stall_threshold=0, qt_args=(), partial_updates=False):
+    app = QtGui.QApplication([sys.argv[0]] + list(qt_args))
+
+    w = MainWindow(base_url, partial_updates)
     w.show()
 
-    #w = ItemsWidget()
-    #w.resize(800, 400)
-    #w.show()
+    watchdog = None
+    if stall_threshold:
+        # the timer does not fire while the event loop is blocked
+        watchdog = StallWatchdog(stall_threshold / 1000.0).start()
+        heartbeat = QtCore.QTimer(w)
+        heartbeat.timeout.connect(watchdog.beat)
+        heartbeat.start(max(stall_threshold // 4, 10))
 
-    sys.exit(app.exec_())
+    try:
+        return app.exec_()
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+            if watchdog.stalls:
+                log.warning("Gui blocked %d times, longest %.0fms",
+                            len(watchdog.stalls), 1000 * max(
+                                s.duration for s in watchdog.stalls))
 
 if __name__ == '__main__':
     import signal
 
-    base_url = "http://localhost:8080/"
+    args, qt_args = parse_args(sys.argv[1:])
 
     logging.basicConfig(level=logging.DEBUG)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    #import cProfile
-    #stats_file = "stats.prof"
-    #cProfile.run("test()", stats_file)
-
-    test(base_url)
+    if args.profile:
+        code = profile_call(args.profile, args.profiler, test, args.url,
+                            args.stall_threshold, qt_args,
+                            args.partial_updates)
+    else:
+        code = test(args.url, args.stall_threshold, qt_args,
+                    args.partial_updates)
 
     print("done")
+    sys.exit(code)